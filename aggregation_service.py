@@ -0,0 +1,372 @@
+"""
+An asyncio service that merges partial statistics pushed by many producers. Producers connect over TCP or a Unix
+socket and push serialized statistics (see AbstractGroupStatistic.to_bytes) under a string key; the server queues the
+partials of each key and a merge worker per key tree-reduces whatever has queued up and merges the batch into the
+key's current statistic with |. The decoding and merging run in an executor thread while queries read the current
+statistic directly, so they never wait behind ingestion.
+
+Every message is a frame: a little-endian uint32 body length, a one byte opcode and the body. Requests are PUSH (key
+and statistic, not acknowledged), QUERY (key) and FLUSH (empty); replies are OK (with the statistic, for a query),
+NONE (no statistic under the key) and ERROR (a UTF-8 message). Backpressure comes from the bounded per-key queues:
+while a key's queue is full the server stops reading from the connections pushing to it, so their writes block once
+the socket buffers fill up.
+
+Run a server with: python -m aggregation_service [--host 127.0.0.1] [--port 8765] [--unix PATH]
+"""
+import argparse
+import asyncio
+import struct
+import sys
+
+import serialization
+from algebraic_statistic import AbstractGroupStatistic
+from fitting import tree_reduce
+# Imported so that the statistic classes they define are registered for decoding
+import conjugate_density  # noqa: F401
+import density_model  # noqa: F401
+import mixture_model  # noqa: F401
+import naive_bayes  # noqa: F401
+
+PUSH, QUERY, FLUSH = b'P', b'Q', b'F'
+OK, NONE, ERROR = b'O', b'N', b'E'
+
+MAX_FRAME_SIZE = 1 << 28
+_FRAME_HEADER = struct.Struct('<Ic')
+
+
+class AggregationError(Exception):
+    pass
+
+
+def pack_frame(opcode, body=b''):
+    return _FRAME_HEADER.pack(len(body), opcode) + body
+
+
+async def read_frame(reader):
+    """
+    Returns the (opcode, body) of the next frame, or None at the end of the stream.
+    """
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise AggregationError('Connection closed in the middle of a frame')
+        return None
+    length, opcode = _FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise AggregationError('Frame of {0} bytes exceeds MAX_FRAME_SIZE'.format(length))
+    return opcode, await reader.readexactly(length)
+
+
+class _Connection(object):
+    """
+    The per-connection state shared with the merge workers: the keys pushed to since the last FLUSH and the error
+    messages of the partials that could not be merged.
+    """
+    def __init__(self):
+        self.pending_keys = set()
+        self.errors = []
+
+
+class _KeyState(object):
+    def __init__(self, max_queue_size):
+        self.queue = asyncio.Queue(max_queue_size)
+        self.statistic = None
+        self.encoded = None
+        self.worker = None
+
+
+class AggregationServer(object):
+    """
+    Merges the partials pushed under each key. At most max_queue_size partials wait per key and a merge worker takes
+    up to max_batch_size of them at a time. The merged statistic of a key is replaced, never changed in place, so a
+    query always serializes a consistent snapshot.
+    """
+    def __init__(self, max_queue_size=1024, max_batch_size=256):
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self.keys = {}
+        self.stats = {'pushed': 0, 'merged': 0, 'rejected': 0, 'batches': 0, 'queries': 0}
+        self._server = None
+        self._handlers = set()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """
+        Listens on a Unix socket at path if given, otherwise on host and port (0 picks a free port). Returns the
+        bound address.
+        """
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+        return self.get_address()
+
+    def get_address(self):
+        return self._server.sockets[0].getsockname()
+
+    def get_stats(self):
+        """
+        Counters of pushed, merged and rejected partials, merge batches and queries.
+        """
+        return dict(self.stats)
+
+    def get_statistic(self, key):
+        """
+        The current merged statistic under key, or None.
+        """
+        state = self.keys.get(key)
+        return None if state is None else state.statistic
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+        tasks = list(self._handlers) + [state.worker for state in self.keys.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    def _key_state(self, key):
+        state = self.keys.get(key)
+        if state is None:
+            state = self.keys[key] = _KeyState(self.max_queue_size)
+            state.worker = asyncio.ensure_future(self._merge_worker(state))
+        return state
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        connection = _Connection()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                opcode, body = frame
+                if opcode == PUSH:
+                    key, offset = serialization.unpack_string(body, 0)
+                    connection.pending_keys.add(key)
+                    self.stats['pushed'] += 1
+                    # Blocks while the key's queue is full, which stops reading from this connection
+                    await self._key_state(key).queue.put((memoryview(body)[offset:], connection))
+                    # Frames already buffered are read without suspending, so yield to let the other connections
+                    # and the queries in
+                    await asyncio.sleep(0)
+                elif opcode == QUERY:
+                    writer.write(self._query(serialization.unpack_string(body, 0)[0]))
+                elif opcode == FLUSH:
+                    writer.write(await self._flush(connection))
+                else:
+                    writer.write(pack_frame(ERROR, 'Unknown opcode {0!r}'.format(opcode).encode('utf-8')))
+                    break
+                await writer.drain()
+        except (AggregationError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by close(); the connection simply ends
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def _query(self, key):
+        self.stats['queries'] += 1
+        state = self.keys.get(key)
+        if state is None or state.statistic is None:
+            return pack_frame(NONE)
+        if state.encoded is None:
+            state.encoded = pack_frame(OK, state.statistic.to_bytes())
+        return state.encoded
+
+    async def _flush(self, connection):
+        # A marker queued behind the connection's partials completes once they have all been merged, and fails if
+        # the key's merge worker has stopped
+        markers = []
+        for key in connection.pending_keys:
+            state = self.keys[key]
+            marker = asyncio.get_running_loop().create_future()
+            if not state.worker.done():
+                await state.queue.put((marker, None))
+            if state.worker.done() and not marker.done():
+                marker.set_exception(AggregationError('the merge worker of {0!r} has stopped'.format(key)))
+            markers.append(marker)
+        connection.pending_keys.clear()
+        for result in await asyncio.gather(*markers, return_exceptions=True):
+            if isinstance(result, AggregationError):
+                connection.errors.append(str(result))
+        errors, connection.errors = connection.errors, []
+        if errors:
+            message = '{0} partials were rejected; first error: {1}'.format(len(errors), errors[0])
+            return pack_frame(ERROR, message.encode('utf-8'))
+        return pack_frame(OK)
+
+    @staticmethod
+    def _decode(payload, expected_cls):
+        try:
+            statistic = AbstractGroupStatistic.from_bytes(payload)
+        except Exception as e:
+            raise ValueError('cannot decode partial: {0}'.format(e))
+        if expected_cls is not None and type(statistic) is not expected_cls:
+            raise ValueError('cannot merge {0} into {1}'.format(type(statistic).__name__, expected_cls.__name__))
+        return statistic
+
+    @classmethod
+    def _reduce(cls, statistic, partials):
+        """
+        Decodes the (payload, connection) partials and merges them into statistic, which may be None. Runs in an
+        executor thread, so it only reads its arguments: returns the merged statistic, the number of partials merged
+        and the (connection, error message) of every rejected partial.
+        """
+        expected_cls = None if statistic is None else type(statistic)
+        decoded, rejections = [], []
+        for payload, connection in partials:
+            try:
+                decoded.append((cls._decode(payload, expected_cls), connection))
+            except ValueError as e:
+                rejections.append((connection, str(e)))
+                continue
+            expected_cls = type(decoded[-1][0])
+        if not decoded:
+            return statistic, 0, rejections
+        try:
+            reduced = tree_reduce([partial for partial, _ in decoded])
+            return (reduced if statistic is None else statistic | reduced), len(decoded), rejections
+        except Exception:
+            # Partials of the same class can still be incompatible, e.g. Covariances of different dimensions; merge
+            # them one at a time so that only the offending ones are rejected
+            merged, merged_count = statistic, 0
+            for partial, connection in decoded:
+                try:
+                    merged = partial if merged is None else merged | partial
+                    merged_count += 1
+                except Exception as e:
+                    rejections.append((connection, 'cannot merge {0}: {1}'.format(type(partial).__name__, e)))
+            return merged, merged_count, rejections
+
+    async def _merge(self, state, partials):
+        # Decoding and merging run in a thread, so that queries and the other keys are served meanwhile; only this
+        # key's worker replaces state.statistic, so the snapshot passed to the thread is still current afterwards
+        merged, merged_count, rejections = await asyncio.get_running_loop().run_in_executor(
+            None, self._reduce, state.statistic, partials)
+        for connection, message in rejections:
+            connection.errors.append(message)
+        self.stats['rejected'] += len(rejections)
+        if merged_count:
+            state.statistic = merged
+            state.encoded = None
+            self.stats['merged'] += merged_count
+            self.stats['batches'] += 1
+
+    async def _merge_worker(self, state):
+        markers = []
+        try:
+            while True:
+                batch = [await state.queue.get()]
+                while len(batch) < self.max_batch_size and not state.queue.empty():
+                    batch.append(state.queue.get_nowait())
+                markers = [payload for payload, connection in batch if connection is None]
+                partials = [(payload, connection) for payload, connection in batch if connection is not None]
+                if partials:
+                    await self._merge(state, partials)
+                for marker in markers:
+                    marker.set_result(None)
+                markers = []
+                # Queue.get does not yield while items are waiting, so let the connections and queries run
+                await asyncio.sleep(0)
+        finally:
+            # However the worker stops, no flush may wait on it forever
+            while not state.queue.empty():
+                payload, connection = state.queue.get_nowait()
+                if connection is None:
+                    markers.append(payload)
+            for marker in markers:
+                if not marker.done():
+                    marker.set_exception(AggregationError('the merge worker of the key has stopped'))
+
+
+class AggregationClient(object):
+    """
+    A connection to an AggregationServer. push only waits for the socket buffer, so a producer can stream partials;
+    flush waits until the server has merged everything this client pushed and raises AggregationError if any
+    partial was rejected. Requests on one client are serialized.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=None, path=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def push(self, key, statistic):
+        """
+        Sends a statistic, or its to_bytes encoding, to be merged under key.
+        """
+        if isinstance(statistic, AbstractGroupStatistic):
+            statistic = statistic.to_bytes()
+        async with self._lock:
+            self.writer.write(pack_frame(PUSH, serialization.pack_string(key) + bytes(statistic)))
+            await self.writer.drain()
+
+    async def query(self, key):
+        """
+        The statistic currently merged under key, or None. Partials still queued on the server are not included;
+        flush first to read this client's own pushes.
+        """
+        opcode, body = await self._request(QUERY, serialization.pack_string(key))
+        return AbstractGroupStatistic.from_bytes(body) if opcode == OK else None
+
+    async def flush(self):
+        await self._request(FLUSH)
+
+    async def _request(self, opcode, body=b''):
+        async with self._lock:
+            self.writer.write(pack_frame(opcode, body))
+            await self.writer.drain()
+            reply = await read_frame(self.reader)
+        if reply is None:
+            raise AggregationError('Connection closed by the server')
+        if reply[0] == ERROR:
+            raise AggregationError(reply[1].decode('utf-8'))
+        return reply
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve(host='127.0.0.1', port=8765, path=None, max_queue_size=1024, max_batch_size=256):
+    server = AggregationServer(max_queue_size, max_batch_size)
+    address = await server.start(host, port, path)
+    print('listening on {0}'.format(address if path is None else path), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a statistic aggregation server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='0 picks a free port')
+    parser.add_argument('--unix', help='listen on a Unix socket at this path instead of TCP')
+    parser.add_argument('--max-queue-size', type=int, default=1024)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.max_queue_size, args.max_batch_size))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,145 @@
 from collections import Counter
-import copy
+import functools
+import hashlib
+import numbers
+import threading
+import time
+
+import numpy as np
+
+import serialization
+
+# Every statistic class, keyed by the name written in serialized headers ('module:qualname', see _class_name), and
+# by bare qualname for headers whose module does not match, such as ones written before the module was recorded
+_STATISTIC_CLASSES_BY_NAME = {}
+_STATISTIC_CLASSES_BY_QUALNAME = {}
+# The registry recording instrumentation metrics while it is enabled, and the classes whose methods are wrapped
+_instrumentation_registry = None
+_instrumented_classes = []
+
+
+def _as_array(data):
+    """
+    Returns data as a NumPy array if it is an ndarray or exposes the buffer protocol, so that it can take the
+    vectorized construction path. Anything else (lists, tuples, generators) returns None.
+    """
+    if isinstance(data, np.ndarray):
+        return data
+    if isinstance(data, (bytes, bytearray, str)):
+        return None
+    try:
+        memoryview(data)
+    except TypeError:
+        return None
+    return np.asarray(data)
+
+
+def _group_sums(group_index, values, n_groups):
+    """
+    Segmented sum of values (1-D, or 2-D with one row per observation) over the groups in group_index.
+    """
+    if values.ndim == 1:
+        return np.bincount(group_index, weights=values, minlength=n_groups)
+    columns = values.reshape(values.shape[0], -1)
+    sums = np.column_stack([np.bincount(group_index, weights=columns[:, j], minlength=n_groups)
+                            for j in range(columns.shape[1])])
+    return sums.reshape((n_groups,) + values.shape[1:])
+
+
+def _as_weights(weights, n):
+    """
+    Returns the observation weights as a 1-D NumPy array, checking that there is one per observation.
+    """
+    weights = np.asarray(weights)
+    if weights.shape != (n,):
+        raise ValueError('Expected one weight per observation ({0}), got weights of shape {1}'.format(
+            n, weights.shape))
+    return weights
+
+
+def _weighted(values, weights):
+    "Scales each observation (row) of values by its weight."
+    return values * weights.reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+def _group_moments(group_index, values, n_groups, weights=None):
+    """
+    Returns the count (the total weight, if weights are given) and mean of every group, with a mean of 0 for empty
+    groups.
+    """
+    if weights is None:
+        n = np.bincount(group_index, minlength=n_groups)
+        sums = _group_sums(group_index, values, n_groups)
+    else:
+        weights = _as_weights(weights, len(values))
+        n = np.bincount(group_index, weights=weights, minlength=n_groups)
+        sums = _group_sums(group_index, _weighted(values, weights), n_groups)
+    divisor = np.where(n != 0, n, 1).reshape((n_groups,) + (1,) * (values.ndim - 1))
+    return n, sums / divisor
+
+
+def _neumaier_add(total, compensation, value):
+    """
+    One step of Neumaier's compensated summation: returns the new total and the accumulated rounding error, which
+    should be added back to the total when it is read.
+    """
+    t = total + value
+    if abs(total) >= abs(value):
+        compensation += (total - t) + value
+    else:
+        compensation += (value - t) + total
+    return t, compensation
+
+
+def _to_scalar(value):
+    "Collapses 0-d NumPy results to Python floats so 1-D input yields the same kind of value as the list path."
+    if isinstance(value, np.ndarray) and value.ndim == 0:
+        return float(value)
+    if isinstance(value, np.generic):
+        return float(value)
+    return value
+
+
+def _to_count(value):
+    "Converts a NumPy count or total weight to a Python int or float."
+    return value.item() if isinstance(value, np.generic) else value
+
+def _class_name(cls):
+    return '{0}:{1}'.format(cls.__module__, cls.__qualname__)
+
+
+def _statistic_class(name):
+    """
+    The statistic class written as name by _class_name. When no class is registered under exactly that name, e.g.
+    because the module was imported under another path, a class with the same qualname is used if it is the only one.
+    """
+    statistic_cls = _STATISTIC_CLASSES_BY_NAME.get(name)
+    if statistic_cls is not None:
+        return statistic_cls
+    candidates = _STATISTIC_CLASSES_BY_QUALNAME.get(name.rpartition(':')[2], {})
+    if len(candidates) == 1:
+        return list(candidates.values())[0]
+    if candidates:
+        raise ValueError('Cannot decode a {0}: it matches the classes of modules {1}'.format(
+            name, ', '.join(sorted(candidates))))
+    raise ValueError('Cannot decode a {0}: no such statistic class'.format(name))
+
 
 class AbstractGroupStatistic(object):
+    __slots__ = ()
+
+    # (attribute, statistic class) pairs for sub-statistics that this statistic keeps up to date as part of its own
+    # state. A composite which declares both shares the attribute instead of computing the sub-statistic again.
+    PROVIDES = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # A class defined again under the same module and qualname, e.g. by a reload, replaces the old one
+        _STATISTIC_CLASSES_BY_NAME[_class_name(cls)] = cls
+        _STATISTIC_CLASSES_BY_QUALNAME.setdefault(cls.__qualname__, {})[cls.__module__] = cls
+        if _instrumentation_registry is not None:
+            _instrument_class(cls, _instrumentation_registry)
+
     def __init__(self, data=None):
         """
         The statistic should be calculated and saved to the object's state here.
@@ -31,15 +169,150 @@ class AbstractGroupStatistic(object):
     def __sub__(self, other):
         return self | -other
 
+    @classmethod
+    def is_invertible(cls):
+        """
+        True if the statistic forms a group rather than only a monoid, i.e. it implements __neg__.
+        """
+        return cls.__neg__ is not AbstractGroupStatistic.__neg__
+
+    def _merge_sizes(self, other):
+        """
+        Sizes of the two operands of a merge, recorded by the instrumentation layer, or None if not meaningful.
+        """
+        return None
+
+    def _depth(self):
+        return 0
+
+    def update(self, x):
+        """
+        Adds the single observation x in place and returns self. The default merges in a statistic built from [x];
+        subclasses override it with an O(1) update.
+        """
+        return self.__ior__(self.__class__([x]))
+
+    def __ior__(self, other):
+        """
+        In-place version of |. Subclasses override this to merge into their own state instead of allocating a new
+        object.
+        """
+        return self | other
+
+    def __isub__(self, other):
+        return self.__ior__(-other)
+
+    def to_bytes(self):
+        """
+        Serializes the statistic to the compact, versioned binary format described in the serialization module.
+        """
+        return serialization.pack_header(_class_name(type(self))) + self._pack_payload()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Decodes a statistic written by to_bytes. Called on a base class, it returns whichever subclass was encoded.
+        """
+        name, offset = serialization.unpack_header(data)
+        statistic_cls = _statistic_class(name)
+        if not issubclass(statistic_cls, cls):
+            raise ValueError('Cannot decode a {0} as a {1}'.format(name, cls.__name__))
+        return statistic_cls._unpack_payload(data, offset)[0]
+
+    def _pack_payload(self):
+        raise NotImplementedError
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        """
+        Returns the decoded statistic and the offset just past its payload.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_columns(cls, data):
+        """
+        Builds one statistic per column of a 2-D array.
+        """
+        data = np.asarray(data)
+        return [cls(data[:, j]) for j in range(data.shape[1])]
+
+    @classmethod
+    def fit_groups(cls, group_index, values, n_groups, weights=None):
+        """
+        Fits one statistic per group, where group_index[i] in range(n_groups) is the group of values[i] (with weight
+        weights[i], if given). Returns a list of n_groups statistics. By default the values are sorted by group once
+        and each segment is fitted; subclasses override this with segmented reductions.
+        """
+        values = np.asarray(values)
+        order = np.argsort(group_index, kind='stable')
+        boundaries = np.searchsorted(group_index[order], np.arange(1, n_groups))
+        segments = np.split(values[order], boundaries)
+        if weights is None:
+            return [cls(segment) if len(segment) else cls() for segment in segments]
+        weight_segments = np.split(_as_weights(weights, len(values))[order], boundaries)
+        return [cls(segment, weights=w) if len(segment) else cls() for segment, w in zip(segments, weight_segments)]
+
 class Mean(AbstractGroupStatistic):
-    def __init__(self, data=None):
+    __slots__ = ('n', 'mean')
+
+    def __init__(self, data=None, weights=None):
+        """
+        With weights, observation i counts weights[i] times: n is the total weight and mean the weighted mean.
+        """
         if data is None:
             self.n = 0
             self.mean = 0
+            return
+        if weights is not None:
+            self.n, self.mean = self._moments_from_array(np.asarray(data, dtype=np.float64), weights)
+            return
+        array = _as_array(data)
+        if array is not None:
+            self.n, self.mean = self._moments_from_array(array)
         else:
             self.n = len(data)
             self.mean = 1.0*sum(data) / len(data)
 
+    @staticmethod
+    def _moments_from_array(array, weights=None):
+        if weights is not None:
+            weights = _as_weights(weights, array.shape[0])
+            n = _to_count(weights.sum())
+            if n == 0:
+                return 0, 0
+            return n, _to_scalar(np.tensordot(weights, array, axes=1) / n)
+        n = array.shape[0]
+        if n == 0:
+            return 0, 0
+        return n, _to_scalar(array.mean(axis=0, dtype=np.float64))
+
+    @classmethod
+    def from_columns(cls, data):
+        data = np.asarray(data)
+        n, means = cls._moments_from_array(data)
+        result = []
+        for j in range(data.shape[1]):
+            m = cls()
+            if n:
+                m.set_n(n)
+                m.set_mean(float(means[j]))
+            result.append(m)
+        return result
+
+    @classmethod
+    def fit_groups(cls, group_index, values, n_groups, weights=None):
+        n, means = _group_moments(group_index, np.asarray(values), n_groups, weights)
+        return [cls._from_moments(n[g], means[g]) for g in range(n_groups)]
+
+    @classmethod
+    def _from_moments(cls, n, mean):
+        m = cls()
+        if n:
+            m.set_n(_to_count(n))
+            m.set_mean(_to_scalar(mean))
+        return m
+
     def get_mean(self):
         return self.mean
 
@@ -52,6 +325,9 @@ class Mean(AbstractGroupStatistic):
     def set_n(self, new_n):
         self.n = new_n
 
+    def is_identity(self):
+        return self.n == 0
+
     def __or__(self, other):
         merged_m = Mean()
         merged_n = self.get_n() + other.get_n()
@@ -62,8 +338,27 @@ class Mean(AbstractGroupStatistic):
         merged_m.set_mean(merged_mean_val)
         return merged_m
 
+    def update(self, x):
+        return self._merge_in_place(1, x)
+
+    def __ior__(self, other):
+        return self._merge_in_place(other.get_n(), other.get_mean())
+
+    def __isub__(self, other):
+        return self._merge_in_place(-other.get_n(), other.get_mean())
+
+    def _merge_in_place(self, other_n, other_mean):
+        merged_n = self.n + other_n
+        if merged_n == 0: # Handle subtracting all elements
+            self.n = 0
+            self.mean = 0
+            return self
+        self.mean = 1.0/merged_n * (self.n * self.mean + other_n * other_mean)
+        self.n = merged_n
+        return self
+
     def __eq__(self, other):
-        return self.n == other.n and self.mean == other.mean
+        return self.n == other.n and np.array_equal(self.mean, other.mean)
 
     def __neg__(self):
         new_mean = Mean()
@@ -71,16 +366,52 @@ class Mean(AbstractGroupStatistic):
         new_mean.set_n(-self.get_n())
         return new_mean
 
+    def _pack_payload(self):
+        return serialization.pack_number(self.n) + serialization.pack_number(self.mean)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        m = cls()
+        m.n, offset = serialization.unpack_number(buffer, offset)
+        m.mean, offset = serialization.unpack_number(buffer, offset)
+        return m, offset
+
 class Frequency(AbstractGroupStatistic):
     """
     Keeps track of the count of each object observed in the data so far. You can think of this as the
     collections.Counter class endowed with the algebraic properties of a group.
     """
-    def __init__(self, data=None):
+    __slots__ = ('counter',)
+
+    def __init__(self, data=None, weights=None):
+        """
+        With weights, each object is counted with the total weight of its observations, e.g. Frequency(values,
+        weights=counts) fits a (value, count) histogram directly. Objects whose total weight is not positive are
+        dropped, as in merges.
+        """
         if data is None:
             self.counter = Counter()
-        else:
+        elif weights is None:
             self.counter = Counter(data)
+        else:
+            self.counter = self._weighted_counter(data, weights)
+
+    @staticmethod
+    def _weighted_counter(data, weights):
+        array = _as_array(data)
+        if array is not None:
+            weights = _as_weights(weights, len(array))
+            keys, inverse = np.unique(array, return_inverse=True)
+            totals = np.bincount(inverse.reshape(-1), weights=weights, minlength=len(keys))
+            if weights.dtype.kind in 'iub':
+                totals = totals.astype(np.int64)
+            counter = Counter(dict(zip(keys.tolist(), totals.tolist())))
+        else:
+            data = list(data)
+            counter = Counter()
+            for key, weight in zip(data, _as_weights(weights, len(data)).tolist()):
+                counter[key] += weight
+        return Counter({key: total for key, total in counter.items() if total > 0})
 
     def get_counter(self):
         return self.counter
@@ -88,12 +419,18 @@ class Frequency(AbstractGroupStatistic):
     def set_counter(self, new_counter):
         self.counter = new_counter
 
+    def _merge_sizes(self, other):
+        return len(self.counter), len(other.counter)
+
     def get_frequency(self, obj):
         if obj in self.counter:
             return self.counter[obj]
         else:
             return 0
 
+    def __eq__(self, other):
+        return dict(self.counter) == dict(other.counter)
+
     def __or__(self, other):
         self_ctr = self.get_counter()
         other_ctr = other.get_counter()
@@ -104,21 +441,420 @@ class Frequency(AbstractGroupStatistic):
         result.set_counter(merged_counter)
         return result
 
+    def __ior__(self, other):
+        self_ctr = self.get_counter()
+        other_ctr = other.get_counter()
+        if len(other_ctr) > len(self_ctr) and min(other_ctr.values()) > 0:
+            # Copying the larger counter is a single C-level dict copy; only the smaller one is walked in Python.
+            # The copy skips the filtering of _add_counts, so it is only taken when every count is positive.
+            self_ctr, other_ctr = dict(other_ctr), self_ctr
+        self.counter = self._add_counts(self_ctr, other_ctr, 1)
+        return self
+
+    def __isub__(self, other):
+        self.counter = self._add_counts(self.get_counter(), other.get_counter(), -1)
+        return self
+
+    def is_identity(self):
+        return not self.counter
+
+    def update(self, x):
+        self._add_counts(self.counter, {x: 1}, 1)
+        return self
+
+    @staticmethod
+    def _add_counts(counter, update, sign):
+        if update is counter:
+            update = dict(update)
+        for k, v in update.items():
+            total = counter.get(k, 0) + sign * v
+            if total > 0:
+                counter[k] = total
+            elif k in counter:
+                del counter[k]
+        return counter
+
     def __neg__(self):
-        neg_ctr = copy.deepcopy(self.get_counter())
-        for k in neg_ctr.keys():
-            neg_ctr[k] = -neg_ctr[k]
+        neg_ctr = {k: -v for k, v in self.get_counter().items()}
         result = Frequency()
         result.set_counter(neg_ctr)
         return result
 
+    def _pack_payload(self):
+        counter = self.get_counter()
+        return serialization.pack_keys(counter.keys()) + serialization.pack_array(list(counter.values()))
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        keys, offset = serialization.unpack_keys(buffer, offset)
+        counts, offset = serialization.unpack_array(buffer, offset)
+        result = cls()
+        result.set_counter(Counter(dict(zip(keys, counts.tolist()))))
+        return result, offset
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(x):
+    # The splitmix64 finalizer, on a Python int or elementwise on a uint64 array (where the products wrap)
+    if isinstance(x, np.ndarray):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & _MASK64
+    return x ^ (x >> 31)
+
+
+def _stable_hash(obj):
+    """
+    A 64-bit hash of obj that, unlike hash(), is the same in every process, so sketches built by different workers
+    can be merged. Numbers that compare equal hash equally, as they do as Frequency keys, and numbers that fit in an
+    int64 (and other floats) hash as _numeric_hashes hashes them in arrays.
+    """
+    if isinstance(obj, numbers.Integral) or (isinstance(obj, numbers.Real) and float(obj).is_integer()):
+        value = int(obj)
+        if -(1 << 63) <= value < (1 << 63):
+            return _mix64(value & _MASK64)
+        encoded = b'i' + str(value).encode('ascii')
+    elif isinstance(obj, numbers.Real):
+        return _mix64(int(np.float64(obj).view(np.uint64)))
+    elif isinstance(obj, str):
+        encoded = b's' + obj.encode('utf-8')
+    elif isinstance(obj, bytes):
+        encoded = b'b' + obj
+    else:
+        encoded = b'r' + repr(obj).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little')
+
+
+def _numeric_hashes(values):
+    """
+    The _stable_hash of every element of a numeric array as a uint64 array, computed without a Python loop. Returns
+    None if an element would hash through its encoding instead (not a number, or an integer outside the int64 range).
+    """
+    values = values.reshape(-1)
+    if values.dtype.kind in 'bi':
+        return _mix64(values.astype(np.int64).astype(np.uint64))
+    if values.dtype.kind == 'u':
+        if len(values) and values.max() >= 1 << 63:
+            return None
+        return _mix64(values.astype(np.uint64))
+    if values.dtype.kind != 'f':
+        return None
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    integral = np.isfinite(values)
+    integral[integral] = values[integral] == np.floor(values[integral])
+    in_range = (values >= -2.0**63) & (values < 2.0**63)
+    if np.any(integral & ~in_range):
+        return None
+    bits = values.view(np.uint64).copy()
+    integral &= in_range
+    bits[integral] = values[integral].astype(np.int64).astype(np.uint64)
+    return _mix64(bits)
+
+
+@functools.lru_cache(maxsize=None)
+def _count_min_hash_parameters(seed, depth):
+    # One (a, b) pair per row for the universal hash family ((a * x + b) mod p) mod width
+    random_state = np.random.RandomState(seed)
+    return tuple(zip(random_state.randint(1, 1 << 30, size=depth).tolist(),
+                     random_state.randint(0, 1 << 30, size=depth).tolist()))
+
+
+def _count_min_columns(hashes, seed, depth, width):
+    """
+    The (depth, n) columns ((a * x + b) mod p) mod width of the uint64 hashes x, exactly as computed for a single key
+    with Python integers. The products are split so that every intermediate fits in a uint64: with a < 2**30 and
+    x = high * 2**31 + low reduced mod p, a * high * 2**31 is folded using 2**61 = 1 (mod p).
+    """
+    prime = np.uint64(_MERSENNE_PRIME)
+    x = (hashes & prime) + (hashes >> np.uint64(61))
+    x = np.where(x >= prime, x - prime, x)
+    low, high = x & np.uint64((1 << 31) - 1), x >> np.uint64(31)
+    columns = np.empty((depth, len(hashes)), dtype=np.intp)
+    for row, (a, b) in enumerate(_count_min_hash_parameters(seed, depth)):
+        high_product = np.uint64(a) * high
+        folded = (high_product >> np.uint64(30)) + ((high_product & np.uint64((1 << 30) - 1)) << np.uint64(31))
+        columns[row] = (folded + np.uint64(a) * low + np.uint64(b)) % prime % np.uint64(width)
+    return columns
+
+
+class ApproximateFrequency(AbstractGroupStatistic):
+    """
+    A bounded-memory sibling of Frequency: a Count-Min sketch of depth rows of width signed counters. Merging adds
+    the tables and the inverse negates them, so the group laws hold exactly; get_frequency overestimates a count by
+    at most 2n / width with probability 1 - 2**-depth, as long as no true count is negative.
+
+    With top_k > 0 the sketch also tracks up to top_k heavy-hitter candidates, re-estimated from the merged table on
+    every merge. width, depth, top_k and seed default to the WIDTH, DEPTH, TOP_K and SEED class attributes, so a
+    subclass can set them for use in STATISTIC_CLASSES. Only sketches with the same width, depth and seed can be
+    merged, except that the empty sketch merges with any other.
+    """
+    __slots__ = ('table', 'seed', 'top_k', 'candidates')
+
+    WIDTH = 2048
+    DEPTH = 4
+    TOP_K = 0
+    SEED = 0
+    # Numeric arrays are hashed this many keys at a time, which bounds the memory of the intermediate hashes
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, data=None, weights=None, width=None, depth=None, top_k=None, seed=None):
+        """
+        Numeric arrays are hashed and counted in NumPy without finding their distinct keys, unless top_k is set;
+        other data is counted exactly first and each distinct key hashed in Python. weights, if given, must be
+        integers: the table holds integer counts.
+        """
+        self.table = np.zeros((self.DEPTH if depth is None else depth, self.WIDTH if width is None else width),
+                              dtype=np.int64)
+        self.seed = self.SEED if seed is None else seed
+        self.top_k = self.TOP_K if top_k is None else top_k
+        self.candidates = set()
+        if data is None:
+            return
+        if weights is not None and np.asarray(weights).dtype.kind not in 'iub':
+            raise ValueError('ApproximateFrequency needs integer weights, got {0}'.format(np.asarray(weights).dtype))
+        array = _as_array(data)
+        if array is not None and self._add_array(array, weights):
+            return
+        if weights is not None:
+            counter = Frequency(data, weights=weights).get_counter()
+        else:
+            counter = Counter(array.reshape(-1).tolist() if array is not None else data)
+        if counter:
+            columns = np.array([self._columns(key) for key in counter])
+            counts = np.array(list(counter.values()), dtype=self.table.dtype)
+            for row in range(self.table.shape[0]):
+                np.add.at(self.table[row], columns[:, row], counts)
+        if self.top_k:
+            self.candidates = set(sorted(counter, key=counter.get, reverse=True)[:self.top_k])
+
+    def _add_array(self, array, weights):
+        # Counts the keys of a numeric array block by block; returns False if the array needs the per-key path
+        values = array.reshape(-1)
+        if weights is not None:
+            weights = _as_weights(weights, len(values)).astype(self.table.dtype)
+        depth, width = self.table.shape
+        for start in range(0, len(values), self.BLOCK_SIZE):
+            hashes = _numeric_hashes(values[start:start + self.BLOCK_SIZE])
+            if hashes is None:
+                self.table[:] = 0
+                return False
+            columns = _count_min_columns(hashes, self.seed, depth, width)
+            for row in range(depth):
+                if weights is None:
+                    self.table[row] += np.bincount(columns[row], minlength=width)
+                else:
+                    np.add.at(self.table[row], columns[row], weights[start:start + self.BLOCK_SIZE])
+        if self.top_k and len(values):
+            keys = np.unique(values)
+            columns = _count_min_columns(_numeric_hashes(keys), self.seed, depth, width)
+            estimates = self.table[np.arange(depth)[:, None], columns].min(axis=0)
+            top = np.argsort(-estimates, kind='stable')[:self.top_k]
+            self.candidates = self._prune_candidates(set(keys[top].tolist()))
+        return True
+
+    def _columns(self, key):
+        x = _stable_hash(key)
+        depth, width = self.table.shape
+        return [((a * x + b) % _MERSENNE_PRIME) % width for a, b in _count_min_hash_parameters(self.seed, depth)]
+
+    def get_frequency(self, obj):
+        return int(self.table[np.arange(self.table.shape[0]), self._columns(obj)].min())
+
+    def update(self, x):
+        self.table[np.arange(self.table.shape[0]), self._columns(x)] += 1
+        if self.top_k:
+            self.candidates = self._prune_candidates(self.candidates | {x})
+        return self
+
+    def get_n(self):
+        return int(self.table[0].sum())
+
+    def is_identity(self):
+        return not self.table.any()
+
+    def get_heavy_hitters(self):
+        """
+        Returns the tracked heavy hitters as (key, estimated count) pairs, most frequent first.
+        """
+        estimates = [(key, self.get_frequency(key)) for key in self.candidates]
+        return sorted(estimates, key=lambda pair: pair[1], reverse=True)
+
+    def _merged_table(self, other, sign, out=None):
+        """
+        Returns the table of self plus sign times the table of other, written to out if given, and its seed. The
+        empty sketch takes on the width, depth and seed of the sketch it is merged with.
+        """
+        if self.table.shape == other.table.shape and self.seed == other.seed:
+            return (np.add if sign > 0 else np.subtract)(self.table, other.table, out=out), self.seed
+        if other.is_identity():
+            return self.table if out is not None else self.table.copy(), self.seed
+        if self.is_identity():
+            return sign * other.table, other.seed
+        raise ValueError('Cannot merge Count-Min sketches with different width, depth or seed')
+
+    def _prune_candidates(self, candidates):
+        if not self.top_k:
+            return set()
+        estimates = [(key, self.get_frequency(key)) for key in candidates]
+        estimates = [pair for pair in estimates if pair[1] > 0]
+        estimates.sort(key=lambda pair: pair[1], reverse=True)
+        return set(key for key, _ in estimates[:self.top_k])
+
+    def __or__(self, other):
+        result = self.__class__()
+        result.table, result.seed = self._merged_table(other, 1)
+        result.top_k = max(self.top_k, other.top_k)
+        result.candidates = result._prune_candidates(self.candidates | other.candidates)
+        return result
+
+    def __ior__(self, other):
+        self.table, self.seed = self._merged_table(other, 1, out=self.table)
+        self.top_k = max(self.top_k, other.top_k)
+        self.candidates = self._prune_candidates(self.candidates | other.candidates)
+        return self
+
+    def __isub__(self, other):
+        self.table, self.seed = self._merged_table(other, -1, out=self.table)
+        self.candidates = self._prune_candidates(self.candidates | other.candidates)
+        return self
+
+    def __neg__(self):
+        result = self.__class__()
+        result.table = -self.table
+        result.seed, result.top_k = self.seed, self.top_k
+        result.candidates = set(self.candidates)
+        return result
+
+    def __eq__(self, other):
+        return self.seed == other.seed and np.array_equal(self.table, other.table)
+
+    def _pack_payload(self):
+        return serialization.pack_number(self.seed) + serialization.pack_number(self.top_k) \
+               + serialization.pack_array(self.table) + serialization.pack_keys(self.candidates)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        result = cls.__new__(cls)
+        result.seed, offset = serialization.unpack_number(buffer, offset)
+        result.top_k, offset = serialization.unpack_number(buffer, offset)
+        table, offset = serialization.unpack_array(buffer, offset)
+        result.table = np.array(table)
+        candidates, offset = serialization.unpack_keys(buffer, offset)
+        result.candidates = set(candidates)
+        return result, offset
+
 class Variance(AbstractGroupStatistic):
-    def __init__(self, data=None):
-        self.mean = Mean(data)
+    """
+    Keeps the count, mean and sum of squared deviations from the mean (M2). Partial results are merged with Chan et
+    al.'s pairwise update, which only ever adds squared deviations and so stays accurate for data far from zero.
+    """
+    __slots__ = ('mean', 'sum_square_distance')
+    PROVIDES = [('mean', Mean)]
+
+    # Arrays are reduced in blocks of this many rows: each block is read from memory once and then revisited in
+    # cache for its deviations, and the block results are combined with the pairwise merge.
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, data=None, compensated=False, weights=None):
+        """
+        Lists, iterators and generators are consumed in a single pass with Welford's update. With compensated=True
+        the running mean and M2 of that pass also use Neumaier summation, which helps for very long inputs of
+        scalars. Arrays take the blocked vectorized path, where NumPy's pairwise summation already bounds the error.
+
+        With weights, observation i counts weights[i] times (frequency weights), so get_variance matches the
+        variance of the data with each observation repeated; the data then takes the array path.
+        """
         if data is None:
+            self.mean = Mean()
             self.sum_square_distance = 0
+            return
+        if weights is not None:
+            array = np.asarray(data, dtype=np.float64)
+            self.mean, self.sum_square_distance = self._moments_from_array(array, _as_weights(weights, len(array)))
+            return
+        array = _as_array(data)
+        if array is not None:
+            self.mean, self.sum_square_distance = self._moments_from_array(array)
+        else:
+            self.mean, self.sum_square_distance = self._welford(data, compensated)
+
+    @staticmethod
+    def _welford(data, compensated):
+        n, mean, m2 = 0, 0.0, 0.0
+        if compensated:
+            mean_compensation, m2_compensation = 0.0, 0.0
+            for x in data:
+                n += 1
+                delta = x - (mean + mean_compensation)
+                mean, mean_compensation = _neumaier_add(mean, mean_compensation, delta / n)
+                m2, m2_compensation = _neumaier_add(m2, m2_compensation, delta * (x - (mean + mean_compensation)))
+            mean, m2 = mean + mean_compensation, m2 + m2_compensation
+        else:
+            for x in data:
+                n += 1
+                delta = x - mean
+                mean = mean + delta / n
+                m2 = m2 + delta * (x - mean)
+        if n == 0:
+            return Mean(), 0
+        return Mean._from_moments(n, mean), _to_scalar(m2)
+
+    @classmethod
+    def _moments_from_array(cls, array, weights=None):
+        if array.shape[0] > cls.BLOCK_SIZE:
+            result = cls()
+            for start in range(0, array.shape[0], cls.BLOCK_SIZE):
+                block_weights = None if weights is None else weights[start:start + cls.BLOCK_SIZE]
+                result |= cls(array[start:start + cls.BLOCK_SIZE], weights=block_weights)
+            return result.mean, result.sum_square_distance
+        mean = Mean(array, weights=weights)
+        if mean.get_n() == 0:
+            return mean, 0
+        deviations = array - mean.get_mean()
+        weighted_deviations = deviations if weights is None else _weighted(deviations, weights)
+        if deviations.ndim == 1:
+            sum_square_distance = float(np.dot(weighted_deviations, deviations))
         else:
-            self.sum_square_distance = sum([(d - self.mean.get_mean())**2 for d in data])
+            deviations = deviations.reshape(deviations.shape[0], -1)
+            weighted_deviations = weighted_deviations.reshape(deviations.shape[0], -1)
+            sum_square_distance = np.einsum('ij,ij->j', weighted_deviations, deviations).reshape(array.shape[1:])
+        return mean, sum_square_distance
+
+    @classmethod
+    def from_columns(cls, data):
+        data = np.asarray(data)
+        mean, sum_square_distance = cls._moments_from_array(data)
+        result = []
+        for j in range(data.shape[1]):
+            v = cls()
+            if mean.get_n():
+                v.mean.set_n(mean.get_n())
+                v.mean.set_mean(float(mean.get_mean()[j]))
+                v.sum_square_distance = float(sum_square_distance[j])
+            result.append(v)
+        return result
+
+    @classmethod
+    def fit_groups(cls, group_index, values, n_groups, weights=None):
+        values = np.asarray(values)
+        n, means = _group_moments(group_index, values, n_groups, weights)
+        deviations = values - means[group_index]
+        square_deviations = deviations * deviations
+        if weights is not None:
+            square_deviations = _weighted(square_deviations, _as_weights(weights, len(values)))
+        sum_square_distances = _group_sums(group_index, square_deviations, n_groups)
+        result = []
+        for g in range(n_groups):
+            v = cls()
+            if n[g]:
+                v.mean = Mean._from_moments(n[g], means[g])
+                v.sum_square_distance = _to_scalar(sum_square_distances[g])
+            result.append(v)
+        return result
 
     def get_sum_square_distance(self):
         return self.sum_square_distance
@@ -126,46 +862,813 @@ class Variance(AbstractGroupStatistic):
     def get_variance(self):
         return 1.0/(self.mean.get_n()-1) * self.sum_square_distance
 
+    def is_identity(self):
+        return self.mean.is_identity()
+
+    @staticmethod
+    def _merged_sum_square_distance(n_a, mean_a, sum_square_distance_a, n_b, mean_b, sum_square_distance_b):
+        merged_n = n_a + n_b
+        if merged_n == 0: # Handle subtracting all elements
+            return 0
+        delta = mean_b - mean_a
+        return sum_square_distance_a + sum_square_distance_b + delta * delta * (1.0 * n_a * n_b / merged_n)
+
     def __or__(self, other):
         v = Variance()
         v.mean = self.mean | other.mean
-        v.sum_square_distance =   self.get_sum_square_distance() + self.mean.get_n() * self.mean.get_mean()**2 \
-                                + other.get_sum_square_distance() + other.mean.get_n() * other.mean.get_mean()**2 \
-                                - v.mean.get_n() * v.mean.get_mean()**2
+        v.sum_square_distance = self._merged_sum_square_distance(
+            self.mean.get_n(), self.mean.get_mean(), self.get_sum_square_distance(),
+            other.mean.get_n(), other.mean.get_mean(), other.get_sum_square_distance())
         return v
 
+    def update(self, x):
+        # One step of Welford's update
+        delta = x - self.mean.get_mean()
+        self.mean.update(x)
+        if self.mean.get_n() == 0:
+            self.sum_square_distance = 0
+        else:
+            self.sum_square_distance = self.sum_square_distance + delta * (x - self.mean.get_mean())
+        return self
+
+    def __ior__(self, other):
+        return self._merge_in_place(other, 1)
+
+    def __isub__(self, other):
+        return self._merge_in_place(other, -1)
+
+    def _merge_in_place(self, other, sign):
+        self.sum_square_distance = self._merged_sum_square_distance(
+            self.mean.get_n(), self.mean.get_mean(), self.get_sum_square_distance(),
+            sign * other.mean.get_n(), other.mean.get_mean(), sign * other.get_sum_square_distance())
+        if sign > 0:
+            self.mean |= other.mean
+        else:
+            self.mean -= other.mean
+        return self
+
     def __eq__(self, other):
-        return self.get_sum_square_distance() == other.get_sum_square_distance()
+        return self.mean == other.mean \
+               and np.array_equal(self.get_sum_square_distance(), other.get_sum_square_distance())
 
     def __neg__(self):
-        new_variance = copy.deepcopy(self)
-        new_variance.sum_square_distance *= -1
-        new_variance.mean.n *= -1
+        new_variance = Variance()
+        new_variance.mean = -self.mean
+        new_variance.sum_square_distance = -self.sum_square_distance
         return new_variance
 
+    def _pack_payload(self):
+        return self.mean._pack_payload() + serialization.pack_number(self.sum_square_distance)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        v = cls()
+        v.mean, offset = Mean._unpack_payload(buffer, offset)
+        v.sum_square_distance, offset = serialization.unpack_number(buffer, offset)
+        return v, offset
+
+class Covariance(AbstractGroupStatistic):
+    """
+    The multivariate counterpart of Variance: the count, the mean vector and the co-moment matrix (the sum of outer
+    products of deviations from the mean) of d-dimensional observations. Built from a 2-D array with one matrix
+    product, and merged with the pairwise update.
+    """
+    __slots__ = ('mean', 'comoment')
+    PROVIDES = [('mean', Mean)]
+
+    def __init__(self, data=None, weights=None):
+        if data is None:
+            self.mean = Mean()
+            self.comoment = 0
+            return
+        X = np.asarray(data, dtype=np.float64)
+        if X.ndim != 2:
+            raise ValueError('Covariance needs a 2-D array with one observation per row')
+        self.mean = Mean(X, weights=weights)
+        if self.mean.get_n() == 0:
+            self.mean = Mean()
+            self.comoment = 0
+            return
+        deviations = X - self.mean.get_mean()
+        weighted_deviations = deviations if weights is None else _weighted(deviations, np.asarray(weights))
+        self.comoment = weighted_deviations.T @ deviations
+
+    def get_n(self):
+        return self.mean.get_n()
+
+    def get_mean(self):
+        return self.mean.get_mean()
+
+    def get_comoment(self):
+        return self.comoment
+
+    def get_covariance(self):
+        return self.comoment / (self.mean.get_n() - 1.0)
+
+    def is_identity(self):
+        return self.mean.is_identity()
+
+    @staticmethod
+    def _merged_comoment(n_a, mean_a, comoment_a, n_b, mean_b, comoment_b):
+        merged_n = n_a + n_b
+        if merged_n == 0: # Handle subtracting all elements
+            return 0
+        delta = np.asarray(mean_b - mean_a)
+        return comoment_a + comoment_b + np.multiply.outer(delta, delta) * (1.0 * n_a * n_b / merged_n)
+
+    def __or__(self, other):
+        c = Covariance()
+        c.mean = self.mean | other.mean
+        c.comoment = self._merged_comoment(self.get_n(), self.get_mean(), self.comoment,
+                                           other.get_n(), other.get_mean(), other.comoment)
+        return c
+
+    def __ior__(self, other):
+        return self._merge_in_place(other, 1)
+
+    def __isub__(self, other):
+        return self._merge_in_place(other, -1)
+
+    def _merge_in_place(self, other, sign):
+        self.comoment = self._merged_comoment(self.get_n(), self.get_mean(), self.comoment,
+                                              sign * other.get_n(), other.get_mean(), sign * other.comoment)
+        if sign > 0:
+            self.mean |= other.mean
+        else:
+            self.mean -= other.mean
+        return self
+
+    def __neg__(self):
+        c = Covariance()
+        c.mean = -self.mean
+        c.comoment = -self.comoment
+        return c
+
+    def __eq__(self, other):
+        return self.get_n() == other.get_n() and np.array_equal(self.get_mean(), other.get_mean()) \
+               and np.array_equal(self.comoment, other.comoment)
+
+    def _pack_payload(self):
+        return self.mean._pack_payload() + serialization.pack_number(self.comoment)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        c = cls()
+        c.mean, offset = Mean._unpack_payload(buffer, offset)
+        c.comoment, offset = serialization.unpack_number(buffer, offset)
+        return c, offset
+
+class StatisticArray(AbstractGroupStatistic):
+    """
+    Struct-of-arrays storage for the Variance statistics of many keys: element i holds the count, mean and sum of
+    squared deviations of key i in three NumPy arrays instead of three Python objects. | and - merge the whole keyed
+    population elementwise in a few vectorized operations. The empty array is the identity.
+    """
+    __slots__ = ('n', 'mean', 'sum_square_distance')
+
+    def __init__(self, n=None, mean=None, sum_square_distance=None):
+        if n is None:
+            n, mean, sum_square_distance = [], [], []
+        self.n = np.array(n, dtype=np.float64)
+        self.mean = np.array(mean, dtype=np.float64)
+        if sum_square_distance is None:
+            sum_square_distance = np.zeros_like(self.n)
+        self.sum_square_distance = np.array(sum_square_distance, dtype=np.float64)
+        if not (self.n.shape == self.mean.shape == self.sum_square_distance.shape and self.n.ndim == 1):
+            raise ValueError('n, mean and sum_square_distance must be 1-D arrays of the same length')
+
+    @classmethod
+    def from_statistics(cls, statistics):
+        """
+        Packs a sequence of Mean or Variance statistics into one array.
+        """
+        n, mean, sum_square_distance = [], [], []
+        for statistic in statistics:
+            if isinstance(statistic, Variance):
+                sum_square_distance.append(statistic.get_sum_square_distance())
+                statistic = statistic.mean
+            else:
+                sum_square_distance.append(0)
+            n.append(statistic.get_n())
+            mean.append(statistic.get_mean())
+        return cls(n, mean, sum_square_distance)
+
+    def to_statistics(self):
+        return [self[i] for i in range(len(self))]
+
+    def get_n(self):
+        return self.n
+
+    def get_mean(self):
+        return self.mean
+
+    def get_sum_square_distance(self):
+        return self.sum_square_distance
+
+    def get_variance(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sum_square_distance / (self.n - 1)
+
+    def is_identity(self):
+        return len(self) == 0
+
+    def __len__(self):
+        return self.n.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            v = Variance()
+            if self.n[index] != 0:
+                v.mean.set_n(float(self.n[index]))
+                v.mean.set_mean(float(self.mean[index]))
+                v.sum_square_distance = float(self.sum_square_distance[index])
+            return v
+        return StatisticArray(self.n[index], self.mean[index], self.sum_square_distance[index])
+
+    def _merged_arrays(self, other, sign):
+        if len(other) == 0:
+            return self.n, self.mean, self.sum_square_distance
+        if len(self) == 0:
+            return sign * other.n, other.mean, sign * other.sum_square_distance
+        if len(self) != len(other):
+            raise ValueError('Cannot merge StatisticArrays of lengths {0} and {1}'.format(len(self), len(other)))
+        other_n = sign * other.n
+        merged_n = self.n + other_n
+        delta = other.mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            merged_mean = (self.n * self.mean + other_n * other.mean) / merged_n
+            merged_sum_square_distance = self.sum_square_distance + sign * other.sum_square_distance \
+                                       + delta * delta * (self.n * other_n / merged_n)
+        emptied = merged_n == 0 # Handle subtracting all elements
+        merged_mean[emptied] = 0
+        merged_sum_square_distance[emptied] = 0
+        return merged_n, merged_mean, merged_sum_square_distance
+
+    def __or__(self, other):
+        return StatisticArray(*self._merged_arrays(other, 1))
+
+    def __ior__(self, other):
+        self.n, self.mean, self.sum_square_distance = [np.array(a) for a in self._merged_arrays(other, 1)]
+        return self
+
+    def __isub__(self, other):
+        self.n, self.mean, self.sum_square_distance = [np.array(a) for a in self._merged_arrays(other, -1)]
+        return self
+
+    def __neg__(self):
+        return StatisticArray(-self.n, self.mean, -self.sum_square_distance)
+
+    def __eq__(self, other):
+        return np.array_equal(self.n, other.n) and np.array_equal(self.mean, other.mean) \
+               and np.array_equal(self.sum_square_distance, other.sum_square_distance)
+
+    @classmethod
+    def _from_arrays(cls, n, mean, sum_square_distance):
+        # Keeps the given arrays (possibly read-only views of a buffer) instead of copying them
+        result = cls.__new__(cls)
+        result.n, result.mean, result.sum_square_distance = n, mean, sum_square_distance
+        return result
+
+    def _pack_payload(self):
+        return serialization.pack_array(self.n) + serialization.pack_array(self.mean) \
+               + serialization.pack_array(self.sum_square_distance)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        n, offset = serialization.unpack_array(buffer, offset)
+        mean, offset = serialization.unpack_array(buffer, offset)
+        sum_square_distance, offset = serialization.unpack_array(buffer, offset)
+        return cls._from_arrays(n, mean, sum_square_distance), offset
+
+    def save(self, path, keys=None):
+        """
+        Writes the array, and optionally one numeric key per element, to a batch file that load() can memory-map.
+        """
+        key_kind = b'n'
+        if keys is not None:
+            keys = np.asarray(keys)
+            if keys.shape != self.n.shape or keys.dtype.kind not in 'iuf':
+                raise ValueError('keys must be a numeric array with one key per element')
+            key_kind = b'i' if keys.dtype.kind in 'iu' else b'd'
+            keys = keys.astype(serialization.batch_key_dtype(key_kind), copy=False)
+        with open(path, 'wb') as f:
+            f.write(serialization.pack_batch_header(key_kind, len(self)))
+            if keys is not None:
+                np.ascontiguousarray(keys).tofile(f)
+            for column in [self.n, self.mean, self.sum_square_distance]:
+                np.ascontiguousarray(column, dtype='<f8').tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a batch file written by save(). Returns (keys, array), where keys is None if none were saved.
+        The arrays are read-only views of the mapped file, so nothing is copied until the data is touched.
+        """
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        key_kind, length = serialization.unpack_batch_header(buffer)
+        offset = serialization.BATCH_HEADER_SIZE
+        keys = None
+        if key_kind != b'n':
+            keys = np.frombuffer(buffer, dtype=serialization.batch_key_dtype(key_kind), count=length, offset=offset)
+            offset += 8 * length
+        columns = []
+        for i in range(3):
+            columns.append(np.frombuffer(buffer, dtype='<f8', count=length, offset=offset))
+            offset += 8 * length
+        return keys, cls._from_arrays(*columns)
+
+class GroupedStatistic(AbstractGroupStatistic):
+    """
+    One statistic of statistic_cls per key. | merges key by key, so grouped results fitted on different shards
+    combine into the grouped result of the union; a key missing from one side acts as the identity, and a key whose
+    statistic merges to the identity is dropped. The per-key statistics may be shared between grouped results and are
+    never merged in place.
+    """
+    __slots__ = ('statistic_cls', 'groups')
+
+    def __init__(self, statistic_cls=None, groups=None):
+        self.statistic_cls = statistic_cls
+        self.groups = {} if groups is None else groups
+
+    def __getitem__(self, key):
+        return self.groups[key]
+
+    def __contains__(self, key):
+        return key in self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def keys(self):
+        return self.groups.keys()
+
+    def items(self):
+        return self.groups.items()
+
+    def is_identity(self):
+        return not self.groups
+
+    def __or__(self, other):
+        result = GroupedStatistic(self.statistic_cls or other.statistic_cls, dict(self.groups))
+        result._merge_groups(other, 1)
+        return result
+
+    def __ior__(self, other):
+        self.statistic_cls = self.statistic_cls or other.statistic_cls
+        self._merge_groups(other, 1)
+        return self
+
+    def __isub__(self, other):
+        self.statistic_cls = self.statistic_cls or other.statistic_cls
+        self._merge_groups(other, -1)
+        return self
+
+    def _merge_groups(self, other, sign):
+        # A key whose statistic becomes the identity is dropped, so that missing and emptied keys are the same
+        for key, statistic in other.groups.items():
+            if key in self.groups:
+                merged = self.groups[key] | statistic if sign > 0 else self.groups[key] - statistic
+            else:
+                merged = statistic if sign > 0 else -statistic
+            if merged.is_identity():
+                self.groups.pop(key, None)
+            else:
+                self.groups[key] = merged
+
+    def __neg__(self):
+        return GroupedStatistic(self.statistic_cls, {key: -statistic for key, statistic in self.groups.items()})
+
+    def __eq__(self, other):
+        return self.groups.keys() == other.groups.keys() \
+               and all(statistic == other.groups[key] for key, statistic in self.groups.items())
+
+    def _pack_payload(self):
+        name = _class_name(self.statistic_cls) if self.statistic_cls is not None else ''
+        return serialization.pack_string(name) + serialization.pack_keys(self.groups.keys()) \
+               + b''.join(statistic._pack_payload() for statistic in self.groups.values())
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        name, offset = serialization.unpack_string(buffer, offset)
+        keys, offset = serialization.unpack_keys(buffer, offset)
+        statistic_cls = _statistic_class(name) if name else None
+        groups = {}
+        for key in keys:
+            groups[key], offset = statistic_cls._unpack_payload(buffer, offset)
+        return cls(statistic_cls, groups), offset
+
+class QuantileSketch(AbstractGroupStatistic):
+    """
+    A mergeable quantile sketch in the style of KLL. Items are held in levels, where an item in level h stands for
+    2**h observations. When a level holds more than K items it is sorted and every other item is promoted to the next
+    level, alternating between the odd and even positions from one compaction to the next, so the total weight is
+    kept exactly and the rank error of a query grows like log(n / K) / K. Memory is O(K log(n / K)).
+
+    The sketch forms a commutative monoid but has no inverse, so windows over it use the two-stack fallback.
+    """
+    __slots__ = ('k', 'levels', 'compactions')
+
+    K = 200
+
+    def __init__(self, data=None, weights=None):
+        """
+        weights, if given, must be non-negative integers. An observation of weight w is stored exactly, as one item
+        in each level h for which bit h of w is set.
+        """
+        self.k = self.K
+        self.levels = [np.empty(0)]
+        self.compactions = [0]
+        if data is not None:
+            array = _as_array(data)
+            values = np.asarray(array if array is not None else list(data), dtype=np.float64).reshape(-1)
+            if weights is None:
+                self.levels[0] = values
+            else:
+                self._add_weighted(values, _as_weights(weights, len(values)))
+            self._compress()
+
+    def _add_weighted(self, values, weights):
+        if weights.dtype.kind not in 'iub' or (weights < 0).any():
+            raise ValueError('QuantileSketch needs non-negative integer weights')
+        weights = weights.astype(np.int64)
+        h = 0
+        while weights.any():
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+                self.compactions.append(0)
+            self.levels[h] = np.concatenate([self.levels[h], values[(weights & 1).astype(bool)]])
+            weights = weights >> 1
+            h += 1
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.k:
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                    self.compactions.append(0)
+                level = np.sort(self.levels[h])
+                leftover = level[len(level) - len(level) % 2:]
+                level = level[:len(level) - len(level) % 2]
+                promoted = level[self.compactions[h] % 2::2]
+                self.compactions[h] += 1
+                self.levels[h] = leftover
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def _weighted_items(self):
+        if self.is_identity():
+            raise ValueError('Cannot query an empty quantile sketch')
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    def get_n(self):
+        return int(sum(len(level) * 2**h for h, level in enumerate(self.levels)))
+
+    def is_identity(self):
+        return self.get_n() == 0
+
+    def quantile(self, q):
+        """
+        Returns the approximate q-quantile; q may be a scalar or an array of fractions in [0, 1].
+        """
+        values, cumulative_weights = self._weighted_items()
+        ranks = np.asarray(q) * cumulative_weights[-1]
+        index = np.minimum(np.searchsorted(cumulative_weights, ranks), len(values) - 1)
+        return values[index]
+
+    def rank(self, x):
+        """
+        Returns the approximate fraction of observations that are <= x.
+        """
+        values, cumulative_weights = self._weighted_items()
+        index = np.searchsorted(values, x, side='right')
+        return np.where(index > 0, cumulative_weights[np.maximum(index - 1, 0)], 0.0) / cumulative_weights[-1]
+
+    def hpdi(self, interval_fraction):
+        """
+        Returns the approximate shortest interval holding interval_fraction of the observations.
+        """
+        values, cumulative_weights = self._weighted_items()
+        weight_before = np.concatenate([[0.0], cumulative_weights[:-1]])
+        ends = np.searchsorted(cumulative_weights, weight_before + interval_fraction * cumulative_weights[-1])
+        valid = ends < len(values)
+        starts, ends = np.nonzero(valid)[0], ends[valid]
+        shortest = np.argmin(values[ends] - values[starts])
+        return values[starts[shortest]], values[ends[shortest]]
+
+    def __or__(self, other):
+        if self.k != other.k:
+            raise ValueError('Cannot merge quantile sketches with different K')
+        result = self.__class__()
+        depth = max(len(self.levels), len(other.levels))
+        result.levels = [np.concatenate([self.levels[h] if h < len(self.levels) else np.empty(0),
+                                         other.levels[h] if h < len(other.levels) else np.empty(0)])
+                         for h in range(depth)]
+        result.compactions = [(self.compactions[h] if h < len(self.compactions) else 0) +
+                              (other.compactions[h] if h < len(other.compactions) else 0) for h in range(depth)]
+        result._compress()
+        return result
+
+    def __eq__(self, other):
+        return self.k == other.k and len(self.levels) == len(other.levels) \
+               and all(np.array_equal(np.sort(a), np.sort(b)) for a, b in zip(self.levels, other.levels))
+
+    def _pack_payload(self):
+        return serialization.pack_number(self.k) + serialization.pack_array(self.compactions) \
+               + b''.join(serialization.pack_array(level) for level in self.levels)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        result = cls.__new__(cls)
+        result.k, offset = serialization.unpack_number(buffer, offset)
+        compactions, offset = serialization.unpack_array(buffer, offset)
+        result.compactions = compactions.tolist()
+        result.levels = []
+        for h in range(len(result.compactions)):
+            level, offset = serialization.unpack_array(buffer, offset)
+            result.levels.append(np.asarray(level, dtype=np.float64))
+        return result, offset
+
+def scipy_special():
+    """
+    Returns the scipy.special module. scipy is imported on first use rather than with the modules that need it, which
+    keeps their import cheap for processes that only build and merge statistics.
+    """
+    from scipy import special
+    return special
+
+def scipy_linalg():
+    """
+    Returns the scipy.linalg module, imported on first use like scipy_special.
+    """
+    from scipy import linalg
+    return linalg
+
+def cached_parameter(method):
+    """
+    Memoizes a derived parameter of a composite statistic, such as a normalizing constant. The cached value is
+    dropped whenever the composite is changed in place.
+    """
+    name = method.__name__
+    @functools.wraps(method)
+    def wrapper(self):
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = method(self)
+            return value
+    return wrapper
+
+# The statistic graph of each composite class, keyed by class: the STATISTIC_CLASSES it was computed from and the
+# (roots, links) pair returned by get_statistic_graph
+_STATISTIC_GRAPHS = {}
+
 class AbstractCompositeGroupStatistic(AbstractGroupStatistic):
+    """
+    A statistic made of the named sub-statistics in STATISTIC_CLASSES. Sub-statistics form a dependency graph: when
+    one entry maintains another as part of its own state (see AbstractGroupStatistic.PROVIDES), as Variance does with
+    its Mean, the provided entry is not computed separately but shares the provider's object. Only the root entries
+    are built, merged, negated and compared, so each underlying sufficient statistic is computed once.
+    """
     STATISTIC_CLASSES = None
-    def __init__(self, data=None):
-        self.statistic_values = {name: cls(data) for name, cls in self.STATISTIC_CLASSES}
+    def __init__(self, data=None, weights=None):
+        roots, _ = self.get_statistic_graph()
+        if weights is None:
+            self.statistic_values = {name: cls(data) for name, cls in roots}
+        else:
+            self.statistic_values = {name: cls(data, weights=weights) for name, cls in roots}
+        self._link_shared()
+        self._cache = {}
+
+    @classmethod
+    def get_statistic_graph(cls):
+        """
+        Returns (roots, links): the (name, class) entries of STATISTIC_CLASSES that hold their own state, and a
+        (name, provider name, attribute) triple for every entry that is shared from attribute of a root entry.
+        """
+        cached = _STATISTIC_GRAPHS.get(cls)
+        if cached is not None and cached[0] is cls.STATISTIC_CLASSES:
+            return cached[1]
+        providers = {}
+        for name, statistic_cls in cls.STATISTIC_CLASSES:
+            for provider_name, provider_cls in cls.STATISTIC_CLASSES:
+                attributes = [a for a, provided_cls in provider_cls.PROVIDES if provided_cls is statistic_cls]
+                if provider_name != name and attributes:
+                    providers[name] = (provider_name, attributes[0])
+                    break
+        # Providers must hold their own state, so an entry provided by a shared entry stays a root
+        links = [(name, provider_name, attribute) for name, (provider_name, attribute) in providers.items()
+                 if provider_name not in providers]
+        shared = set(name for name, _, _ in links)
+        roots = [(name, statistic_cls) for name, statistic_cls in cls.STATISTIC_CLASSES if name not in shared]
+        _STATISTIC_GRAPHS[cls] = (cls.STATISTIC_CLASSES, (roots, links))
+        return roots, links
+
+    def _root_names(self):
+        return [name for name, _ in self.get_statistic_graph()[0]]
+
+    def is_identity(self):
+        return all(self.statistic_values[name].is_identity() for name in self._root_names())
+
+    def _link_shared(self):
+        for name, provider_name, attribute in self.get_statistic_graph()[1]:
+            self.statistic_values[name] = getattr(self.statistic_values[provider_name], attribute)
+
+    def _invalidate_cache(self):
+        self._cache.clear()
+
+    def _depth(self):
+        return 1 + max(statistic._depth() for statistic in self.statistic_values.values())
+
+    @classmethod
+    def is_invertible(cls):
+        return all(statistic_cls.is_invertible() for _, statistic_cls in cls.get_statistic_graph()[0])
+
+    @classmethod
+    def from_statistic_values(cls, statistic_values):
+        """
+        Builds the composite from already fitted sub-statistics, keyed by the names in STATISTIC_CLASSES. Only the
+        root entries are needed; shared entries are taken from their providers.
+        """
+        result = cls()
+        result.statistic_values = dict(statistic_values)
+        result._link_shared()
+        return result
+
+    @classmethod
+    def fit_groups(cls, group_index, values, n_groups, weights=None):
+        fitted = [(name, statistic_cls.fit_groups(group_index, values, n_groups, weights=weights))
+                  for name, statistic_cls in cls.get_statistic_graph()[0]]
+        return [cls.from_statistic_values({name: statistics[g] for name, statistics in fitted})
+                for g in range(n_groups)]
 
     def __or__(self, other):
         result = self.__class__()
-        names = self.statistic_values.keys()
+        names = self._root_names()
         statistic_values = {n: self.statistic_values[n] | other.statistic_values[n] for n in names}
         result.statistic_values = statistic_values
+        result._link_shared()
         return result
 
     def __neg__(self):
         result = self.__class__()
-        names = self.statistic_values.keys()
+        names = self._root_names()
         statistic_values = {n: -self.statistic_values[n] for n in names}
         result.statistic_values = statistic_values
+        result._link_shared()
         return result
 
+    def update(self, x):
+        for n in self._root_names():
+            self.statistic_values[n].update(x)
+        self._link_shared()
+        self._invalidate_cache()
+        return self
+
+    def __ior__(self, other):
+        for n in self._root_names():
+            self.statistic_values[n] |= other.statistic_values[n]
+        self._link_shared()
+        self._invalidate_cache()
+        return self
+
+    def __isub__(self, other):
+        for n in self._root_names():
+            self.statistic_values[n] -= other.statistic_values[n]
+        self._link_shared()
+        self._invalidate_cache()
+        return self
+
     def __eq__(self, other):
-        names = self.statistic_values.keys()
+        names = self._root_names()
         result = all([self.statistic_values[n] == other.statistic_values[n] for n in names])
         return result
 
+    def _pack_payload(self):
+        # Shared entries are still written, which keeps the format independent of the statistic graph
+        return b''.join(self.statistic_values[name]._pack_payload() for name, _ in self.STATISTIC_CLASSES)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        statistic_values = {}
+        for name, statistic_cls in cls.STATISTIC_CLASSES:
+            statistic_values[name], offset = statistic_cls._unpack_payload(buffer, offset)
+        return cls.from_statistic_values(statistic_values), offset
+
     def __getitem__(self, key):
-        return self.statistic_values[key]
\ No newline at end of file
+        return self.statistic_values[key]
+
+    def __setitem__(self, key, value):
+        for name, provider_name, _ in self.get_statistic_graph()[1]:
+            if name == key:
+                raise ValueError('{0!r} is shared from {1!r}; set {1!r} instead'.format(key, provider_name))
+        self.statistic_values[key] = value
+        self._link_shared()
+        self._invalidate_cache()
+
+class MetricsRegistry(object):
+    """
+    In-process store of instrumentation metrics. Timings are kept per (class name, method) as a call count and
+    total seconds, and distributions such as merge sizes as count, sum, min and max.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.distributions = {}
+
+    def record_timing(self, class_name, method_name, seconds):
+        key = class_name + '.' + method_name
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+
+    def observe(self, name, value):
+        with self._lock:
+            distribution = self.distributions.get(name)
+            if distribution is None:
+                self.distributions[name] = [1, value, value, value]
+            else:
+                distribution[0] += 1
+                distribution[1] += value
+                distribution[2] = min(distribution[2], value)
+                distribution[3] = max(distribution[3], value)
+
+    def snapshot(self):
+        """
+        Returns a copy of the metrics as plain dicts, ready to be exported as JSON.
+        """
+        with self._lock:
+            timings = {key: {'count': count, 'total_seconds': seconds}
+                       for key, (count, seconds) in self.timings.items()}
+            distributions = {name: {'count': count, 'sum': total, 'min': low, 'max': high}
+                             for name, (count, total, low, high) in self.distributions.items()}
+        return {'timings': timings, 'distributions': distributions}
+
+
+METRICS = MetricsRegistry()
+INSTRUMENTED_METHODS = ('__init__', '__or__', '__ior__', '__neg__', 'pdf')
+
+
+def _instrumented(method, method_name, registry):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if method_name in ('__or__', '__ior__'):
+            sizes = self._merge_sizes(args[0])
+            if sizes is not None:
+                for size in sizes:
+                    registry.observe(type(self).__name__ + '.merge_size', size)
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            registry.record_timing(type(self).__name__, method_name, time.perf_counter() - start)
+        if method_name == '__init__':
+            depth = self._depth()
+            if depth:
+                registry.observe(type(self).__name__ + '.depth', depth)
+        return result
+    wrapper._uninstrumented = method
+    return wrapper
+
+
+def _instrument_class(cls, registry):
+    for method_name in INSTRUMENTED_METHODS:
+        method = cls.__dict__.get(method_name)
+        if method is not None and not hasattr(method, '_uninstrumented'):
+            setattr(cls, method_name, _instrumented(method, method_name, registry))
+    _instrumented_classes.append(cls)
+
+
+def enable_instrumentation(registry=METRICS):
+    """
+    Starts counting and timing INSTRUMENTED_METHODS of every statistic class, recording into registry. Merged
+    Frequency counter sizes and the depth of composite statistics are recorded too. The methods are wrapped in place
+    on the classes, so while instrumentation is disabled they run with no overhead at all.
+    """
+    global _instrumentation_registry
+    disable_instrumentation()
+    _instrumentation_registry = registry
+    for cls in list(_STATISTIC_CLASSES_BY_NAME.values()):
+        _instrument_class(cls, registry)
+
+
+def disable_instrumentation():
+    global _instrumentation_registry
+    _instrumentation_registry = None
+    while _instrumented_classes:
+        cls = _instrumented_classes.pop()
+        for method_name in INSTRUMENTED_METHODS:
+            method = cls.__dict__.get(method_name)
+            if method is not None and hasattr(method, '_uninstrumented'):
+                setattr(cls, method_name, method._uninstrumented)
@@ -0,0 +1,146 @@
+"""
+Load test of the aggregation service: many producers stream partial statistics to one server while queriers poll the
+merged results. Reports the merge throughput (partials pushed, merged and flushed per second) and the latency of the
+queries issued during ingestion.
+
+By default a server is started in a child process on a Unix socket (or on a free TCP port with --tcp), so that it
+does not share a CPU with the producers. Point --address at host:port or a socket path to test a running instance.
+
+Run from the repository root with: python -m benchmarks.aggregation_load [--producers 100] [--pushes 100]
+[--keys 10] [--statistic Variance] [--tcp] [--address ADDRESS]
+"""
+import argparse
+import ast
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from aggregation_service import AggregationClient
+from algebraic_statistic import Frequency, Mean, Variance
+from density_model import NormalDistribution
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_STATISTICS = {
+    'Mean': lambda random_state, size: Mean(random_state.normal(size=size)),
+    'Variance': lambda random_state, size: Variance(random_state.normal(size=size)),
+    'Frequency': lambda random_state, size: Frequency(random_state.randint(1000, size=size).tolist()),
+    'NormalDistribution': lambda random_state, size: NormalDistribution(random_state.normal(size=size)),
+}
+
+
+def start_server(tcp=False, max_queue_size=1024, max_batch_size=256):
+    """
+    Starts a server in a child process and returns (process, connect keyword arguments, temporary directory).
+    """
+    command = [sys.executable, '-m', 'aggregation_service', '--max-queue-size', str(max_queue_size),
+               '--max-batch-size', str(max_batch_size)]
+    directory = None
+    if tcp:
+        command += ['--port', '0']
+    else:
+        directory = tempfile.mkdtemp()
+        command += ['--unix', os.path.join(directory, 'aggregation.sock')]
+    process = subprocess.Popen(command, cwd=REPOSITORY_ROOT, stdout=subprocess.PIPE)
+    address = process.stdout.readline().decode('utf-8').strip()[len('listening on '):]
+    if tcp:
+        host, port = ast.literal_eval(address)[:2]
+        return process, {'host': host, 'port': port}, directory
+    return process, {'path': address}, directory
+
+
+def _parse_address(address):
+    if ':' in address and not os.path.exists(address):
+        host, port = address.rsplit(':', 1)
+        return {'host': host, 'port': int(port)}
+    return {'path': address}
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.percentile(np.array(latencies) * 1e3, [50, 90, 99, 100])
+    return dict(zip(['p50_ms', 'p90_ms', 'p99_ms', 'max_ms'], values.tolist()))
+
+
+async def run_load(connect, producers=100, pushes=100, keys=10, statistic='Variance', partial_size=100,
+                   queriers=1):
+    """
+    Runs the load against the server reached with AggregationClient.connect(**connect) and returns the measurements.
+    Each producer pushes the same pre-serialized partial pushes times, round robin over the keys, then flushes.
+    """
+    random_state = np.random.RandomState(0)
+    payloads = [_STATISTICS[statistic](random_state, partial_size).to_bytes() for i in range(producers)]
+    key_names = ['key{0}'.format(k) for k in range(keys)]
+    clients = [await AggregationClient.connect(**connect) for i in range(producers + queriers)]
+    done = asyncio.Event()
+    latencies = []
+
+    async def produce(client, index):
+        payload = payloads[index]
+        for i in range(pushes):
+            await client.push(key_names[(index + i) % keys], payload)
+        await client.flush()
+
+    async def query(client, index):
+        i = index
+        while not done.is_set():
+            start = time.perf_counter()
+            await client.query(key_names[i % keys])
+            latencies.append(time.perf_counter() - start)
+            i += 1
+
+    query_tasks = [asyncio.ensure_future(query(client, i)) for i, client in enumerate(clients[producers:])]
+    start = time.perf_counter()
+    await asyncio.gather(*[produce(client, i) for i, client in enumerate(clients[:producers])])
+    seconds = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*query_tasks)
+    for client in clients:
+        await client.close()
+    result = {'partials': producers * pushes, 'seconds': seconds,
+              'partials_per_second': producers * pushes / seconds, 'queries': len(latencies)}
+    result.update(_percentiles(latencies))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the statistic aggregation service.')
+    parser.add_argument('--producers', type=int, default=100)
+    parser.add_argument('--pushes', type=int, default=100, help='partials pushed by each producer')
+    parser.add_argument('--keys', type=int, default=10)
+    parser.add_argument('--statistic', choices=sorted(_STATISTICS), default='Variance')
+    parser.add_argument('--partial-size', type=int, default=100, help='observations behind each partial')
+    parser.add_argument('--queriers', type=int, default=1)
+    parser.add_argument('--address', help='host:port or Unix socket path of a running server')
+    parser.add_argument('--tcp', action='store_true', help='start the server on TCP instead of a Unix socket')
+    parser.add_argument('--max-queue-size', type=int, default=1024)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    args = parser.parse_args(argv)
+    process = directory = None
+    if args.address is not None:
+        connect = _parse_address(args.address)
+    else:
+        process, connect, directory = start_server(args.tcp, args.max_queue_size, args.max_batch_size)
+    try:
+        result = asyncio.run(run_load(connect, args.producers, args.pushes, args.keys, args.statistic,
+                                      args.partial_size, args.queriers))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    for name, value in result.items():
+        print('{0:<22} {1:.6g}'.format(name, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
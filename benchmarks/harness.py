@@ -0,0 +1,134 @@
+"""
+A small benchmark harness. Benchmarks are registered as factories that take a problem size, do their setup and
+return the zero-argument callable to time, so setup never counts towards the measurement. Each benchmark reports the
+best time per call over several repeats (timeit) and the peak memory allocated by one call (tracemalloc). Results are
+written as JSON and can be compared against a stored baseline run, flagging any benchmark that got slower or
+allocates more than the tolerance allows.
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+BENCHMARKS = []
+
+
+def register(name, max_size=None):
+    """
+    Decorator registering factory(size) as the benchmark name. Sizes above max_size are skipped, for the pure Python
+    paths that would take minutes at the largest sizes.
+    """
+    def decorator(factory):
+        BENCHMARKS.append((name, factory, max_size))
+        return factory
+    return decorator
+
+
+def sizes(min_size, max_size):
+    """
+    Powers of ten from min_size up to max_size.
+    """
+    size = min_size
+    while size <= max_size:
+        yield size
+        size *= 10
+
+
+def measure(func, repeat=3):
+    """
+    Returns the best time of one call to func in seconds, the number of calls per timing loop and the peak number of
+    bytes traced while running func once.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'number': number, 'peak_bytes': peak_bytes}
+
+
+def run(pattern='*', min_size=10, max_size=10**6, repeat=3, report=None):
+    """
+    Runs every registered benchmark whose name matches the glob pattern at each size, returning a dict from
+    'name[size]' to its measurement. report, if given, is called with each key and measurement as they complete.
+    """
+    results = {}
+    for name, factory, benchmark_max_size in BENCHMARKS:
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        for size in sizes(min_size, max_size):
+            if benchmark_max_size is not None and size > benchmark_max_size:
+                break
+            key = '{0}[{1}]'.format(name, size)
+            results[key] = measure(factory(size), repeat=repeat)
+            if report is not None:
+                report(key, results[key])
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Returns (key, metric, baseline value, new value) for every measurement which is more than tolerance (a fraction)
+    worse than in baseline. Benchmarks missing from either side are ignored.
+    """
+    regressions = []
+    for key, measurement in sorted(results.items()):
+        if key not in baseline:
+            continue
+        for metric in ['seconds', 'peak_bytes']:
+            old, new = baseline[key][metric], measurement[metric]
+            if new > old * (1 + tolerance):
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def save_results(path, results):
+    document = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                'results': results}
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=1, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def _print_measurement(key, measurement):
+    print('{0:<50} {1:12.3e} s {2:12.1f} KiB'.format(key, measurement['seconds'], measurement['peak_bytes'] / 1024.0))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmark suite.')
+    parser.add_argument('-k', '--filter', default='*', help='only run benchmarks matching this glob')
+    parser.add_argument('--min-size', type=int, default=10)
+    parser.add_argument('--max-size', type=int, default=10**6, help='up to 10**8; the largest sizes need GBs of memory')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results stored in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction by which a benchmark may be slower or allocate more than the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.min_size, args.max_size, args.repeat, report=_print_measurement)
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        for key, metric, old, new in regressions:
+            print('REGRESSION {0} {1}: {2:.4g} -> {3:.4g} ({4:+.0%})'.format(key, metric, old, new, new / old - 1))
+        if regressions:
+            return 1
+    return 0
@@ -0,0 +1,60 @@
+"""
+Measures the cost of importing each module of the package in a fresh interpreter, which is what every spawned worker
+process pays. numpy is imported first and reported separately, since every module needs it; the time reported for a
+module is what it adds on top of numpy. Exits with status 1 if any module takes longer than --budget seconds.
+
+Run from the repository root with: python -m benchmarks.import_time [--repeat 5] [--budget 0.1]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['algebraic_statistic', 'density_model', 'conjugate_density', 'fitting', 'mixture_model', 'naive_bayes',
+           'sliding_window', 'aggregation_service']
+
+_SCRIPT = '''
+import time
+start = time.perf_counter()
+import numpy
+numpy_seconds = time.perf_counter() - start
+start = time.perf_counter()
+import {0}
+print(numpy_seconds, time.perf_counter() - start)
+'''
+
+
+def import_seconds(module, repeat=5):
+    """
+    Returns the best (numpy seconds, module seconds) over repeat fresh interpreters.
+    """
+    timings = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _SCRIPT.format(module)], cwd=REPOSITORY_ROOT)
+        timings.append(tuple(float(t) for t in output.split()))
+    return min(t[0] for t in timings), min(t[1] for t in timings)
+
+
+def run(modules=MODULES, repeat=5, budget=None):
+    over_budget = []
+    for module in modules:
+        numpy_seconds, module_seconds = import_seconds(module, repeat)
+        print('{0:<22} {1:8.1f} ms  (numpy {2:.1f} ms)'.format(module, module_seconds * 1e3, numpy_seconds * 1e3))
+        if budget is not None and module_seconds > budget:
+            over_budget.append(module)
+    for module in over_budget:
+        print('OVER BUDGET {0}'.format(module))
+    return over_budget
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the import time of each module.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, help='maximum seconds a module may add to the numpy import')
+    args = parser.parse_args(argv)
+    return 1 if run(repeat=args.repeat, budget=args.budget) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
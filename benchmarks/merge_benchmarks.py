@@ -0,0 +1,44 @@
+"""
+Compares allocating merges (|, -) against in-place merges (|=, -=) in an online aggregation loop that folds many
+small updates into one running statistic.
+
+Run from the repository root with: python -m benchmarks.merge_benchmarks
+"""
+import random
+import timeit
+
+from algebraic_statistic import Mean, Variance, Frequency
+
+
+def _updates(cls, n_updates, update_size, cardinality):
+    return [cls([random.randint(0, cardinality) for i in range(update_size)]) for j in range(n_updates)]
+
+
+def _fold_allocating(cls, updates):
+    result = cls.get_identity()
+    for u in updates:
+        result = result | u
+    return result
+
+
+def _fold_in_place(cls, updates):
+    result = cls.get_identity()
+    for u in updates:
+        result |= u
+    return result
+
+
+def run(n_updates=1000, update_size=5, cardinalities=(100, 1000, 10000), repeat=3):
+    for cls in [Mean, Variance, Frequency]:
+        for cardinality in cardinalities:
+            updates = _updates(cls, n_updates, update_size, cardinality)
+            allocating = min(timeit.repeat(lambda: _fold_allocating(cls, updates), number=1, repeat=repeat))
+            in_place = min(timeit.repeat(lambda: _fold_in_place(cls, updates), number=1, repeat=repeat))
+            print('{0:<10} cardinality={1:<8} |: {2:8.4f}s  |=: {3:8.4f}s  speedup: {4:6.1f}x'.format(
+                cls.__name__, cardinality, allocating, in_place, allocating / in_place))
+            if cls is not Frequency:
+                break
+
+
+if __name__ == '__main__':
+    run()
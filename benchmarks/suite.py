@@ -0,0 +1,211 @@
+"""
+Benchmarks of the hot paths: construction of the statistics and density models, | and - merges at growing
+cardinality, |, -, |= and -= folds of many scalar Mean and Variance partials, tree reductions over many partials, pdf
+evaluated point by point against one batch call, and naive Bayes training and scoring.
+
+Run from the repository root with: python -m benchmarks.suite [--max-size 100000000] [--output results.json]
+[--baseline baseline.json]. The exit status is 1 if any benchmark regressed against the baseline.
+"""
+import functools
+import operator
+import sys
+
+import numpy as np
+
+from algebraic_statistic import Mean, Variance, Frequency, StatisticArray
+from benchmarks.harness import register, main
+from density_model import (NormalDistribution, PoissonDistribution, BernoulliDistribution, BinomialDistribution,
+                           ExponentialDistribution, CategoricalDistribution, MultivariateNormalDistribution)
+from fitting import group_fit, tree_reduce
+from naive_bayes import NaiveBayes
+
+PURE_PYTHON_MAX_SIZE = 10**6
+CARDINALITY = 1000
+
+
+def _random_state():
+    return np.random.RandomState(0)
+
+
+def _construct(cls, make_data):
+    def factory(size):
+        data = make_data(_random_state(), size)
+        return lambda: cls(data)
+    return factory
+
+
+for _cls in [Mean, Variance]:
+    register('construct/{0}/array'.format(_cls.__name__))(
+        _construct(_cls, lambda random_state, size: random_state.normal(size=size)))
+    register('construct/{0}/list'.format(_cls.__name__), max_size=PURE_PYTHON_MAX_SIZE)(
+        _construct(_cls, lambda random_state, size: random_state.normal(size=size).tolist()))
+
+register('construct/Frequency', max_size=10**7)(
+    _construct(Frequency, lambda random_state, size: random_state.randint(CARDINALITY, size=size).tolist()))
+
+_MODEL_DATA = [
+    (NormalDistribution, lambda random_state, size: random_state.normal(size=size)),
+    (PoissonDistribution, lambda random_state, size: random_state.poisson(3.0, size=size)),
+    (BernoulliDistribution, lambda random_state, size: random_state.randint(2, size=size)),
+    (BinomialDistribution, lambda random_state, size: random_state.rand(size)),
+    (ExponentialDistribution, lambda random_state, size: random_state.exponential(size=size)),
+    (CategoricalDistribution, lambda random_state, size: np.eye(10)[random_state.randint(10, size=size)]),
+    (MultivariateNormalDistribution, lambda random_state, size: random_state.normal(size=(size, 3))),
+]
+for _cls, _make_data in _MODEL_DATA:
+    register('construct/{0}'.format(_cls.__name__), max_size=10**7)(_construct(_cls, _make_data))
+
+
+def _frequency_pair(size):
+    # Two counters with size keys each, half of them shared
+    return Frequency(range(size)), Frequency(range(size // 2, size + size // 2))
+
+
+@register('merge/or/Frequency', max_size=10**7)
+def _merge_or_frequency(size):
+    a, b = _frequency_pair(size)
+    return lambda: a | b
+
+
+@register('merge/sub/Frequency', max_size=10**7)
+def _merge_sub_frequency(size):
+    a, b = _frequency_pair(size)
+    return lambda: a - b
+
+
+@register('merge/ior/Frequency', max_size=10**7)
+def _merge_ior_frequency(size):
+    # Only the counts of a keep growing between calls, so every call does the same amount of work
+    a, b = _frequency_pair(size)
+    def merge():
+        a.__ior__(b)
+    return merge
+
+
+def _scalar_partials(cls, size):
+    return [cls(chunk) for chunk in _random_state().normal(size=(size, 4))]
+
+
+def _scalar_merge_benchmarks(cls):
+    # Each call folds size partials of four observations, so the time per merge is the time per call over size
+    def merge_or(size):
+        partials = _scalar_partials(cls, size)
+        return lambda: functools.reduce(operator.or_, partials)
+
+    def merge_sub(size):
+        partials = _scalar_partials(cls, size)
+        total = tree_reduce(partials)
+        return lambda: functools.reduce(operator.sub, partials, total)
+
+    def merge_ior(size):
+        partials = _scalar_partials(cls, size)
+        def merge():
+            total = cls()
+            for partial in partials:
+                total |= partial
+        return merge
+
+    def merge_isub(size):
+        partials = _scalar_partials(cls, size)
+        def merge():
+            total = cls()
+            for partial in partials:
+                total -= partial
+        return merge
+
+    for operation, factory in [('or', merge_or), ('sub', merge_sub), ('ior', merge_ior), ('isub', merge_isub)]:
+        register('merge/{0}/{1}'.format(operation, cls.__name__), max_size=PURE_PYTHON_MAX_SIZE)(factory)
+
+
+for _cls in [Mean, Variance]:
+    _scalar_merge_benchmarks(_cls)
+
+
+def _statistic_array_pair(size):
+    random_state = _random_state()
+    return [StatisticArray(random_state.randint(1, 100, size=size), random_state.normal(size=size),
+                           random_state.exponential(size=size)) for i in range(2)]
+
+
+@register('merge/or/StatisticArray')
+def _merge_or_statistic_array(size):
+    a, b = _statistic_array_pair(size)
+    return lambda: a | b
+
+
+@register('merge/sub/StatisticArray')
+def _merge_sub_statistic_array(size):
+    a, b = _statistic_array_pair(size)
+    return lambda: a - b
+
+
+@register('merge/or/GroupedStatistic', max_size=PURE_PYTHON_MAX_SIZE)
+def _merge_or_grouped(size):
+    random_state = _random_state()
+    a = group_fit(Variance, random_state.randint(size, size=2 * size), random_state.normal(size=2 * size))
+    b = group_fit(Variance, random_state.randint(size, size=2 * size), random_state.normal(size=2 * size))
+    return lambda: a | b
+
+
+@register('tree_reduce/Variance', max_size=PURE_PYTHON_MAX_SIZE)
+def _tree_reduce_variance(size):
+    random_state = _random_state()
+    partials = [Variance(chunk) for chunk in random_state.normal(size=(size, 4))]
+    return lambda: tree_reduce(partials)
+
+
+@register('tree_reduce/Frequency', max_size=PURE_PYTHON_MAX_SIZE)
+def _tree_reduce_frequency(size):
+    random_state = _random_state()
+    partials = [Frequency(chunk) for chunk in random_state.randint(CARDINALITY, size=(size, 4)).tolist()]
+    return lambda: tree_reduce(partials)
+
+
+def _pdf_benchmarks(cls, make_data):
+    def scalar(size):
+        model = cls(make_data(_random_state(), 1000))
+        points = make_data(_random_state(), size).tolist()
+        return lambda: [model.pdf(x) for x in points]
+
+    def batch(size):
+        model = cls(make_data(_random_state(), 1000))
+        points = make_data(_random_state(), size)
+        return lambda: model.pdf(points)
+
+    register('pdf/scalar/{0}'.format(cls.__name__), max_size=PURE_PYTHON_MAX_SIZE)(scalar)
+    register('pdf/batch/{0}'.format(cls.__name__))(batch)
+
+
+for _cls, _make_data in [(NormalDistribution, _MODEL_DATA[0][1]), (PoissonDistribution, _MODEL_DATA[1][1]),
+                         (ExponentialDistribution, _MODEL_DATA[4][1])]:
+    _pdf_benchmarks(_cls, _make_data)
+
+
+@register('pdf/batch/MultivariateNormalDistribution', max_size=10**7)
+def _pdf_batch_multivariate_normal(size):
+    random_state = _random_state()
+    model = MultivariateNormalDistribution(random_state.normal(size=(1000, 3)))
+    points = random_state.normal(size=(size, 3))
+    return lambda: model.pdf(points)
+
+
+def _classification_data(random_state, size, n_features=20, n_classes=5):
+    labels = random_state.randint(n_classes, size=size)
+    return random_state.normal(labels[:, None], 1.0, size=(size, n_features)), labels
+
+
+@register('construct/NaiveBayes', max_size=10**7)
+def _construct_naive_bayes(size):
+    X, labels = _classification_data(_random_state(), size)
+    return lambda: NaiveBayes(X, labels)
+
+
+@register('predict_log_proba/NaiveBayes', max_size=10**7)
+def _predict_log_proba_naive_bayes(size):
+    model = NaiveBayes(*_classification_data(_random_state(), 1000))
+    X, _ = _classification_data(_random_state(), size)
+    return lambda: model.predict_log_proba(X)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
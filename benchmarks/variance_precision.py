@@ -0,0 +1,67 @@
+"""
+Compares the pairwise (Chan) Variance merge against the previous textbook merge, which added and subtracted
+n * mean**2 terms, on data with a large offset. Reports the relative error of the merged variance against a two-pass
+reference and the time taken by each merge strategy and by construction.
+
+Run from the repository root with: python -m benchmarks.variance_precision
+"""
+import timeit
+
+import numpy as np
+
+from algebraic_statistic import Variance
+
+
+def _textbook_merge(a, b):
+    # The merge formula Variance.__or__ used before it switched to the pairwise update
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    mean = (n_a * mean_a + n_b * mean_b) / n
+    return n, mean, m2_a + n_a * mean_a**2 + m2_b + n_b * mean_b**2 - n * mean**2
+
+
+def _relative_error(value, gold):
+    return abs(value - gold) / gold
+
+
+def run(offsets=(0.0, 1e3, 1e6, 1e9), n_chunks=1000, chunk_size=1000, seed=0):
+    random_state = np.random.RandomState(seed)
+    for offset in offsets:
+        chunks = [random_state.normal(0, 1, size=chunk_size) + offset for i in range(n_chunks)]
+        gold = np.var(np.concatenate(chunks), ddof=1)
+        partials = [Variance(chunk) for chunk in chunks]
+        triples = [(p.mean.get_n(), p.mean.get_mean(), p.get_sum_square_distance()) for p in partials]
+
+        def pairwise():
+            result = Variance()
+            for p in partials:
+                result |= p
+            return result
+
+        def textbook():
+            result = (0, 0.0, 0.0)
+            for t in triples:
+                result = _textbook_merge(result, t)
+            return result
+
+        pairwise_result, textbook_result = pairwise(), textbook()
+        textbook_variance = textbook_result[2] / (textbook_result[0] - 1)
+        pairwise_time = min(timeit.repeat(pairwise, number=1, repeat=3))
+        textbook_time = min(timeit.repeat(textbook, number=1, repeat=3))
+        print('offset={0:<8g} relative error  pairwise: {1:.2e}  textbook: {2:.2e}   '
+              'merge time  pairwise: {3:.4f}s  textbook: {4:.4f}s'.format(
+                  offset, _relative_error(pairwise_result.get_variance(), gold),
+                  _relative_error(textbook_variance, gold), pairwise_time, textbook_time))
+
+    data = random_state.normal(0, 1, size=n_chunks * chunk_size) + offsets[-1]
+    for label, build in [('array', lambda: Variance(data)),
+                         ('list', lambda: Variance(data[:100000].tolist())),
+                         ('list, compensated', lambda: Variance(data[:100000].tolist(), compensated=True))]:
+        elapsed = min(timeit.repeat(build, number=1, repeat=3))
+        size = len(data) if label == 'array' else 100000
+        print('construction ({0}): {1:.1f} M rows/s'.format(label, size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    run()
@@ -1,33 +1,191 @@
 """
-This module allows the user to construct distributions over parameter values for
+This module allows the user to construct distributions over parameter values for the common likelihoods
+(Bernoulli, Poisson, Normal and Categorical data) from their conjugate priors.
+
+Each model keeps the sufficient statistics of its likelihood and derives the posterior parameters from them and the
+class-level prior. update(x) adds one observation in O(1) and the posterior parameters are cached until the next
+change. get_posterior_log_pdf and get_posterior_pdf accept scalars or NumPy arrays of parameter values.
 """
+import math
+
 import numpy as np
-from matplotlib import pyplot as plt
-from algebraic_statistic import AbstractCompositeGroupStatistic, Frequency
-from scipy.stats import beta
+from algebraic_statistic import AbstractCompositeGroupStatistic, Frequency, Mean, Variance, cached_parameter, \
+    scipy_special
 
 class AbstractConjugateModel(AbstractCompositeGroupStatistic):
-    def get_posterior_pdf(self, *args, **kwargs):
+    def get_posterior_parameters(self):
+        raise NotImplementedError
+
+    def get_posterior_pdf(self, *args):
+        return np.exp(self.get_posterior_log_pdf(*args))
+
+    def get_posterior_log_pdf(self, *args):
+        raise NotImplementedError
+
+    def sample_posterior(self, size=None, random_state=None):
+        """
+        Draws parameter values from the posterior. random_state is a np.random.RandomState or Generator and defaults
+        to the global NumPy random state.
+        """
         raise NotImplementedError
 
+def _random_state(random_state):
+    return np.random if random_state is None else random_state
+
 class Bernoulli(AbstractConjugateModel):
+    """
+    Beta-Bernoulli model over the success probability mu, with a Beta(PRIOR_A, PRIOR_B) prior.
+    """
     STATISTIC_CLASSES = [('Frequency', Frequency)]
-    def get_posterior_pdf(self, mu):
-        a = self.statistic_values['Frequency'].get_frequency(1) + 1
-        b = self.statistic_values['Frequency'].get_frequency(0) + 1
-        return beta.pdf(mu, a, b)
+    PRIOR_A = 1.0
+    PRIOR_B = 1.0
+
+    @cached_parameter
+    def get_posterior_parameters(self):
+        return (self.PRIOR_A + self.statistic_values['Frequency'].get_frequency(1),
+                self.PRIOR_B + self.statistic_values['Frequency'].get_frequency(0))
+
+    @cached_parameter
+    def _log_normalizing_constant(self):
+        return -scipy_special().betaln(*self.get_posterior_parameters())
+
+    def get_posterior_log_pdf(self, mu):
+        mu = np.asarray(mu)
+        a, b = self.get_posterior_parameters()
+        special = scipy_special()
+        return self._log_normalizing_constant() + special.xlogy(a - 1, mu) + special.xlog1py(b - 1, -mu)
+
+    def sample_posterior(self, size=None, random_state=None):
+        return _random_state(random_state).beta(*self.get_posterior_parameters(), size=size)
+
+class Poisson(AbstractConjugateModel):
+    """
+    Gamma-Poisson model over the rate, with a Gamma(PRIOR_SHAPE, PRIOR_RATE) prior.
+    """
+    STATISTIC_CLASSES = [('mean', Mean)]
+    PRIOR_SHAPE = 1.0
+    PRIOR_RATE = 1.0
+
+    @cached_parameter
+    def get_posterior_parameters(self):
+        mean = self.statistic_values['mean']
+        return self.PRIOR_SHAPE + mean.get_n() * mean.get_mean(), self.PRIOR_RATE + mean.get_n()
+
+    @cached_parameter
+    def _log_normalizing_constant(self):
+        shape, rate = self.get_posterior_parameters()
+        return shape * math.log(rate) - scipy_special().gammaln(shape)
+
+    def get_posterior_log_pdf(self, rate):
+        rate = np.asarray(rate)
+        posterior_shape, posterior_rate = self.get_posterior_parameters()
+        log_kernel = scipy_special().xlogy(posterior_shape - 1, rate) - posterior_rate * rate
+        return self._log_normalizing_constant() + log_kernel
+
+    def sample_posterior(self, size=None, random_state=None):
+        shape, rate = self.get_posterior_parameters()
+        return _random_state(random_state).gamma(shape, 1.0 / rate, size=size)
+
+class Normal(AbstractConjugateModel):
+    """
+    Normal model with unknown mean and variance under a Normal-Inverse-Gamma prior: the variance sigma2 follows
+    InvGamma(PRIOR_SHAPE, PRIOR_SCALE) and, given sigma2, the mean follows Normal(PRIOR_MEAN, sigma2 / PRIOR_KAPPA).
+    Posterior parameters are (mean, kappa, shape, scale).
+    """
+    STATISTIC_CLASSES = [('variance', Variance)]
+    PRIOR_MEAN = 0.0
+    PRIOR_KAPPA = 1.0
+    PRIOR_SHAPE = 1.0
+    PRIOR_SCALE = 1.0
+
+    @cached_parameter
+    def get_posterior_parameters(self):
+        variance = self.statistic_values['variance']
+        n, sample_mean = variance.mean.get_n(), variance.mean.get_mean()
+        kappa = self.PRIOR_KAPPA + n
+        mean = (self.PRIOR_KAPPA * self.PRIOR_MEAN + n * sample_mean) / kappa
+        shape = self.PRIOR_SHAPE + 0.5 * n
+        scale = (self.PRIOR_SCALE + 0.5 * variance.get_sum_square_distance()
+                 + self.PRIOR_KAPPA * n * (sample_mean - self.PRIOR_MEAN)**2 / (2 * kappa))
+        return mean, kappa, shape, scale
+
+    @cached_parameter
+    def _log_normalizing_constant(self):
+        mean, kappa, shape, scale = self.get_posterior_parameters()
+        return 0.5 * math.log(kappa / (2 * math.pi)) + shape * math.log(scale) - scipy_special().gammaln(shape)
+
+    def get_posterior_log_pdf(self, mu, sigma2):
+        """
+        Joint posterior density of the mean mu and the variance sigma2.
+        """
+        mu, sigma2 = np.asarray(mu), np.asarray(sigma2)
+        mean, kappa, shape, scale = self.get_posterior_parameters()
+        return (self._log_normalizing_constant() - (shape + 1.5) * np.log(sigma2)
+                - (2 * scale + kappa * (mu - mean)**2) / (2 * sigma2))
+
+    def sample_posterior(self, size=None, random_state=None):
+        """
+        Returns samples of (mu, sigma2).
+        """
+        random_state = _random_state(random_state)
+        mean, kappa, shape, scale = self.get_posterior_parameters()
+        sigma2 = 1.0 / random_state.gamma(shape, 1.0 / scale, size=size)
+        mu = random_state.normal(mean, np.sqrt(sigma2 / kappa))
+        return mu, sigma2
+
+class Categorical(AbstractConjugateModel):
+    """
+    Dirichlet-Categorical model over the category probabilities, with a symmetric Dirichlet(PRIOR_CONCENTRATION)
+    prior. CATEGORIES fixes the order of the probability vector; if None the sorted observed categories are used.
+    """
+    STATISTIC_CLASSES = [('Frequency', Frequency)]
+    CATEGORIES = None
+    PRIOR_CONCENTRATION = 1.0
+
+    @cached_parameter
+    def get_categories(self):
+        if self.CATEGORIES is not None:
+            return list(self.CATEGORIES)
+        return sorted(self.statistic_values['Frequency'].get_counter())
+
+    @cached_parameter
+    def get_posterior_parameters(self):
+        frequency = self.statistic_values['Frequency']
+        return self.PRIOR_CONCENTRATION + np.array([frequency.get_frequency(c) for c in self.get_categories()],
+                                                   dtype=float)
+
+    @cached_parameter
+    def _log_normalizing_constant(self):
+        alpha = self.get_posterior_parameters()
+        special = scipy_special()
+        return special.gammaln(alpha.sum()) - special.gammaln(alpha).sum()
+
+    def get_posterior_log_pdf(self, p):
+        """
+        p has shape (..., number of categories), one probability vector per row.
+        """
+        log_terms = scipy_special().xlogy(self.get_posterior_parameters() - 1, np.asarray(p))
+        return self._log_normalizing_constant() + log_terms.sum(axis=-1)
+
+    def sample_posterior(self, size=None, random_state=None):
+        return _random_state(random_state).dirichlet(self.get_posterior_parameters(), size=size)
 
 def sliding_window_hpdi(samples, interval_fraction):
-    window_size = int(1.0 * len(samples) * interval_fraction)
-    sorted_samples = sorted(samples)
-    shortest_window_start = None
-    shortest_window_length = float('inf')
-    for window_start in range(len(samples) - window_size):
-        window_length = sorted_samples[window_start + window_size] - sorted_samples[window_start]
-        if window_length < shortest_window_length:
-            shortest_window_start = window_start
-            shortest_window_length = window_length
+    """
+    Returns the shortest interval containing interval_fraction of the samples. The samples are sorted once and the
+    widths of every window of that size are computed in one vectorized difference. An interval_fraction of 1 gives
+    the range of the samples.
+    """
+    sorted_samples = np.sort(np.asarray(samples))
+    if len(sorted_samples) == 0:
+        raise ValueError('Cannot compute the HPDI of no samples')
+    window_size = min(int(1.0 * len(sorted_samples) * interval_fraction), len(sorted_samples) - 1)
+    if window_size == 0:
+        return sorted_samples[0], sorted_samples[0]
+    window_lengths = sorted_samples[window_size:] - sorted_samples[:-window_size]
+    shortest_window_start = int(np.argmin(window_lengths))
     return sorted_samples[shortest_window_start], sorted_samples[shortest_window_start + window_size]
 
-data = np.random.normal(0,1,50000)
-print(sliding_window_hpdi(data, 0.68))
\ No newline at end of file
+if __name__ == '__main__':
+    data = np.random.normal(0,1,50000)
+    print(sliding_window_hpdi(data, 0.68))
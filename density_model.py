@@ -1,13 +1,17 @@
 import math
 
 import numpy as np
-from scipy.special import comb
-import von_mises_fisher
-from algebraic_statistic import Mean, Variance, AbstractCompositeGroupStatistic
+from algebraic_statistic import Mean, Variance, Covariance, AbstractCompositeGroupStatistic, cached_parameter, \
+    scipy_linalg, scipy_special
 
 class AbstractDensityModel(AbstractCompositeGroupStatistic):
+    """
+    pdf, log_pdf and unnormalized_pdf accept scalars or NumPy arrays of points and return values of the same shape.
+    The univariate models fitted to an (n, d) array hold d independent sets of parameters and score (m, d) arrays
+    column by column.
+    """
     def pdf(self, *args):
-        raise NotImplementedError
+        return np.exp(self.log_pdf(*args))
 
     def log_pdf(self, *args):
         raise NotImplementedError
@@ -17,16 +21,33 @@ class NormalDistribution(AbstractDensityModel):
     STATISTIC_CLASSES = [('mean', Mean), ('variance', Variance)]
 
     def pdf(self, X):
-        return self._calculate_normalizing_constant() * math.exp(self._mahalanobis_distance(X))
+        return self._calculate_normalizing_constant() * np.exp(self._mahalanobis_distance(X))
+
+    def log_pdf(self, X):
+        return self._log_normalizing_constant() + self._mahalanobis_distance(X)
+
+    @cached_parameter
+    def _mu(self):
+        return self['mean'].get_mean()
+
+    @cached_parameter
+    def _variance(self):
+        return self['variance'].get_variance()
 
+    @cached_parameter
     def _calculate_normalizing_constant(self):
-        var = self['variance'].get_variance()
-        return 1.0 / (math.sqrt(2 * math.pi * var))
+        return 1.0 / np.sqrt(2 * math.pi * self._variance())
+
+    @cached_parameter
+    def _log_normalizing_constant(self):
+        return -0.5 * np.log(2 * math.pi * self._variance())
+
+    @cached_parameter
+    def _half_precision(self):
+        return 1.0 / (2 * self._variance())
 
     def _mahalanobis_distance(self, X):
-        mu = self['mean'].get_mean()
-        var = self['variance'].get_variance()
-        return - ((X - mu)**2) / (2 * var)
+        return - ((np.asarray(X) - self._mu())**2) * self._half_precision()
 
     def unnormalized_pdf(self, X):
         return self._mahalanobis_distance(X)
@@ -35,22 +56,52 @@ class NormalDistribution(AbstractDensityModel):
 class PoissonDistribution(AbstractDensityModel):
     STATISTIC_CLASSES = [('mean', Mean)]
 
-    def pdf(self, k):
-        lam = self['mean'].get_mean()
-        return (lam**k * math.exp(-lam)) / (math.factorial(k))
+    @cached_parameter
+    def _rate(self):
+        return self['mean'].get_mean()
+
+    @cached_parameter
+    def _log_rate(self):
+        with np.errstate(divide='ignore'):
+            return np.log(self._rate())
+
+    def log_pdf(self, k):
+        k = np.asarray(k)
+        special = scipy_special()
+        if np.all(np.asarray(self._rate()) > 0):
+            return k * self._log_rate() - self._rate() - special.gammaln(k + 1)
+        # xlogy keeps 0 * log(0) at 0 for a zero rate
+        return special.xlogy(k, self._rate()) - self._rate() - special.gammaln(k + 1)
 
     def unnormalized_pdf(self, k):
-        lam = self['mean'].get_mean()
-        return lam**k
+        return self._rate()**np.asarray(k)
 
 
 class BernoulliDistribution(AbstractDensityModel):
     STATISTIC_CLASSES = [('mean', Mean)]
 
+    @cached_parameter
+    def _mu(self):
+        return self['mean'].get_mean()
+
+    @cached_parameter
+    def _log_mu(self):
+        with np.errstate(divide='ignore'):
+            return np.log(self._mu())
+
+    @cached_parameter
+    def _log_one_minus_mu(self):
+        with np.errstate(divide='ignore'):
+            return np.log1p(-self._mu())
+
     def pdf(self, x):
-        mu = self['mean'].get_mean()
+        mu = self._mu()
+        x = np.asarray(x)
         return (mu ** x)*((1.0 - mu) ** (1 - x))
 
+    def log_pdf(self, x):
+        return np.where(np.asarray(x) == 1, self._log_mu(), self._log_one_minus_mu())
+
     def unnormalized_pdf(self, x):
         return self.pdf(x)
 
@@ -58,10 +109,30 @@ class BernoulliDistribution(AbstractDensityModel):
 class BinomialDistribution(AbstractDensityModel):
     STATISTIC_CLASSES = [('mean', Mean)]
 
-    def pdf(self, n, k):
+    @cached_parameter
+    def _mu(self):
+        return self['mean'].get_mean()
+
+    @cached_parameter
+    def _log_mu(self):
+        with np.errstate(divide='ignore'):
+            return np.log(self._mu())
+
+    @cached_parameter
+    def _log_one_minus_mu(self):
+        with np.errstate(divide='ignore'):
+            return np.log1p(-self._mu())
+
+    def log_pdf(self, n, k):
         # n is the number of trials, k is the number of successes
-        mu = self['mean'].get_mean()
-        return comb(n, k) * (mu ** k) * ((1.0- mu) ** (n - k))
+        n, k = np.asarray(n), np.asarray(k)
+        special = scipy_special()
+        log_comb = special.gammaln(n + 1) - special.gammaln(k + 1) - special.gammaln(n - k + 1)
+        mu = self._mu()
+        if np.all((0 < mu) & (mu < 1)):
+            return log_comb + k * self._log_mu() + (n - k) * self._log_one_minus_mu()
+        # xlogy keeps 0 * log(0) at 0 when mu sits on the boundary
+        return log_comb + special.xlogy(k, mu) + special.xlog1py(n - k, -mu)
 
     def unnormalized_pdf(self, n, k):
         return self.pdf(n, k)
@@ -70,14 +141,58 @@ class BinomialDistribution(AbstractDensityModel):
 class ExponentialDistribution(AbstractDensityModel):
     STATISTIC_CLASSES = [('mean', Mean)]
 
+    @cached_parameter
+    def _rate(self):
+        return 1.0 / self['mean'].get_mean()
+
+    @cached_parameter
+    def _log_rate(self):
+        return np.log(self._rate())
+
     def pdf(self, x):
-        lam = 1.0 / self['mean'].get_mean()
-        return lam * math.exp(-lam * x)
+        lam = self._rate()
+        return lam * np.exp(-lam * np.asarray(x))
+
+    def log_pdf(self, x):
+        return self._log_rate() - self._rate() * np.asarray(x)
 
     def unnormalized_pdf(self, x):
         return self.pdf(x)
 
 
+class MultivariateNormalDistribution(AbstractDensityModel):
+    """
+    Normal distribution over d-dimensional points, fitted from a Covariance statistic. log_pdf scores a whole
+    (m, d) array with one triangular solve against the cached Cholesky factor of the covariance.
+    """
+    STATISTIC_CLASSES = [('covariance', Covariance)]
+
+    def log_pdf(self, X):
+        return self._log_normalizing_constant() + self._log_kernel(X)
+
+    @cached_parameter
+    def _mu(self):
+        return np.asarray(self['covariance'].get_mean())
+
+    @cached_parameter
+    def _cholesky(self):
+        return np.linalg.cholesky(self['covariance'].get_covariance())
+
+    @cached_parameter
+    def _log_normalizing_constant(self):
+        L = self._cholesky()
+        return -0.5 * L.shape[0] * math.log(2 * math.pi) - np.log(np.diag(L)).sum()
+
+    def _log_kernel(self, X):
+        # -0.5 times the squared Mahalanobis distance of each point, from L z = (x - mu)
+        Z = scipy_linalg().solve_triangular(self._cholesky(), (np.asarray(X) - self._mu()).T, lower=True,
+                                            check_finite=False)
+        return -0.5 * np.sum(Z * Z, axis=0)
+
+    def unnormalized_pdf(self, X):
+        return self._log_kernel(X)
+
+
 # class vonMisesFisherDistribution(AbstractDensityModel):
 #     STATISTIC_CLASSES = [('mean', Mean)]
 #
@@ -93,14 +208,20 @@ class ExponentialDistribution(AbstractDensityModel):
 class CategoricalDistribution(AbstractDensityModel):
     STATISTIC_CLASSES = [('mean', Mean)]
 
+    @cached_parameter
+    def _probabilities(self):
+        return np.asarray(self['mean'].get_mean())
+
     def pdf(self, x):
-        mean = self['mean'].get_mean()
-        return np.dot(x, mean)
+        # x is one one-hot encoded point, or a 2-D array with one point per row
+        return np.dot(x, self._probabilities())
+
+    def log_pdf(self, x):
+        return np.log(self.pdf(x))
 
     def unnormalized_pdf(self, x):
         # Technically this one is normalized
-        mean = self['mean'].get_mean()
-        return np.dot(x, mean)
+        return np.dot(x, self._probabilities())
 
 class BetaDistribution(AbstractDensityModel):
     pass
\ No newline at end of file
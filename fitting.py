@@ -0,0 +1,177 @@
+"""
+Fitting strategies built on the group structure of the statistics. Because every AbstractGroupStatistic has an
+associative, commutative | with an identity, a data set can be cut into chunks, each chunk fitted independently,
+and the partial results reduced back together.
+"""
+import concurrent.futures
+import csv
+from itertools import islice
+import math
+import os
+
+import numpy as np
+
+from algebraic_statistic import GroupedStatistic
+
+
+def tree_reduce(statistics, identity=None):
+    """
+    Reduces a sequence of statistics with | by merging neighbouring pairs, so that n partials take log2(n) rounds
+    and every merge combines statistics of similar size.
+    """
+    statistics = list(statistics)
+    if not statistics:
+        return identity
+    while len(statistics) > 1:
+        merged = [statistics[i] | statistics[i + 1] for i in range(0, len(statistics) - 1, 2)]
+        if len(statistics) % 2:
+            merged.append(statistics[-1])
+        statistics = merged
+    return statistics[0]
+
+
+def _chunk(data, chunk_size):
+    return [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+
+
+def _fit_chunk(cls, chunk, weights=None, labels=None):
+    args = (chunk,) if labels is None else (chunk, labels)
+    if weights is None:
+        return cls(*args)
+    return cls(*args, weights=weights)
+
+
+def _make_pool(executor, n_workers):
+    # The executors are looked up here, not imported with the module, so that multiprocessing is only loaded by
+    # processes that actually start a pool
+    if executor == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+    if executor == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+    raise ValueError('executor must be "process" or "thread", got {0!r}'.format(executor))
+
+
+def fit_parallel(cls, data, n_workers=None, chunk_size=None, executor='process', weights=None, labels=None):
+    """
+    Fits cls to data by building cls(chunk) for each chunk in a worker pool and tree-reducing the partial results.
+
+    executor may be 'process' (a process pool, for the pure Python construction paths) or 'thread' (a thread pool,
+    for the NumPy paths that release the GIL). data must support len() and slicing, e.g. a list or an ndarray, and
+    so must weights, which are split into the same chunks. So are labels, if given, for classifiers such as
+    NaiveBayes: each chunk is then fitted with cls(chunk, labels).
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if len(data) == 0:
+        return cls.get_identity()
+    if chunk_size is None:
+        chunk_size = int(math.ceil(1.0 * len(data) / n_workers))
+    chunks = _chunk(data, chunk_size)
+    weight_chunks = [None] * len(chunks) if weights is None else _chunk(weights, chunk_size)
+    label_chunks = [None] * len(chunks) if labels is None else _chunk(labels, chunk_size)
+    if n_workers == 1 or len(chunks) == 1:
+        return tree_reduce(map(_fit_chunk, [cls] * len(chunks), chunks, weight_chunks, label_chunks))
+    with _make_pool(executor, n_workers) as pool:
+        partials = list(pool.map(_fit_chunk, [cls] * len(chunks), chunks, weight_chunks, label_chunks))
+    return tree_reduce(partials)
+
+
+def fit_stream(cls, chunks):
+    """
+    Folds an iterable of data chunks into a single statistic, one chunk at a time. Only the running statistic and
+    the current chunk are held in memory.
+    """
+    result = cls.get_identity()
+    for chunk in chunks:
+        if len(chunk):
+            result |= cls(chunk)
+    return result
+
+
+def iter_chunks(iterable, chunk_size):
+    """
+    Groups the elements of an iterator or generator into lists of at most chunk_size elements.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_csv_chunks(path, chunk_size, column=0, delimiter=',', skip_header=False, dtype=float):
+    """
+    Reads a CSV file in chunks of chunk_size rows. Each chunk is a 1-D array holding the given column, or a 2-D array
+    of every column if column is None.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        if skip_header:
+            next(reader, None)
+        for rows in iter_chunks(reader, chunk_size):
+            rows = [row for row in rows if row]
+            if not rows:
+                continue
+            if column is None:
+                yield np.array(rows, dtype=dtype)
+            else:
+                yield np.array([row[column] for row in rows], dtype=dtype)
+
+
+def read_npy_chunks(path, chunk_size):
+    """
+    Reads a .npy file in chunks of chunk_size rows through a memory map, so the file is never loaded whole.
+    """
+    array = np.load(path, mmap_mode='r')
+    for start in range(0, array.shape[0], chunk_size):
+        yield np.array(array[start:start + chunk_size])
+
+
+def fit_iterable(cls, iterable, chunk_size=10000):
+    """
+    Fits cls to the elements of an iterator or generator with bounded memory.
+    """
+    return fit_stream(cls, iter_chunks(iterable, chunk_size))
+
+
+def group_fit(cls, keys, values, weights=None):
+    """
+    Fits one cls per distinct key in a single pass, where keys[i] is the key of values[i] and weights[i], if given,
+    its weight. The keys are grouped by sorting once and cls.fit_groups reduces each group. Returns a
+    GroupedStatistic, which merges with other grouped results key by key.
+    """
+    unique_keys, group_index = np.unique(np.asarray(keys), return_inverse=True)
+    group_index = group_index.reshape(-1)
+    statistics = cls.fit_groups(group_index, values, len(unique_keys), weights=weights)
+    return GroupedStatistic(cls, dict(zip(unique_keys.tolist(), statistics)))
+
+
+def fit_shared(model_classes, data, weights=None):
+    """
+    Fits several composite models to the same data, computing each underlying sufficient statistic once. The root
+    statistic classes of all models are collected, those maintained by another collected class (see
+    AbstractGroupStatistic.PROVIDES) are dropped, and each remaining class is fitted in a single pass. Every model
+    is then assembled from copies of the fitted statistics, so the returned models do not share state.
+    """
+    statistic_classes = []
+    for model_cls in model_classes:
+        for _, statistic_cls in model_cls.get_statistic_graph()[0]:
+            if statistic_cls not in statistic_classes:
+                statistic_classes.append(statistic_cls)
+    statistic_classes = [cls for cls in statistic_classes
+                         if not any(cls is provided_cls for provider_cls in statistic_classes
+                                    for _, provided_cls in provider_cls.PROVIDES)]
+    fitted = [(cls, _fit_chunk(cls, data, weights)) for cls in statistic_classes]
+
+    def lookup(statistic_cls):
+        for cls, statistic in fitted:
+            if cls is statistic_cls:
+                return statistic
+            for attribute, provided_cls in cls.PROVIDES:
+                if provided_cls is statistic_cls:
+                    return getattr(statistic, attribute)
+
+    return [model_cls.from_statistic_values({name: lookup(statistic_cls) | statistic_cls.get_identity()
+                                             for name, statistic_cls in model_cls.get_statistic_graph()[0]})
+            for model_cls in model_classes]
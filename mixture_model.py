@@ -0,0 +1,290 @@
+"""
+Finite mixtures of the density models, fitted with expectation maximization. The E-step of every iteration reduces
+the data to responsibility-weighted sufficient statistics (a MixtureStatistics, which is itself a group statistic), so
+it runs as a map over data chunks followed by a | reduce, serially or in a worker pool. The M-step rebuilds each
+component from its share of the statistics through from_statistic_values.
+"""
+import math
+
+import numpy as np
+
+import serialization
+from algebraic_statistic import AbstractGroupStatistic, Mean, Variance, _to_scalar
+from fitting import _chunk, _make_pool, tree_reduce
+
+
+def logsumexp(values, axis=-1):
+    """
+    log(sum(exp(values))) along axis, computed without overflow.
+    """
+    maximum = np.max(values, axis=axis, keepdims=True)
+    maximum = np.where(np.isfinite(maximum), maximum, 0)
+    with np.errstate(divide='ignore'):
+        return np.log(np.sum(np.exp(values - maximum), axis=axis)) + np.squeeze(maximum, axis=axis)
+
+
+class MixtureStatistics(AbstractGroupStatistic):
+    """
+    Weighted sufficient statistics of the components of a mixture: for each component k its total responsibility
+    n[k] and the responsibility-weighted mean[k] and sum of squared deviations sum_square_distance[k] of the data,
+    plus the log likelihood of the data under the mixture that produced the responsibilities. Merges use the same
+    pairwise update as Variance, elementwise over the components. The empty statistic is the identity.
+    """
+    __slots__ = ('n', 'mean', 'sum_square_distance', 'log_likelihood')
+
+    def __init__(self, n=None, mean=None, sum_square_distance=None, log_likelihood=0.0):
+        if n is None:
+            n, mean, sum_square_distance = [], [], []
+        self.n = np.array(n, dtype=np.float64)
+        self.mean = np.array(mean, dtype=np.float64)
+        self.sum_square_distance = np.array(sum_square_distance, dtype=np.float64)
+        self.log_likelihood = log_likelihood
+
+    @classmethod
+    def from_responsibilities(cls, responsibilities, X, log_likelihood=0.0):
+        """
+        responsibilities has one row per point of X and one column per component.
+        """
+        responsibilities = np.asarray(responsibilities, dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        points = X.reshape(len(X), -1)
+        n = responsibilities.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n[:, None] > 0, responsibilities.T.dot(points) / n[:, None], 0)
+        deviations = points[:, None, :] - mean[None, :, :]
+        sum_square_distance = np.einsum('ik,ikd->kd', responsibilities, deviations * deviations)
+        shape = (len(n),) + X.shape[1:]
+        return cls(n, mean.reshape(shape), sum_square_distance.reshape(shape), log_likelihood)
+
+    def get_n(self):
+        return self.n
+
+    def get_mean(self):
+        return self.mean
+
+    def get_sum_square_distance(self):
+        return self.sum_square_distance
+
+    def get_log_likelihood(self):
+        return self.log_likelihood
+
+    def is_identity(self):
+        return len(self) == 0
+
+    def __len__(self):
+        return len(self.n)
+
+    def _broadcast_n(self, n):
+        return n.reshape((-1,) + (1,) * (self.mean.ndim - 1))
+
+    def _merged(self, other, sign):
+        if len(other) == 0:
+            return MixtureStatistics(self.n, self.mean, self.sum_square_distance, self.log_likelihood)
+        if len(self) == 0:
+            return MixtureStatistics(sign * other.n, other.mean, sign * other.sum_square_distance,
+                                     sign * other.log_likelihood)
+        if self.mean.shape != other.mean.shape:
+            raise ValueError('Cannot merge MixtureStatistics of shapes {0} and {1}'.format(
+                self.mean.shape, other.mean.shape))
+        n_a, n_b = self._broadcast_n(self.n), self._broadcast_n(sign * other.n)
+        merged_n = n_a + n_b
+        delta = other.mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            merged_mean = (n_a * self.mean + n_b * other.mean) / merged_n
+            merged_sum_square_distance = self.sum_square_distance + sign * other.sum_square_distance \
+                                       + delta * delta * (n_a * n_b / merged_n)
+        emptied = np.broadcast_to(merged_n == 0, merged_mean.shape) # Handle subtracting all elements
+        merged_mean[emptied] = 0
+        merged_sum_square_distance[emptied] = 0
+        return MixtureStatistics(merged_n.reshape(-1), merged_mean, merged_sum_square_distance,
+                                 self.log_likelihood + sign * other.log_likelihood)
+
+    def __or__(self, other):
+        return self._merged(other, 1)
+
+    def __sub__(self, other):
+        return self._merged(other, -1)
+
+    def __neg__(self):
+        return MixtureStatistics(-self.n, self.mean, -self.sum_square_distance, -self.log_likelihood)
+
+    def __eq__(self, other):
+        return np.array_equal(self.n, other.n) and np.array_equal(self.mean, other.mean) \
+               and np.array_equal(self.sum_square_distance, other.sum_square_distance) \
+               and self.log_likelihood == other.log_likelihood
+
+    def _pack_payload(self):
+        return serialization.pack_array(self.n) + serialization.pack_array(self.mean) \
+               + serialization.pack_array(self.sum_square_distance) + serialization.pack_number(self.log_likelihood)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        n, offset = serialization.unpack_array(buffer, offset)
+        mean, offset = serialization.unpack_array(buffer, offset)
+        sum_square_distance, offset = serialization.unpack_array(buffer, offset)
+        log_likelihood, offset = serialization.unpack_number(buffer, offset)
+        return cls(n, mean, sum_square_distance, log_likelihood), offset
+
+
+def _component_statistic(statistic_cls, n, mean, sum_square_distance):
+    m = Mean()
+    m.set_n(n)
+    m.set_mean(_to_scalar(mean))
+    if issubclass(statistic_cls, Mean):
+        return m
+    if issubclass(statistic_cls, Variance):
+        v = Variance()
+        v.mean = m
+        v.sum_square_distance = _to_scalar(sum_square_distance)
+        return v
+    raise ValueError('Mixture components must be built from Mean and Variance statistics, not {0}'.format(
+        statistic_cls.__name__))
+
+
+def _projection(X):
+    # A fixed scalar projection of each point, used to spread the initial responsibilities over the data
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        return X
+    points = X.reshape(len(X), -1)
+    return points.dot(np.arange(1, points.shape[1] + 1))
+
+
+def _initial_statistics(chunk, cut_points, mixing, weights=None):
+    n_components = len(cut_points) + 1
+    assignment = np.searchsorted(cut_points, _projection(chunk), side='right')
+    responsibilities = np.full((len(chunk), n_components), mixing / n_components)
+    responsibilities[np.arange(len(chunk)), assignment] += 1 - mixing
+    if weights is not None:
+        responsibilities *= np.asarray(weights, dtype=np.float64)[:, None]
+    return MixtureStatistics.from_responsibilities(responsibilities, chunk)
+
+
+def _expectation_chunk(model, chunk, weights=None):
+    return model.expectation(chunk, weights)
+
+
+class MixtureModel(object):
+    """
+    A weighted mixture of density models of one class, such as NormalDistribution, PoissonDistribution or
+    CategoricalDistribution. pdf, log_pdf and predict_proba accept a point or an array of points like the components.
+    """
+    # Components whose total responsibility falls below this keep their previous parameters in the M-step
+    MIN_COMPONENT_WEIGHT = 2.0
+    INITIALIZATION_SAMPLE_SIZE = 10000
+    INITIALIZATION_MIXING = 0.1
+
+    def __init__(self, components, weights=None):
+        self.components = list(components)
+        if weights is None:
+            weights = np.full(len(self.components), 1.0 / len(self.components))
+        self.weights = np.asarray(weights, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            self.log_weights = np.log(self.weights)
+
+    def get_components(self):
+        return self.components
+
+    def get_weights(self):
+        return self.weights
+
+    def _weighted_log_pdfs(self, X):
+        # The components keep their cached parameters between calls, so only the data dependent part is computed
+        return np.stack([np.asarray(c.log_pdf(X), dtype=np.float64) for c in self.components], axis=-1) \
+               + self.log_weights
+
+    def log_pdf(self, X):
+        return logsumexp(self._weighted_log_pdfs(X))
+
+    def pdf(self, X):
+        return np.exp(self.log_pdf(X))
+
+    def predict_proba(self, X):
+        """
+        The posterior probability of each component for each point, in the last axis.
+        """
+        weighted_log_pdfs = self._weighted_log_pdfs(X)
+        return np.exp(weighted_log_pdfs - logsumexp(weighted_log_pdfs)[..., None])
+
+    def predict(self, X):
+        return np.argmax(self._weighted_log_pdfs(X), axis=-1)
+
+    def expectation(self, X, weights=None):
+        """
+        E-step over an array of points: returns their responsibility-weighted MixtureStatistics. With weights, the
+        responsibilities and log likelihood of point i are scaled by weights[i].
+        """
+        weighted_log_pdfs = self._weighted_log_pdfs(X)
+        log_normalizers = logsumexp(weighted_log_pdfs)
+        responsibilities = np.exp(weighted_log_pdfs - log_normalizers[:, None])
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            responsibilities *= weights[:, None]
+            log_normalizers = weights * log_normalizers
+        return MixtureStatistics.from_responsibilities(responsibilities, X, float(log_normalizers.sum()))
+
+    def maximization(self, statistics):
+        """
+        M-step: returns the mixture fitted to statistics.
+        """
+        component_cls = type(self.components[0])
+        return self._from_statistics(component_cls, statistics, self.components)
+
+    @classmethod
+    def _from_statistics(cls, component_cls, statistics, previous_components=None):
+        components = []
+        for k in range(len(statistics)):
+            n = statistics.get_n()[k]
+            if previous_components is not None and n < cls.MIN_COMPONENT_WEIGHT:
+                components.append(previous_components[k])
+                continue
+            components.append(component_cls.from_statistic_values({
+                name: _component_statistic(statistic_cls, n, statistics.get_mean()[k],
+                                           statistics.get_sum_square_distance()[k])
+                for name, statistic_cls in component_cls.get_statistic_graph()[0]}))
+        return cls(components, statistics.get_n() / statistics.get_n().sum())
+
+    @classmethod
+    def fit(cls, component_cls, n_components, data, max_iterations=100, tolerance=1e-8, n_workers=1,
+            chunk_size=None, executor='process', random_state=None, weights=None):
+        """
+        Fits a mixture of n_components component_cls models to data (an array of points, which may be a memory map)
+        with EM, stopping when the relative improvement of the log likelihood falls below tolerance. weights, if
+        given, holds the weight of each point.
+
+        Every E-step maps the chunks of chunk_size points to MixtureStatistics and tree-reduces them; with n_workers
+        above 1 the map runs in a pool (see fitting.fit_parallel for the executor choice). The initial
+        responsibilities split the data at quantiles of a sample drawn with random_state, which defaults to a fixed
+        seed so that fits are reproducible.
+        """
+        data = np.asarray(data)
+        if random_state is None:
+            random_state = np.random.RandomState(0)
+        if chunk_size is None:
+            chunk_size = int(math.ceil(1.0 * len(data) / n_workers))
+        chunks = _chunk(data, chunk_size)
+        weight_chunks = [None] * len(chunks) if weights is None else _chunk(np.asarray(weights), chunk_size)
+        sample = data[np.sort(random_state.choice(len(data), min(len(data), cls.INITIALIZATION_SAMPLE_SIZE),
+                                                  replace=False))]
+        cut_points = np.quantile(_projection(sample), np.linspace(0, 1, n_components + 1)[1:-1])
+
+        pool = _make_pool(executor, n_workers) if n_workers > 1 and len(chunks) > 1 else None
+        parallel_map = map if pool is None else pool.map
+        try:
+            statistics = tree_reduce(parallel_map(_initial_statistics, chunks, [cut_points] * len(chunks),
+                                                  [cls.INITIALIZATION_MIXING] * len(chunks), weight_chunks))
+            model = cls._from_statistics(component_cls, statistics)
+            previous_log_likelihood = None
+            for iteration in range(max_iterations):
+                statistics = tree_reduce(parallel_map(_expectation_chunk, [model] * len(chunks), chunks,
+                                                      weight_chunks))
+                model = model.maximization(statistics)
+                log_likelihood = statistics.get_log_likelihood()
+                if previous_log_likelihood is not None and \
+                        abs(log_likelihood - previous_log_likelihood) <= tolerance * abs(log_likelihood):
+                    break
+                previous_log_likelihood = log_likelihood
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return model
@@ -0,0 +1,182 @@
+"""
+A naive Bayes classifier assembled from the density models. The class prior is a Frequency of the labels and every
+feature is a GroupedStatistic holding one density model per label, so the classifier is itself a group statistic:
+classifiers fitted on shards merge with |, new data is added with |= or update, and data is forgotten with -.
+"""
+import math
+
+import numpy as np
+
+from algebraic_statistic import AbstractGroupStatistic, Frequency, GroupedStatistic, cached_parameter
+from density_model import NormalDistribution
+from fitting import fit_parallel, group_fit, tree_reduce
+from mixture_model import logsumexp
+
+
+class NaiveBayes(AbstractGroupStatistic):
+    """
+    FEATURE_MODELS lists the features as (model class, columns) pairs, where columns selects X[:, columns]. A single
+    column gives one univariate model; a list or slice of columns gives one model fitted to the block, which for the
+    univariate models (NormalDistribution, BernoulliDistribution, PoissonDistribution, ...) means independent
+    parameters per column, and for CategoricalDistribution one one-hot encoded feature. By default every column is
+    normally distributed. Subclass and override FEATURE_MODELS to configure the classifier.
+
+    predict_log_proba scores a whole (n, d) array with one log_pdf call per feature and label, summing the log
+    densities in log space. NormalDistribution features are scored for all labels at once from their means and
+    variances, each variance increased by VAR_SMOOTHING times the largest variance of the feature's columns over all
+    labels, so that labels with a single row or a constant column still get finite densities.
+    """
+    __slots__ = ('prior', 'features', '_cache')
+
+    FEATURE_MODELS = [(NormalDistribution, slice(None))]
+    VAR_SMOOTHING = 1e-9
+
+    def __init__(self, X=None, labels=None, weights=None):
+        """
+        X is an (n, d) array of features and labels holds the label of each row. With weights, row i counts
+        weights[i] times in the prior and in every feature model.
+        """
+        self._cache = {}
+        if X is None:
+            self.prior = Frequency()
+            self.features = [GroupedStatistic(model_cls) for model_cls, _ in self.FEATURE_MODELS]
+            return
+        X, labels = np.asarray(X), np.asarray(labels)
+        self.prior = Frequency(labels.tolist(), weights=weights)
+        self.features = [group_fit(model_cls, labels, X[:, columns], weights=weights)
+                         for model_cls, columns in self.FEATURE_MODELS]
+
+    @classmethod
+    def fit(cls, X, labels, weights=None, n_workers=1, chunk_size=None, executor='process'):
+        """
+        Fits a classifier on chunks of chunk_size rows and tree-reduces them; with n_workers above 1 the chunks are
+        fitted in a pool (see fitting.fit_parallel, which this calls).
+        """
+        return fit_parallel(cls, np.asarray(X), n_workers, chunk_size, executor,
+                            weights=None if weights is None else np.asarray(weights), labels=np.asarray(labels))
+
+    def get_prior(self):
+        return self.prior
+
+    def get_features(self):
+        return self.features
+
+    def is_identity(self):
+        return not self.prior.get_counter() and all(feature.is_identity() for feature in self.features)
+
+    def update(self, x, label):
+        """
+        Adds the single row x with the given label in place and returns self.
+        """
+        return self.__ior__(self.__class__(np.asarray(x)[None], [label]))
+
+    def __or__(self, other):
+        result = self.__class__()
+        result.prior = self.prior | other.prior
+        result.features = [a | b for a, b in zip(self.features, other.features)]
+        return result
+
+    def __neg__(self):
+        result = self.__class__()
+        result.prior = -self.prior
+        result.features = [-feature for feature in self.features]
+        return result
+
+    def __ior__(self, other):
+        self.prior |= other.prior
+        for i, other_feature in enumerate(other.features):
+            self.features[i] |= other_feature
+        self._cache.clear()
+        return self
+
+    def __isub__(self, other):
+        self.prior -= other.prior
+        for i, other_feature in enumerate(other.features):
+            self.features[i] -= other_feature
+        self._cache.clear()
+        return self
+
+    def __eq__(self, other):
+        return self.prior == other.prior and all(a == b for a, b in zip(self.features, other.features))
+
+    def _pack_payload(self):
+        return self.prior._pack_payload() + b''.join(feature._pack_payload() for feature in self.features)
+
+    @classmethod
+    def _unpack_payload(cls, buffer, offset):
+        result = cls()
+        result.prior, offset = Frequency._unpack_payload(buffer, offset)
+        for i in range(len(result.features)):
+            result.features[i], offset = GroupedStatistic._unpack_payload(buffer, offset)
+        return result, offset
+
+    @cached_parameter
+    def get_classes(self):
+        """
+        The labels with a positive count, sorted: the order of the last axis of predict_log_proba.
+        """
+        return sorted(label for label, count in self.prior.get_counter().items() if count > 0)
+
+    @cached_parameter
+    def _log_prior(self):
+        counts = np.array([self.prior.get_counter()[label] for label in self.get_classes()], dtype=np.float64)
+        return np.log(counts) - math.log(counts.sum())
+
+    @cached_parameter
+    def _normal_parameters(self):
+        # For each NormalDistribution feature, the means and smoothed variances of the labels in get_classes(),
+        # stacked along the first axis; None for the other features
+        parameters = []
+        for (model_cls, _), feature in zip(self.FEATURE_MODELS, self.features):
+            if not issubclass(model_cls, NormalDistribution):
+                parameters.append(None)
+                continue
+            variances = [feature[label]['variance'] for label in self.get_classes()]
+            means = np.array([variance.mean.get_mean() for variance in variances], dtype=np.float64)
+            sum_square_distances = np.array([variance.get_sum_square_distance() for variance in variances],
+                                            dtype=np.float64)
+            n = np.array([variance.mean.get_n() for variance in variances], dtype=np.float64)
+            n = n.reshape((-1,) + (1,) * (sum_square_distances.ndim - 1))
+            total = tree_reduce(variances)
+            largest = np.max(total.get_sum_square_distance()) / max(total.mean.get_n() - 1, 1)
+            smoothing = self.VAR_SMOOTHING * (largest if largest > 0 else 1.0)
+            parameters.append((means, sum_square_distances / np.maximum(n - 1, 1) + smoothing))
+        return parameters
+
+    def joint_log_likelihood(self, X):
+        """
+        log P(label) + log P(x | label) for each row of X and each label in get_classes(), in the last axis. X is an
+        (n, d) array or a single row of d features.
+        """
+        X = np.asarray(X)
+        if X.ndim == 1:
+            return self.joint_log_likelihood(X[None])[0]
+        classes = self.get_classes()
+        if not classes:
+            raise ValueError('The classifier has no classes: it was not fitted, or all its data was forgotten')
+        joint = np.empty((len(X), len(classes)))
+        joint[:] = self._log_prior()
+        for (_, columns), feature, parameters in zip(self.FEATURE_MODELS, self.features, self._normal_parameters()):
+            values = X[:, columns]
+            if parameters is not None:
+                means, variances = parameters
+                log_pdf = -0.5 * (np.log(2 * math.pi * variances) + (values[:, None] - means)**2 / variances)
+                joint += log_pdf.sum(axis=2) if log_pdf.ndim > 2 else log_pdf
+                continue
+            for k, label in enumerate(classes):
+                log_pdf = feature[label].log_pdf(values)
+                joint[:, k] += log_pdf.sum(axis=1) if log_pdf.ndim > 1 else log_pdf
+        return joint
+
+    def predict_log_proba(self, X):
+        joint = self.joint_log_likelihood(X)
+        return joint - logsumexp(joint)[..., None]
+
+    def predict_proba(self, X):
+        return np.exp(self.predict_log_proba(X))
+
+    def predict(self, X):
+        """
+        The most probable label of each row of X.
+        """
+        return np.asarray(self.get_classes())[np.argmax(self.joint_log_likelihood(X), axis=-1)]
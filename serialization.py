@@ -0,0 +1,179 @@
+"""
+Building blocks of the binary wire format used by AbstractGroupStatistic.to_bytes and from_bytes.
+
+Every message starts with MAGIC, a one byte FORMAT_VERSION and the 'module:qualname' name of the statistic class,
+followed by the class's payload. Payloads are built from fixed-width little-endian fields: numbers are tagged
+int64/float64 values or arrays (float64, or integers in the narrowest of int8 to int64 that fits), and key collections
+use a packed layout with one array per field instead of per-object records. Readers return the decoded value along
+with the offset just past it, so payloads can be nested.
+"""
+import numbers
+import struct
+
+import numpy as np
+
+MAGIC = b'ALGS'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<4sBH')
+_UINT8 = struct.Struct('<B')
+_UINT16 = struct.Struct('<H')
+_UINT64 = struct.Struct('<Q')
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+
+_ARRAY_DTYPES = {b'i': np.dtype('<i8'), b'd': np.dtype('<f8'), b'1': np.dtype('<i1'), b'2': np.dtype('<i2'),
+                 b'4': np.dtype('<i4')}
+_NARROW_INT_TAGS = [b'1', b'2', b'4']
+
+
+def pack_header(name):
+    encoded = name.encode('utf-8')
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded)) + encoded
+
+
+def unpack_header(buffer):
+    magic, version, name_length = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a serialized statistic: bad magic {0!r}'.format(magic))
+    if version > FORMAT_VERSION:
+        raise ValueError('Unsupported format version {0}, expected at most {1}'.format(version, FORMAT_VERSION))
+    offset = _HEADER.size
+    name = bytes(buffer[offset:offset + name_length]).decode('utf-8')
+    return name, offset + name_length
+
+
+def pack_string(value):
+    encoded = value.encode('utf-8')
+    return _UINT16.pack(len(encoded)) + encoded
+
+
+def unpack_string(buffer, offset):
+    length = _UINT16.unpack_from(buffer, offset)[0]
+    offset += _UINT16.size
+    return bytes(buffer[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def _int_tag(array):
+    # Integer arrays are stored in the narrowest width that holds every value
+    if array.size:
+        low, high = int(array.min()), int(array.max())
+        for tag in _NARROW_INT_TAGS:
+            info = np.iinfo(_ARRAY_DTYPES[tag])
+            if info.min <= low and high <= info.max:
+                return tag
+    return b'i'
+
+
+def pack_array(array):
+    array = np.asarray(array)
+    tag = _int_tag(array) if array.dtype.kind in 'iub' else b'd'
+    array = np.ascontiguousarray(array, dtype=_ARRAY_DTYPES[tag])
+    shape = b''.join(_UINT64.pack(d) for d in array.shape)
+    return tag + _UINT8.pack(array.ndim) + shape + array.tobytes()
+
+
+def unpack_array(buffer, offset):
+    """
+    Reads an array without copying: the result is a read-only view of buffer. Narrow integer arrays are widened to
+    int64, which does copy.
+    """
+    dtype = _ARRAY_DTYPES[bytes(buffer[offset:offset + 1])]
+    ndim = _UINT8.unpack_from(buffer, offset + 1)[0]
+    offset += 2
+    shape = struct.unpack_from('<{0}Q'.format(ndim), buffer, offset)
+    offset += ndim * _UINT64.size
+    count = int(np.prod(shape, dtype=np.int64))
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+    if dtype.itemsize < 8:
+        array = array.astype(np.int64)
+    return array, offset + count * dtype.itemsize
+
+
+def pack_number(value):
+    """
+    Packs an int, a float or an ndarray (such as the vector mean of a Mean) into a tagged fixed-width field.
+    """
+    if isinstance(value, np.ndarray):
+        return b'a' + pack_array(value)
+    if isinstance(value, numbers.Integral):
+        return b'i' + _INT64.pack(int(value))
+    return b'd' + _FLOAT64.pack(float(value))
+
+
+def unpack_number(buffer, offset):
+    tag = bytes(buffer[offset:offset + 1])
+    offset += 1
+    if tag == b'i':
+        return _INT64.unpack_from(buffer, offset)[0], offset + _INT64.size
+    if tag == b'd':
+        return _FLOAT64.unpack_from(buffer, offset)[0], offset + _FLOAT64.size
+    if tag == b'a':
+        return unpack_array(buffer, offset)
+    raise ValueError('Unknown number tag {0!r}'.format(tag))
+
+
+def _key_kind(keys):
+    if all(isinstance(k, numbers.Integral) for k in keys):
+        return b'i'
+    if all(isinstance(k, numbers.Real) for k in keys):
+        return b'd'
+    if all(isinstance(k, str) for k in keys):
+        return b's'
+    if all(isinstance(k, bytes) for k in keys):
+        return b'b'
+    raise ValueError('Keys must all be numbers, all str or all bytes to be serialized')
+
+
+def pack_keys(keys):
+    """
+    Packs a list of keys as one array: integers or float64 for numbers, or an array of lengths followed by the
+    concatenated encoded values for str and bytes.
+    """
+    keys = list(keys)
+    kind = _key_kind(keys)
+    if kind in (b'i', b'd'):
+        return kind + pack_array(np.array(keys, dtype=_ARRAY_DTYPES[kind]))
+    encoded = [k.encode('utf-8') for k in keys] if kind == b's' else keys
+    return kind + pack_array(np.array([len(e) for e in encoded], dtype=np.int64)) + b''.join(encoded)
+
+
+def unpack_keys(buffer, offset):
+    kind = bytes(buffer[offset:offset + 1])
+    array, offset = unpack_array(buffer, offset + 1)
+    if kind == b'i':
+        return [int(k) for k in array], offset
+    if kind == b'd':
+        return [float(k) for k in array], offset
+    keys = []
+    for length in array:
+        value = bytes(buffer[offset:offset + length])
+        keys.append(value.decode('utf-8') if kind == b's' else value)
+        offset += int(length)
+    return keys, offset
+
+
+BATCH_MAGIC = b'ALGB'
+_BATCH_HEADER = struct.Struct('<4sBcxxQ')
+BATCH_HEADER_SIZE = _BATCH_HEADER.size
+
+
+def pack_batch_header(key_kind, length):
+    """
+    Header of the batch file format: MAGIC, version, key kind (b'n' for no keys, b'i' or b'd') and the number of
+    rows, padded to 16 bytes so that the float64 columns which follow stay 8-byte aligned for memory mapping.
+    """
+    return _BATCH_HEADER.pack(BATCH_MAGIC, FORMAT_VERSION, key_kind, length)
+
+
+def unpack_batch_header(buffer):
+    magic, version, key_kind, length = _BATCH_HEADER.unpack_from(buffer, 0)
+    if magic != BATCH_MAGIC:
+        raise ValueError('Not a statistic batch file: bad magic {0!r}'.format(magic))
+    if version > FORMAT_VERSION:
+        raise ValueError('Unsupported format version {0}, expected at most {1}'.format(version, FORMAT_VERSION))
+    return key_kind, length
+
+
+def batch_key_dtype(key_kind):
+    return _ARRAY_DTYPES.get(key_kind)
@@ -0,0 +1,159 @@
+"""
+Rolling statistics over the most recent data. A group statistic can drop its oldest chunk by subtracting it, so the
+window is kept up to date with one merge and one subtraction per update instead of a refit. Statistics that only form
+a monoid (no __neg__) fall back to the two-stack queue, which needs amortized O(1) merges per update.
+"""
+from collections import deque
+
+
+class _SubtractingAggregator(object):
+    def __init__(self, statistic_cls):
+        self.statistic_cls = statistic_cls
+        self.statistics = deque()
+        self.total = statistic_cls.get_identity()
+
+    def push(self, statistic):
+        self.statistics.append(statistic)
+        self.total |= statistic
+
+    def pop(self):
+        self.total -= self.statistics.popleft()
+
+    def query(self):
+        return self.total | self.statistic_cls.get_identity()
+
+    def __len__(self):
+        return len(self.statistics)
+
+
+class _TwoStackAggregator(object):
+    """
+    Queue aggregation without inverses. New statistics go onto the back stack, which keeps a running total. When
+    the front stack runs empty the back stack is flipped onto it, storing with each element the aggregate of itself
+    and everything newer on the front stack, so the oldest element can be dropped by a plain pop.
+    """
+    def __init__(self, statistic_cls):
+        self.statistic_cls = statistic_cls
+        self.front = []
+        self.back = []
+        self.back_total = statistic_cls.get_identity()
+
+    def push(self, statistic):
+        self.back.append(statistic)
+        self.back_total = self.back_total | statistic
+
+    def pop(self):
+        if not self.front:
+            aggregate = self.statistic_cls.get_identity()
+            for statistic in reversed(self.back):
+                aggregate = statistic | aggregate
+                self.front.append((statistic, aggregate))
+            self.back = []
+            self.back_total = self.statistic_cls.get_identity()
+        self.front.pop()
+
+    def query(self):
+        if not self.front:
+            return self.back_total | self.statistic_cls.get_identity()
+        return self.front[-1][1] | self.back_total
+
+    def __len__(self):
+        return len(self.front) + len(self.back)
+
+
+def _make_aggregator(statistic_cls):
+    if statistic_cls.is_invertible():
+        return _SubtractingAggregator(statistic_cls)
+    return _TwoStackAggregator(statistic_cls)
+
+
+class SlidingWindow(object):
+    """
+    Keeps statistic_cls fitted to the last `window` updates, where each update is a chunk of data (or a single
+    pre-built statistic).
+    """
+    def __init__(self, statistic_cls, window):
+        if window < 1:
+            raise ValueError('window must be at least 1, got {0}'.format(window))
+        self.statistic_cls = statistic_cls
+        self.window = window
+        self._aggregator = _make_aggregator(statistic_cls)
+
+    def update(self, data):
+        self.update_statistic(self.statistic_cls(data))
+
+    def update_statistic(self, statistic):
+        self._aggregator.push(statistic)
+        if len(self._aggregator) > self.window:
+            self._aggregator.pop()
+
+    def get_statistic(self):
+        return self._aggregator.query()
+
+    def __len__(self):
+        return len(self._aggregator)
+
+
+class TimeBucketedWindow(object):
+    """
+    Keeps statistic_cls fitted to the data of the last n_buckets time buckets of width bucket_width. Each bucket
+    holds a partial statistic in a ring buffer; when time moves past a bucket its partial is subtracted from the
+    running total and the slot is reused. Monoid-only statistics merge the live buckets on query instead.
+    """
+    def __init__(self, statistic_cls, bucket_width, n_buckets):
+        if n_buckets < 1:
+            raise ValueError('n_buckets must be at least 1, got {0}'.format(n_buckets))
+        self.statistic_cls = statistic_cls
+        self.bucket_width = bucket_width
+        self.n_buckets = n_buckets
+        self._invertible = statistic_cls.is_invertible()
+        self._buckets = [statistic_cls.get_identity() for i in range(n_buckets)]
+        self._latest_bucket = None
+        self._total = statistic_cls.get_identity()
+
+    def _bucket_id(self, timestamp):
+        return int(timestamp // self.bucket_width)
+
+    def advance(self, timestamp):
+        """
+        Moves the window forward to timestamp, expiring every bucket that falls out of it.
+        """
+        bucket_id = self._bucket_id(timestamp)
+        if self._latest_bucket is None:
+            self._latest_bucket = bucket_id
+            return
+        if bucket_id <= self._latest_bucket:
+            return
+        for expired in range(self._latest_bucket + 1, min(bucket_id, self._latest_bucket + self.n_buckets) + 1):
+            slot = expired % self.n_buckets
+            if self._invertible:
+                self._total -= self._buckets[slot]
+            self._buckets[slot] = self.statistic_cls.get_identity()
+        self._latest_bucket = bucket_id
+
+    def update(self, timestamp, data):
+        return self.update_statistic(timestamp, self.statistic_cls(data))
+
+    def update_statistic(self, timestamp, statistic):
+        """
+        Adds statistic to the bucket of timestamp. Returns False, dropping the statistic, if the bucket has already
+        left the window.
+        """
+        self.advance(timestamp)
+        bucket_id = self._bucket_id(timestamp)
+        if bucket_id <= self._latest_bucket - self.n_buckets:
+            return False
+        self._buckets[bucket_id % self.n_buckets] |= statistic
+        if self._invertible:
+            self._total |= statistic
+        return True
+
+    def get_statistic(self, timestamp=None):
+        if timestamp is not None:
+            self.advance(timestamp)
+        if self._invertible:
+            return self._total | self.statistic_cls.get_identity()
+        result = self.statistic_cls.get_identity()
+        for bucket in self._buckets:
+            result = result | bucket
+        return result
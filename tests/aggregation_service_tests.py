@@ -0,0 +1,179 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from aggregation_service import AggregationServer, AggregationClient, AggregationError, pack_frame
+from algebraic_statistic import Mean, Variance, Frequency, Covariance
+from density_model import NormalDistribution
+
+_merge_started, _release_merge = threading.Event(), threading.Event()
+
+
+class BlockingMean(Mean):
+    # A Mean whose merges wait until the test releases them
+    __slots__ = ()
+
+    def __or__(self, other):
+        _merge_started.set()
+        _release_merge.wait(5)
+        merged = BlockingMean()
+        merged.n, merged.mean = self.n + other.n, (self.n * self.mean + other.n * other.mean) / (self.n + other.n)
+        return merged
+
+
+class AggregationServiceTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = AggregationServer(max_queue_size=4, max_batch_size=8)
+        self.host, self.port = (await self.server.start())[:2]
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def _connect(self):
+        client = await AggregationClient.connect(self.host, self.port)
+        self.addAsyncCleanup(client.close)
+        return client
+
+    async def test_merges_partials_from_many_producers(self):
+        chunks = np.array_split(np.random.RandomState(0).normal(size=1000), 40)
+
+        async def produce(chunks):
+            client = await self._connect()
+            for chunk in chunks:
+                await client.push('latency', Variance(chunk))
+            await client.flush()
+
+        await asyncio.gather(*[produce(chunks[i::5]) for i in range(5)])
+        merged = await (await self._connect()).query('latency')
+        gold = Variance(np.concatenate(chunks))
+        self.assertIsInstance(merged, Variance)
+        self.assertAlmostEqual(gold.mean.get_n(), merged.mean.get_n())
+        self.assertAlmostEqual(gold.mean.get_mean(), merged.mean.get_mean())
+        self.assertAlmostEqual(gold.get_variance(), merged.get_variance())
+        self.assertEqual(40, self.server.get_stats()['merged'])
+        self.assertLessEqual(self.server.get_stats()['batches'], 40)
+
+    async def test_keys_are_independent(self):
+        client = await self._connect()
+        await client.push('words', Frequency(['a', 'b']))
+        await client.push('model', NormalDistribution([1.0, 2.0]))
+        await client.push('words', Frequency(['a']).to_bytes())
+        await client.flush()
+        self.assertEqual({'a': 2, 'b': 1}, (await client.query('words')).get_counter())
+        self.assertEqual(NormalDistribution([1.0, 2.0]), await client.query('model'))
+        self.assertIsNone(await client.query('missing'))
+
+    async def test_rejected_partials(self):
+        client = await self._connect()
+        await client.push('mean', Mean([1, 2, 3]))
+        await client.push('mean', Frequency([1]))
+        await client.push('mean', b'not a statistic')
+        with self.assertRaises(AggregationError):
+            await client.flush()
+        self.assertEqual(2, self.server.get_stats()['rejected'])
+        self.assertEqual(Mean([1, 2, 3]), await client.query('mean'))
+        await client.push('mean', Mean([4]))
+        await client.flush()
+        self.assertEqual(Mean([1, 2, 3, 4]), await client.query('mean'))
+
+    async def test_incompatible_partials_of_one_class(self):
+        client = await self._connect()
+        await client.push('covariance', Covariance(np.ones((3, 2))))
+        await client.flush()
+        await client.push('covariance', Covariance(np.ones((3, 3))))
+        await client.push('covariance', Covariance(np.zeros((2, 2))))
+        with self.assertRaises(AggregationError):
+            await asyncio.wait_for(client.flush(), 1)
+        self.assertEqual(1, self.server.get_stats()['rejected'])
+        merged = await client.query('covariance')
+        gold = Covariance(np.concatenate([np.ones((3, 2)), np.zeros((2, 2))]))
+        self.assertEqual(gold.get_n(), merged.get_n())
+        np.testing.assert_allclose(gold.get_covariance(), merged.get_covariance())
+        await client.push('covariance', Covariance(np.ones((1, 2))))
+        await asyncio.wait_for(client.flush(), 1)
+        self.assertEqual(6, (await client.query('covariance')).get_n())
+
+    async def test_query_while_queue_is_full(self):
+        producer, reader = await self._connect(), await self._connect()
+        await producer.push('mean', Mean([1.0]))
+        await producer.flush()
+        # Stop the merge worker so that the key's queue fills up and the producer stalls
+        self.server.keys['mean'].worker.cancel()
+        pushed = []
+
+        async def flood():
+            # The partials are never decoded, so their content does not matter
+            while True:
+                await producer.push('mean', bytes(1 << 20))
+                pushed.append(1)
+
+        stalled = asyncio.ensure_future(flood())
+        await asyncio.sleep(0.2)
+        self.assertTrue(self.server.keys['mean'].queue.full())
+        count = len(pushed)
+        self.assertEqual(Mean([1.0]), await asyncio.wait_for(reader.query('mean'), 1))
+        await asyncio.sleep(0.05)
+        self.assertEqual(count, len(pushed))
+        stalled.cancel()
+
+    async def test_query_during_slow_merge(self):
+        _merge_started.clear()
+        _release_merge.clear()
+        self.addCleanup(_release_merge.set)
+        producer, reader = await self._connect(), await self._connect()
+        await producer.push('mean', Mean([1.0]))
+        await producer.flush()
+        await producer.push('slow', BlockingMean([1.0]))
+        await producer.push('slow', BlockingMean([2.0]))
+        flushed = asyncio.ensure_future(producer.flush())
+        self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, _merge_started.wait, 1))
+        self.assertEqual(Mean([1.0]), await asyncio.wait_for(reader.query('mean'), 1))
+        await asyncio.wait_for(reader.query('slow'), 1)
+        self.assertFalse(flushed.done())
+        _release_merge.set()
+        await asyncio.wait_for(flushed, 1)
+        merged = await reader.query('slow')
+        self.assertEqual((2, 1.5), (merged.get_n(), merged.get_mean()))
+
+    async def test_flush_after_worker_stopped(self):
+        client = await self._connect()
+        await client.push('mean', Mean([1.0]))
+        await client.flush()
+        self.server.keys['mean'].worker.cancel()
+        await client.push('mean', Mean([2.0]))
+        with self.assertRaises(AggregationError):
+            await asyncio.wait_for(client.flush(), 1)
+
+    async def test_unknown_opcode(self):
+        client = await self._connect()
+        client.writer.write(pack_frame(b'X'))
+        with self.assertRaises(AggregationError):
+            await client.flush()
+
+
+class UnixSocketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_push_and_query(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'aggregation.sock')
+        server = AggregationServer()
+        await server.start(path=path)
+        try:
+            client = await AggregationClient.connect(path=path)
+            for chunk in [[1, 2], [3], [4, 5, 6]]:
+                await client.push('mean', Mean(chunk))
+            await client.flush()
+            self.assertEqual(Mean([1, 2, 3, 4, 5, 6]), await client.query('mean'))
+            self.assertEqual(Mean([1, 2, 3, 4, 5, 6]), server.get_statistic('mean'))
+            await client.close()
+        finally:
+            await server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
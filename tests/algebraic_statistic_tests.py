@@ -1,9 +1,13 @@
+import array
+import math
 import random
 import unittest
 
 import numpy as np
 
-from algebraic_statistic import Mean, Frequency, Variance
+from algebraic_statistic import Mean, Frequency, Variance, StatisticArray, ApproximateFrequency, \
+    QuantileSketch, Covariance, MetricsRegistry, enable_instrumentation, disable_instrumentation
+from density_model import NormalDistribution
 
 
 class AbstractGroupStatisticTest(unittest.TestCase):
@@ -21,9 +25,17 @@ class AbstractGroupStatisticTest(unittest.TestCase):
     def _assert_equal(self, s1, s2):
         raise NotImplementedError
 
+    def _concatenate(self, d1, d2):
+        return d1 + d2
+
+    def _repeat(self, data_set, counts):
+        if isinstance(data_set, np.ndarray):
+            return np.repeat(data_set, counts, axis=0)
+        return [x for x, count in zip(data_set, counts) for i in range(count)]
+
     def test_merge_correctness(self):
         d1, d2 = self._generate_data_sets([3, 4])
-        merged_dataset = d1 + d2
+        merged_dataset = self._concatenate(d1, d2)
         merged_dataset_m = self.STATISTIC_CLS(merged_dataset)
         m1, m2 = self.STATISTIC_CLS(d1), self.STATISTIC_CLS(d2)
         merged_algebraic_m = m1 | m2
@@ -67,6 +79,44 @@ class AbstractGroupStatisticTest(unittest.TestCase):
         merged_algebraic_m = m1 | m2 - m2
         self._assert_equal(m1, merged_algebraic_m)
 
+    def test_serialization_round_trip(self):
+        m = self.STATISTIC_CLS(self._generate_data_set(7))
+        decoded = self.STATISTIC_CLS.from_bytes(m.to_bytes())
+        self.assertIs(self.STATISTIC_CLS, type(decoded))
+        self._assert_equal(m, decoded)
+        self._assert_equal(self.STATISTIC_CLS.get_identity(),
+                           self.STATISTIC_CLS.from_bytes(self.STATISTIC_CLS.get_identity().to_bytes()))
+
+    def test_in_place_merge(self):
+        d1, d2 = self._generate_data_sets([3, 4])
+        m1, m2 = self.STATISTIC_CLS(d1), self.STATISTIC_CLS(d2)
+        merged_algebraic_m = m1 | m2
+        m1 |= m2
+        self._assert_equal(merged_algebraic_m, m1)
+        self._assert_equal(self.STATISTIC_CLS(d2), m2)
+
+    def test_update(self):
+        data = self._generate_data_sets([5])[0]
+        m = self.STATISTIC_CLS.get_identity()
+        for x in data:
+            self.assertIs(m, m.update(x))
+        self._assert_equal(self.STATISTIC_CLS(data), m)
+
+    def test_integer_weights(self):
+        data_set = self._generate_data_set(5)
+        counts = np.array([2, 0, 1, 3, 1])
+        self._assert_equal(self.STATISTIC_CLS(self._repeat(data_set, counts)),
+                           self.STATISTIC_CLS(data_set, weights=counts))
+
+    def test_in_place_sub(self):
+        d1, d2 = self._generate_data_sets([3, 4])
+        m1, m2 = self.STATISTIC_CLS(d1), self.STATISTIC_CLS(d2)
+        m = m1 | m2
+        m -= m2
+        self._assert_equal(m1, m)
+        m -= m1
+        self._assert_equal(self.STATISTIC_CLS.get_identity(), m)
+
 
 class MeanTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = Mean
@@ -93,6 +143,25 @@ class FrequencyTest(AbstractGroupStatisticTest):
     def _assert_equal(self, s1, s2):
         self.assertEqual(s1.get_counter(), s2.get_counter())
 
+    def test_in_place_merge_into_smaller(self):
+        small, large = Frequency([1, 2]), Frequency([2, 3, 4, 5, 5])
+        small |= large
+        self.assertEqual({1: 1, 2: 2, 3: 1, 4: 1, 5: 2}, small.get_counter())
+        self.assertEqual({2: 1, 3: 1, 4: 1, 5: 2}, large.get_counter())
+
+    def test_in_place_merge_of_larger_inverse(self):
+        a = Frequency([1])
+        a |= -Frequency([2, 3])
+        self.assertEqual((Frequency([1]) | -Frequency([2, 3])).get_counter(), a.get_counter())
+        self.assertEqual({1: 1}, a.get_counter())
+
+    def test_in_place_self_merge(self):
+        f = Frequency([1, 1, 2])
+        f |= f
+        self.assertEqual({1: 4, 2: 2}, f.get_counter())
+        f -= f
+        self.assertEqual({}, f.get_counter())
+
 
 class VectorMeanTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = Mean
@@ -120,4 +189,395 @@ class VarianceTest(AbstractGroupStatisticTest):
         return [random.randint(-1000, 1000) for i in range(size)]
 
     def _assert_equal(self, s1, s2):
-        self.assertAlmostEqual(s1.get_variance(), s2.get_variance(), places=6)
\ No newline at end of file
+        self.assertAlmostEqual(s1.get_variance(), s2.get_variance(), places=6)
+
+    def _offset_chunks(self):
+        return [np.random.normal(0, 1, size=100) + 1e9 for i in range(100)]
+
+    def test_large_offset_merge(self):
+        chunks = self._offset_chunks()
+        merged = Variance.get_identity()
+        for chunk in chunks:
+            merged = merged | Variance(list(chunk))
+        gold = np.var(np.concatenate(chunks), ddof=1)
+        self.assertAlmostEqual(1.0, merged.get_variance() / gold, places=6)
+
+    def test_large_offset_inverse(self):
+        chunks = self._offset_chunks()
+        v1, v2 = Variance(chunks[0]), Variance(chunks[1])
+        self.assertAlmostEqual(1.0, ((v1 | v2) - v2).get_variance() / v1.get_variance(), places=6)
+
+    def test_generator(self):
+        dataset = self._generate_data_set(50)
+        self._assert_equal(Variance(dataset), Variance(x for x in dataset))
+
+    def test_compensated(self):
+        dataset = list(np.random.normal(0, 1, size=1000) + 1e9)
+        gold = np.var(dataset, ddof=1)
+        self.assertAlmostEqual(1.0, Variance(dataset, compensated=True).get_variance() / gold, places=6)
+        exact_mean = math.fsum(dataset) / len(dataset)
+        self.assertAlmostEqual(exact_mean, Variance(dataset, compensated=True).mean.get_mean(), delta=1e-6)
+
+    def test_empty(self):
+        self._assert_equal(Variance(), Variance([]))
+
+
+class NumpyMeanTest(MeanTest):
+    def _generate_data_set(self, size):
+        return np.random.randint(-1000, 1000, size=size)
+
+    def _concatenate(self, d1, d2):
+        return np.concatenate([d1, d2])
+
+    def test_matches_list_path(self):
+        dataset = self._generate_data_set(100)
+        self._assert_equal(Mean(dataset), Mean(list(dataset)))
+
+    def test_buffer_protocol(self):
+        dataset = array.array('d', [1.0, 2.0, 4.5])
+        m = Mean(dataset)
+        self.assertEqual(3, m.get_n())
+        self.assertAlmostEqual(2.5, m.get_mean())
+
+    def test_columns(self):
+        dataset = np.random.uniform(-1000, 1000, size=(50, 3))
+        columns = Mean.from_columns(dataset)
+        self.assertEqual(3, len(columns))
+        for j, m in enumerate(columns):
+            self._assert_equal(m, Mean(list(dataset[:, j])))
+
+
+class NumpyVarianceTest(VarianceTest):
+    def _generate_data_set(self, size):
+        return np.random.randint(-1000, 1000, size=size)
+
+    def _concatenate(self, d1, d2):
+        return np.concatenate([d1, d2])
+
+    def test_matches_list_path(self):
+        dataset = self._generate_data_set(100)
+        self._assert_equal(Variance(dataset), Variance(list(dataset)))
+
+    def test_against_gold(self):
+        dataset = np.random.uniform(-1000, 1000, size=1000)
+        self.assertAlmostEqual(np.var(dataset, ddof=1), Variance(dataset).get_variance(), places=6)
+
+    def test_blocked(self):
+        dataset = np.random.normal(0, 1, size=Variance.BLOCK_SIZE * 3 + 17) + 1e9
+        v = Variance(dataset)
+        self.assertEqual(len(dataset), v.mean.get_n())
+        self.assertAlmostEqual(1.0, v.get_variance() / np.var(dataset, ddof=1), places=6)
+
+    def test_columns(self):
+        dataset = np.random.uniform(-1000, 1000, size=(50, 3))
+        columns = Variance.from_columns(dataset)
+        self.assertEqual(3, len(columns))
+        for j, v in enumerate(columns):
+            self._assert_equal(v, Variance(list(dataset[:, j])))
+
+
+
+class StatisticArrayTest(unittest.TestCase):
+    def _data_sets(self, n_keys):
+        return [[random.randint(-1000, 1000) for i in range(random.randint(2, 6))] for k in range(n_keys)]
+
+    def _assert_matches(self, array, statistics):
+        self.assertEqual(len(statistics), len(array))
+        for element, gold in zip(array.to_statistics(), statistics):
+            self.assertEqual(gold.mean.get_n(), element.mean.get_n())
+            self.assertAlmostEqual(gold.mean.get_mean(), element.mean.get_mean(), places=6)
+            self.assertAlmostEqual(gold.get_sum_square_distance(), element.get_sum_square_distance(), places=4)
+
+    def test_slots(self):
+        for statistic in [Mean([1, 2]), Variance([1, 2]), Frequency([1, 2]), StatisticArray()]:
+            self.assertFalse(hasattr(statistic, '__dict__'))
+
+    def test_round_trip(self):
+        statistics = [Variance(d) for d in self._data_sets(10)]
+        self._assert_matches(StatisticArray.from_statistics(statistics), statistics)
+
+    def test_merge(self):
+        d1, d2 = self._data_sets(20), self._data_sets(20)
+        a1 = StatisticArray.from_statistics([Variance(d) for d in d1])
+        a2 = StatisticArray.from_statistics([Variance(d) for d in d2])
+        self._assert_matches(a1 | a2, [Variance(x + y) for x, y in zip(d1, d2)])
+        a1 |= a2
+        self._assert_matches(a1, [Variance(x + y) for x, y in zip(d1, d2)])
+        a1 -= a2
+        self._assert_matches(a1, [Variance(x) for x in d1])
+
+    def test_inverse_to_identity(self):
+        a = StatisticArray.from_statistics([Variance(d) for d in self._data_sets(5)])
+        merged = a - a
+        self.assertTrue(np.all(merged.get_n() == 0))
+        self.assertTrue(np.all(merged.get_mean() == 0))
+
+    def test_identity(self):
+        a = StatisticArray.from_statistics([Variance(d) for d in self._data_sets(5)])
+        self.assertEqual(a, a | StatisticArray.get_identity())
+        self.assertEqual(a, StatisticArray.get_identity() | a)
+        self.assertTrue(StatisticArray.get_identity().is_identity())
+
+    def test_variance(self):
+        data_sets = self._data_sets(5)
+        a = StatisticArray.from_statistics([Variance(d) for d in data_sets])
+        self.assertTrue(np.allclose([np.var(d, ddof=1) for d in data_sets], a.get_variance()))
+
+    def test_slice(self):
+        statistics = [Variance(d) for d in self._data_sets(6)]
+        a = StatisticArray.from_statistics(statistics)
+        self._assert_matches(a[2:5], statistics[2:5])
+
+    def test_length_mismatch(self):
+        a = StatisticArray.from_statistics([Variance([1, 2])])
+        b = StatisticArray.from_statistics([Variance([1, 2]), Variance([3, 4])])
+        with self.assertRaises(ValueError):
+            a | b
+
+
+class ApproximateFrequencyTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = ApproximateFrequency
+    def _generate_data_set(self, size):
+        return [random.randint(-1000, 1000) for i in range(size)]
+
+    def _assert_equal(self, s1, s2):
+        self.assertTrue(np.array_equal(s1.table, s2.table))
+
+    def test_estimates(self):
+        data = np.random.zipf(1.5, size=20000) % 5000
+        sketch = ApproximateFrequency(data)
+        exact = Frequency(data.tolist())
+        self.assertEqual(len(data), sketch.get_n())
+        bound = 2.0 * len(data) / ApproximateFrequency.WIDTH
+        for key, count in exact.get_counter().items():
+            self.assertGreaterEqual(sketch.get_frequency(key), count)
+        errors = [sketch.get_frequency(k) - c for k, c in exact.get_counter().items()]
+        self.assertGreater(np.mean(np.array(errors) <= bound), 0.9)
+
+    def test_list_and_array_paths_agree(self):
+        data = self._generate_data_set(200)
+        self._assert_equal(ApproximateFrequency(data), ApproximateFrequency(np.array(data)))
+
+    def test_string_keys(self):
+        sketch = ApproximateFrequency(['a', 'b', 'a', 'c', 'a'])
+        self.assertEqual(3, sketch.get_frequency('a'))
+        self.assertEqual(0, sketch.get_frequency('zzz'))
+
+    def test_heavy_hitters(self):
+        class TopSketch(ApproximateFrequency):
+            TOP_K = 2
+        data = ['a'] * 50 + ['b'] * 30 + list(range(20))
+        sketch = TopSketch(data[:60]) | TopSketch(data[60:])
+        self.assertEqual([('a', 50), ('b', 30)], sketch.get_heavy_hitters())
+        sketch -= TopSketch(['a'] * 50)
+        self.assertEqual('b', sketch.get_heavy_hitters()[0][0])
+
+    def test_incompatible(self):
+        class NarrowSketch(ApproximateFrequency):
+            WIDTH = 16
+        with self.assertRaises(ValueError):
+            ApproximateFrequency([1]) | NarrowSketch([1])
+        with self.assertRaises(ValueError):
+            ApproximateFrequency([1]) | ApproximateFrequency([1], seed=1)
+
+    def test_numeric_arrays(self):
+        for data in [np.random.randint(-10**12, 10**12, size=500), np.random.normal(size=500),
+                     np.array([0.0, -0.0, 1.0, 2.5, np.inf, np.nan]), np.arange(10, dtype=np.uint8),
+                     np.array([True, False, True]), np.array([2.0**70, 3.0])]:
+            sketch = ApproximateFrequency(data)
+            self._assert_equal(ApproximateFrequency(data.tolist()), sketch)
+            self.assertEqual(len(data), sketch.get_n())
+            for key in data.tolist()[:20]:
+                self.assertGreaterEqual(sketch.get_frequency(key), 1)
+        self.assertEqual(2, ApproximateFrequency(np.array([3, 3.0])).get_frequency(3))
+        keys, counts = np.arange(50), np.random.randint(0, 5, size=50)
+        self._assert_equal(ApproximateFrequency(np.repeat(keys, counts)), ApproximateFrequency(keys, weights=counts))
+
+    def test_configuration(self):
+        sketch = ApproximateFrequency(np.array([1] * 50 + [2] * 30 + list(range(3, 20))), width=64, depth=3,
+                                      top_k=2, seed=7)
+        self.assertEqual((3, 64), sketch.table.shape)
+        self.assertEqual([(1, 50), (2, 30)], sketch.get_heavy_hitters())
+        self._assert_equal(sketch, sketch | ApproximateFrequency())
+        self._assert_equal(sketch, ApproximateFrequency() | sketch)
+        merged = ApproximateFrequency()
+        merged |= sketch
+        self.assertEqual(30, merged.get_frequency(2))
+        self.assertTrue((sketch - sketch).is_identity())
+        self._assert_equal(sketch, ApproximateFrequency.from_bytes(sketch.to_bytes()))
+
+
+
+class QuantileSketchTest(unittest.TestCase):
+    def _rank_error(self, sketch, data, q):
+        return abs(np.searchsorted(np.sort(data), sketch.quantile(q)) / float(len(data)) - q)
+
+    def test_small_data_exact(self):
+        data = [5, 1, 4, 2, 3]
+        sketch = QuantileSketch(data)
+        self.assertEqual(5, sketch.get_n())
+        self.assertEqual(1, sketch.quantile(0.0))
+        self.assertEqual(3, sketch.quantile(0.5))
+        self.assertEqual(5, sketch.quantile(1.0))
+
+    def test_quantiles(self):
+        data = np.random.normal(0, 1, size=100000)
+        sketch = QuantileSketch(data)
+        self.assertEqual(len(data), sketch.get_n())
+        self.assertLess(sum(len(level) for level in sketch.levels), 2000)
+        for q in [0.01, 0.25, 0.5, 0.75, 0.99]:
+            self.assertLess(self._rank_error(sketch, data, q), 0.02)
+
+    def test_merge(self):
+        chunks = [np.random.exponential(size=5000) for i in range(20)]
+        sketch = QuantileSketch.get_identity()
+        for chunk in chunks:
+            sketch = sketch | QuantileSketch(chunk)
+        data = np.concatenate(chunks)
+        self.assertEqual(len(data), sketch.get_n())
+        for q in np.linspace(0.05, 0.95, 10):
+            self.assertLess(self._rank_error(sketch, data, q), 0.02)
+        self.assertTrue(np.allclose([0.5], sketch.rank(np.median(data)), atol=0.02))
+
+    def test_commutative(self):
+        s1, s2 = QuantileSketch(np.random.normal(size=3000)), QuantileSketch(np.random.normal(size=2000))
+        self.assertEqual(s1 | s2, s2 | s1)
+
+    def test_hpdi(self):
+        sketch = QuantileSketch(np.random.normal(0, 1, size=100000))
+        low, high = sketch.hpdi(0.68)
+        self.assertAlmostEqual(-1.0, low, delta=0.1)
+        self.assertAlmostEqual(1.0, high, delta=0.1)
+
+    def test_monoid_only(self):
+        self.assertFalse(QuantileSketch.is_invertible())
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            QuantileSketch().quantile(0.5)
+
+    def test_serialization(self):
+        sketch = QuantileSketch(np.random.normal(size=10000))
+        self.assertEqual(sketch, QuantileSketch.from_bytes(sketch.to_bytes()))
+
+
+
+class CovarianceTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = Covariance
+    def _generate_data_set(self, size):
+        return np.random.randint(-1000, 1000, size=(size, 3))
+
+    def _concatenate(self, d1, d2):
+        return np.concatenate([d1, d2])
+
+    def _assert_equal(self, s1, s2):
+        self.assertEqual(s1.get_n(), s2.get_n())
+        self.assertTrue(np.allclose(s1.get_mean(), s2.get_mean()))
+        self.assertTrue(np.allclose(s1.get_comoment(), s2.get_comoment()))
+
+    def test_against_gold(self):
+        dataset = np.random.normal(100, 5, size=(1000, 4))
+        self.assertTrue(np.allclose(np.cov(dataset, rowvar=False), Covariance(dataset).get_covariance()))
+
+    def test_diagonal_matches_variance(self):
+        dataset = self._generate_data_set(50)
+        c = Covariance(dataset)
+        for j, v in enumerate(Variance.from_columns(dataset)):
+            self.assertAlmostEqual(v.get_variance(), c.get_covariance()[j, j], places=6)
+
+    def test_requires_matrix(self):
+        with self.assertRaises(ValueError):
+            Covariance([1, 2, 3])
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        enable_instrumentation(self.registry)
+        self.addCleanup(disable_instrumentation)
+
+    def test_counts_calls(self):
+        m = Mean([1, 2]) | Mean([3])
+        -m
+        timings = self.registry.snapshot()['timings']
+        self.assertGreaterEqual(timings['Mean.__init__']['count'], 2)
+        self.assertEqual(1, timings['Mean.__or__']['count'])
+        self.assertEqual(1, timings['Mean.__neg__']['count'])
+        self.assertGreaterEqual(timings['Mean.__or__']['total_seconds'], 0)
+
+    def test_frequency_merge_sizes(self):
+        Frequency([1, 2, 3]) | Frequency([1])
+        self.assertEqual({'count': 2, 'sum': 4, 'min': 1, 'max': 3},
+                         self.registry.snapshot()['distributions']['Frequency.merge_size'])
+
+    def test_pdf_and_depth(self):
+        model = NormalDistribution([1.0, 2.0, 4.0])
+        model.pdf(np.array([1.0, 2.0]))
+        snapshot = self.registry.snapshot()
+        self.assertEqual(1, snapshot['timings']['NormalDistribution.pdf']['count'])
+        self.assertEqual(1, snapshot['distributions']['NormalDistribution.depth']['max'])
+
+    def test_disable_restores_methods(self):
+        original = Mean.__dict__['__or__']
+        self.assertTrue(hasattr(original, '_uninstrumented'))
+        disable_instrumentation()
+        self.assertFalse(hasattr(Mean.__dict__['__or__'], '_uninstrumented'))
+        Mean([1]) | Mean([2])
+        self.assertNotIn('Mean.__or__', self.registry.snapshot()['timings'])
+
+    def test_reset(self):
+        Mean([1])
+        self.registry.reset()
+        self.assertEqual({'timings': {}, 'distributions': {}}, self.registry.snapshot())
+
+
+class WeightsTest(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.values = self.random_state.normal(size=50)
+        self.weights = self.random_state.rand(50)
+
+    def test_fractional_weights(self):
+        self.assertAlmostEqual(self.weights.sum(), Mean(self.values, weights=self.weights).get_n())
+        self.assertAlmostEqual(np.average(self.values, weights=self.weights),
+                               Mean(self.values, weights=self.weights).get_mean())
+        mean = np.average(self.values, weights=self.weights)
+        self.assertAlmostEqual(np.dot(self.weights, (self.values - mean)**2),
+                               Variance(list(self.values), weights=list(self.weights)).get_sum_square_distance())
+
+    def test_merge_of_weighted_parts(self):
+        merged = Variance(self.values[:20], weights=self.weights[:20]) \
+                 | Variance(self.values[20:], weights=self.weights[20:])
+        whole = Variance(self.values, weights=self.weights)
+        self.assertAlmostEqual(whole.mean.get_mean(), merged.mean.get_mean())
+        self.assertAlmostEqual(whole.get_variance(), merged.get_variance())
+
+    def test_histogram(self):
+        f = Frequency(['a', 'b', 'a', 'c'], weights=[0.5, 2.0, 1.0, 0.0])
+        self.assertEqual({'a': 1.5, 'b': 2.0}, f.get_counter())
+        f = Frequency(np.array([3, 1, 3]), weights=np.array([2, 5, 1]))
+        self.assertEqual({1: 5, 3: 3}, f.get_counter())
+
+    def test_quantile_sketch(self):
+        counts = self.random_state.randint(0, 1000, size=50)
+        weighted = QuantileSketch(self.values, weights=counts)
+        repeated = QuantileSketch(np.repeat(self.values, counts))
+        self.assertEqual(counts.sum(), weighted.get_n())
+        q = np.linspace(0, 1, 11)
+        np.testing.assert_allclose(weighted.quantile(q), repeated.quantile(q), atol=0.2)
+        self.assertRaises(ValueError, QuantileSketch, self.values, weights=self.weights)
+
+    def test_approximate_frequency(self):
+        sketch = ApproximateFrequency([1, 2, 1], weights=[10, 20, 5])
+        self.assertEqual(15, sketch.get_frequency(1))
+        self.assertRaises(ValueError, ApproximateFrequency, [1, 2], weights=[0.5, 1.0])
+
+    def test_covariance(self):
+        X = np.random.normal(size=(30, 3))
+        counts = np.random.randint(0, 4, size=30)
+        np.testing.assert_allclose(Covariance(np.repeat(X, counts, axis=0)).get_covariance(),
+                                   Covariance(X, weights=counts).get_covariance())
+
+    def test_wrong_length(self):
+        self.assertRaises(ValueError, Mean, [1.0, 2.0], weights=[1.0])
+        self.assertRaises(ValueError, Variance, np.arange(3.0), weights=np.ones(4))
@@ -1,8 +1,12 @@
 import unittest
 from tests.algebraic_statistic_tests import AbstractGroupStatisticTest
-from conjugate_density import Bernoulli
+from algebraic_statistic import ApproximateFrequency
+from conjugate_density import Bernoulli, Poisson, Normal, Categorical, sliding_window_hpdi
 from random import choice
 
+import numpy as np
+from scipy import stats
+
 class BernoulliTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = Bernoulli
     def _generate_data_set(self, size):
@@ -25,5 +29,166 @@ class BernoulliTest(AbstractGroupStatisticTest):
         self.assertLess(b.get_posterior_pdf(0.0), b.get_posterior_pdf(0.5))
         self.assertAlmostEqual(b.get_posterior_pdf(0.3), b.get_posterior_pdf(0.7))
 
+    def test_matches_scipy(self):
+        b = Bernoulli([0]*30 + [1]*70)
+        mu = np.linspace(0.05, 0.95, 7)
+        np.testing.assert_allclose(stats.beta.pdf(mu, 71, 31), b.get_posterior_pdf(mu))
+
+    def test_update(self):
+        data = self._generate_data_set(50)
+        b = Bernoulli(data[:-1])
+        before = b.get_posterior_parameters()
+        b.update(data[-1])
+        self.assertNotEqual(before, b.get_posterior_parameters())
+        self.assertEqual(Bernoulli(data).get_posterior_parameters(), b.get_posterior_parameters())
+
+    def test_sample_posterior(self):
+        b = Bernoulli([0]*300 + [1]*700)
+        samples = b.sample_posterior(size=10000, random_state=np.random.RandomState(0))
+        self.assertEqual((10000,), samples.shape)
+        self.assertAlmostEqual(0.7, samples.mean(), places=2)
+
+class PoissonTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = Poisson
+    def _generate_data_set(self, size):
+        return list(np.random.poisson(3.0, size))
+
+    def _assert_equal(self, s1, s2):
+        self.assertAlmostEqual(s1['mean'].get_n(), s2['mean'].get_n())
+        self.assertAlmostEqual(s1['mean'].get_mean(), s2['mean'].get_mean())
+
+    def test_matches_scipy(self):
+        data = np.random.poisson(3.0, 200)
+        p = Poisson(data)
+        rate = np.linspace(2.0, 4.0, 9)
+        expected = stats.gamma.pdf(rate, 1 + data.sum(), scale=1.0 / (1 + len(data)))
+        np.testing.assert_allclose(expected, p.get_posterior_pdf(rate))
+
+    def test_update(self):
+        data = self._generate_data_set(100)
+        p = Poisson()
+        for x in data:
+            p.update(x)
+        np.testing.assert_allclose(Poisson(data).get_posterior_parameters(), p.get_posterior_parameters())
+
+    def test_sample_posterior(self):
+        p = Poisson(np.random.poisson(3.0, 5000))
+        samples = p.sample_posterior(size=1000, random_state=np.random.RandomState(0))
+        self.assertAlmostEqual(3.0, samples.mean(), delta=0.1)
+
+class NormalTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = Normal
+    def _generate_data_set(self, size):
+        return list(np.random.normal(2.0, 1.5, size))
+
+    def _assert_equal(self, s1, s2):
+        self.assertAlmostEqual(s1['variance'].mean.get_n(), s2['variance'].mean.get_n())
+        self.assertAlmostEqual(s1['variance'].mean.get_mean(), s2['variance'].mean.get_mean())
+        self.assertAlmostEqual(s1['variance'].get_sum_square_distance(), s2['variance'].get_sum_square_distance())
+
+    def test_matches_scipy(self):
+        n = Normal(self._generate_data_set(100))
+        mean, kappa, shape, scale = n.get_posterior_parameters()
+        mu, sigma2 = np.meshgrid(np.linspace(1.5, 2.5, 5), np.linspace(1.5, 3.0, 5))
+        expected = (stats.norm.logpdf(mu, mean, np.sqrt(sigma2 / kappa))
+                    + stats.invgamma.logpdf(sigma2, shape, scale=scale))
+        np.testing.assert_allclose(expected, n.get_posterior_log_pdf(mu, sigma2))
+
+    def test_prior(self):
+        mean, kappa, shape, scale = Normal().get_posterior_parameters()
+        self.assertEqual((Normal.PRIOR_MEAN, Normal.PRIOR_KAPPA, Normal.PRIOR_SHAPE, Normal.PRIOR_SCALE),
+                         (mean, kappa, shape, scale))
+
+    def test_update(self):
+        data = self._generate_data_set(100)
+        n = Normal()
+        for x in data:
+            n.update(x)
+        np.testing.assert_allclose(Normal(data).get_posterior_parameters(), n.get_posterior_parameters())
+
+    def test_sample_posterior(self):
+        n = Normal(list(np.random.normal(2.0, 1.5, 5000)))
+        mu, sigma2 = n.sample_posterior(size=1000, random_state=np.random.RandomState(0))
+        self.assertAlmostEqual(2.0, mu.mean(), delta=0.1)
+        self.assertAlmostEqual(2.25, sigma2.mean(), delta=0.2)
+
+class CategoricalTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = Categorical
+    def _generate_data_set(self, size):
+        return [choice('abc') for i in range(size)]
+
+    def _assert_equal(self, s1, s2):
+        self.assertEqual(s1['Frequency'].get_counter(), s2['Frequency'].get_counter())
+
+    def test_matches_scipy(self):
+        c = Categorical(['a']*5 + ['b']*3 + ['c'])
+        self.assertEqual(['a', 'b', 'c'], c.get_categories())
+        p = np.array([[0.5, 0.3, 0.2], [0.2, 0.2, 0.6]])
+        expected = [stats.dirichlet.logpdf(row, [6, 4, 2]) for row in p]
+        np.testing.assert_allclose(expected, c.get_posterior_log_pdf(p))
+
+    def test_update(self):
+        c = Categorical(['a', 'b'])
+        np.testing.assert_allclose([2, 2], c.get_posterior_parameters())
+        c.update('c')
+        self.assertEqual(['a', 'b', 'c'], c.get_categories())
+        np.testing.assert_allclose([2, 2, 2], c.get_posterior_parameters())
+
+    def test_sample_posterior(self):
+        c = Categorical(['a']*600 + ['b']*400)
+        samples = c.sample_posterior(size=500, random_state=np.random.RandomState(0))
+        self.assertEqual((500, 2), samples.shape)
+        np.testing.assert_allclose(1.0, samples.sum(axis=1))
+
+class ApproximateBernoulli(Bernoulli):
+    STATISTIC_CLASSES = [('Frequency', ApproximateFrequency)]
+
+
+class ApproximateBernoulliTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = ApproximateBernoulli
+    def _generate_data_set(self, size):
+        return [choice([0,1]) for i in range(size)]
+
+    def _assert_equal(self, s1, s2):
+        self.assertEqual(s1['Frequency'], s2['Frequency'])
+
+    def test_matches_exact_posterior(self):
+        data = [0]*30 + [1]*70
+        exact, approximate = Bernoulli(data), ApproximateBernoulli(data)
+        for mu in [0.1, 0.5, 0.7, 0.9]:
+            self.assertAlmostEqual(exact.get_posterior_pdf(mu), approximate.get_posterior_pdf(mu))
+
+class SlidingWindowHpdiTest(unittest.TestCase):
+    def _loop_hpdi(self, samples, interval_fraction):
+        # The original pure Python scan, kept as the reference
+        window_size = int(1.0 * len(samples) * interval_fraction)
+        sorted_samples = sorted(samples)
+        shortest_window_start = None
+        shortest_window_length = float('inf')
+        for window_start in range(len(samples) - window_size):
+            window_length = sorted_samples[window_start + window_size] - sorted_samples[window_start]
+            if window_length < shortest_window_length:
+                shortest_window_start = window_start
+                shortest_window_length = window_length
+        return sorted_samples[shortest_window_start], sorted_samples[shortest_window_start + window_size]
+
+    def test_matches_loop(self):
+        for fraction in [0.1, 0.5, 0.68, 0.95]:
+            samples = np.random.gamma(2.0, size=1000)
+            self.assertEqual(self._loop_hpdi(list(samples), fraction), sliding_window_hpdi(samples, fraction))
+
+    def test_normal(self):
+        low, high = sliding_window_hpdi(np.random.RandomState(0).normal(0, 1, 50000), 0.68)
+        self.assertAlmostEqual(-1.0, low, places=1)
+        self.assertAlmostEqual(1.0, high, places=1)
+
+    def test_edge_cases(self):
+        samples = np.array([3.0, 1.0, 2.0, 5.0])
+        self.assertEqual((1.0, 5.0), sliding_window_hpdi(samples, 1.0))
+        self.assertEqual((7.0, 7.0), sliding_window_hpdi([7.0], 1.0))
+        self.assertEqual((1.0, 1.0), sliding_window_hpdi(samples, 0.1))
+        with self.assertRaises(ValueError):
+            sliding_window_hpdi([], 0.5)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
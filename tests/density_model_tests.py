@@ -3,8 +3,10 @@ import random
 
 import numpy as np
 
+from algebraic_statistic import Mean, Variance
+
 from density_model import NormalDistribution, PoissonDistribution, CategoricalDistribution, BernoulliDistribution, \
-    ExponentialDistribution, BinomialDistribution
+    ExponentialDistribution, BinomialDistribution, MultivariateNormalDistribution
 from tests.algebraic_statistic_tests import AbstractGroupStatisticTest
 
 
@@ -28,6 +30,47 @@ class NormalDistributionTest(AbstractGroupStatisticTest):
         for i in range(-3,3):
             self.assertAlmostEqual(true_pdf(i), n.pdf(i), places=2)
 
+    def test_batch_pdf(self):
+        n = NormalDistribution(self._generate_data_set(100))
+        X = np.linspace(-1500, 1500, 41)
+        self.assertTrue(np.allclose([n.pdf(x) for x in X], n.pdf(X)))
+        self.assertTrue(np.allclose(np.log(n.pdf(X)), n.log_pdf(X)))
+        self.assertTrue(np.allclose([n.unnormalized_pdf(x) for x in X], n.unnormalized_pdf(X)))
+
+    def test_cache_invalidated_on_merge(self):
+        d1, d2 = self._generate_data_sets([10, 20])
+        n, gold = NormalDistribution(d1), NormalDistribution(d1 + d2)
+        n.pdf(0)
+        n |= NormalDistribution(d2)
+        self.assertAlmostEqual(gold.log_pdf(5), n.log_pdf(5))
+        n -= NormalDistribution(d2)
+        self.assertAlmostEqual(NormalDistribution(d1).log_pdf(5), n.log_pdf(5))
+        n['variance'] = Variance(d2)
+        self.assertAlmostEqual(math.log(n.pdf(5)), n.log_pdf(5))
+
+    def test_shared_mean(self):
+        d1, d2 = self._generate_data_sets([10, 20])
+        n1, n2 = NormalDistribution(d1), NormalDistribution(d2)
+        self.assertEqual([('variance', Variance)], NormalDistribution.get_statistic_graph()[0])
+        shared = lambda n: n['mean'] is n['variance'].mean
+        self.assertTrue(shared(n1))
+        self.assertTrue(shared(n1 | n2))
+        self.assertTrue(shared(-n1))
+        self.assertTrue(shared(NormalDistribution.from_bytes(n1.to_bytes())))
+        self.assertTrue(shared(NormalDistribution.from_statistic_values({'variance': Variance(d1)})))
+        n1 |= n2
+        n1.update(3)
+        self.assertTrue(shared(n1))
+        self.assertEqual(len(d1) + len(d2) + 1, n1['mean'].get_n())
+        n1['variance'] = Variance(d2)
+        self.assertTrue(shared(n1))
+        self.assertRaises(ValueError, n1.__setitem__, 'mean', Mean(d2))
+
+    def test_equality_compares_means(self):
+        self.assertNotEqual(NormalDistribution([1.0, 2.0, 3.0]), NormalDistribution([101.0, 102.0, 103.0]))
+        self.assertNotEqual(Variance([1.0, 2.0, 3.0]), Variance([101.0, 102.0, 103.0]))
+        self.assertEqual(NormalDistribution([1.0, 2.0, 3.0]), NormalDistribution([1.0, 2.0, 3.0]))
+
 
 class PoissonDistributionTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = PoissonDistribution
@@ -46,6 +89,19 @@ class PoissonDistributionTest(AbstractGroupStatisticTest):
         for i in range(0,10):
             self.assertAlmostEqual(true_pmf(i), p.pdf(i), places=2)
 
+    def test_batch_pdf(self):
+        lam = 3.5
+        p = PoissonDistribution([lam])
+        k = np.arange(0, 30)
+        true_pmf = np.array([(lam**i * math.exp(-lam)) / (math.factorial(i)) for i in k])
+        self.assertTrue(np.allclose(true_pmf, p.pdf(k)))
+        self.assertTrue(np.allclose(np.log(true_pmf), p.log_pdf(k)))
+
+    def test_log_pdf_large_k(self):
+        # A direct lam**k / k! overflows here, the log-space form does not
+        p = PoissonDistribution([500.0])
+        self.assertTrue(np.isfinite(p.log_pdf(np.array([400, 500, 2000]))).all())
+
 
 class CategoricalDistributionTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = CategoricalDistribution
@@ -75,6 +131,12 @@ class CategoricalDistributionTest(AbstractGroupStatisticTest):
             test_x = [1 if i == j else 0 for j in range(self.TEST_DATA_ITEM_LENGTH)]
             self.assertAlmostEqual(p.pdf(test_x), TRUE_CATEGORY_LIKELIHOOD, places=1)
 
+    def test_batch_pdf(self):
+        p = CategoricalDistribution(self._generate_data_set(1000))
+        X = np.eye(self.TEST_DATA_ITEM_LENGTH)[np.random.randint(0, self.TEST_DATA_ITEM_LENGTH, size=20)]
+        self.assertTrue(np.allclose([p.pdf(x) for x in X], p.pdf(X)))
+        self.assertTrue(np.allclose(np.log(p.pdf(X)), p.log_pdf(X)))
+
 
 class BernoulliDistributionTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = BernoulliDistribution
@@ -93,6 +155,12 @@ class BernoulliDistributionTest(AbstractGroupStatisticTest):
         self.assertAlmostEqual(p.pdf(0), 1.0 - self.TEST_DATA_MU, places=2)
         self.assertAlmostEqual(p.pdf(1), self.TEST_DATA_MU, places=2)
 
+    def test_batch_pdf(self):
+        p = BernoulliDistribution([0, 1, 1, 1])
+        x = np.array([0, 1, 1, 0])
+        self.assertTrue(np.allclose([0.25, 0.75, 0.75, 0.25], p.pdf(x)))
+        self.assertTrue(np.allclose(np.log([0.25, 0.75, 0.75, 0.25]), p.log_pdf(x)))
+
 
 class ExponentialDistributionTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = ExponentialDistribution
@@ -111,6 +179,18 @@ class ExponentialDistributionTest(AbstractGroupStatisticTest):
         for i in range(0,10):
             self.assertAlmostEqual(true_pmf(i), p.pdf(i), places=2)
 
+    def test_batch_pdf(self):
+        p = ExponentialDistribution([0.5, 1.5])
+        x = np.linspace(0, 10, 21)
+        self.assertTrue(np.allclose(np.exp(-x), p.pdf(x)))
+        self.assertTrue(np.allclose(-x, p.log_pdf(x)))
+
+    def test_cache_invalidated_on_merge(self):
+        p = ExponentialDistribution([1.0])
+        self.assertAlmostEqual(1.0, p.pdf(0))
+        p |= ExponentialDistribution([3.0])
+        self.assertAlmostEqual(0.5, p.pdf(0))
+
 
 class BinomialDistributionTest(AbstractGroupStatisticTest):
     STATISTIC_CLS = BernoulliDistribution
@@ -129,6 +209,13 @@ class BinomialDistributionTest(AbstractGroupStatisticTest):
         self.assertAlmostEqual(p.pdf(1, 0), 1.0 - self.TEST_DATA_MU, places=2)
         self.assertAlmostEqual(p.pdf(1, 1), self.TEST_DATA_MU, places=2)
 
+    def test_batch_pdf(self):
+        p = BinomialDistribution([0, 1, 1, 1])
+        k = np.arange(0, 11)
+        true_pmf = np.array([math.comb(10, i) * 0.75**i * 0.25**(10 - i) for i in k])
+        self.assertTrue(np.allclose(true_pmf, p.pdf(10, k)))
+        self.assertTrue(np.allclose(np.log(true_pmf), p.log_pdf(10, k)))
+
 #
 # class vonMisesFisherDistributionTest(AbstractGroupStatisticTest):
 #     STATISTIC_CLS = vonMisesFisherDistribution
@@ -140,4 +227,36 @@ class BinomialDistributionTest(AbstractGroupStatisticTest):
 #         self.assertAlmostEqual(m1.get_mean(), m2.get_mean())
 #
 # if __name__ == '__main__':
-#     unittest.main()
\ No newline at end of file
+#     unittest.main()
+
+class MultivariateNormalDistributionTest(AbstractGroupStatisticTest):
+    STATISTIC_CLS = MultivariateNormalDistribution
+    TRUE_MU = np.array([1.0, -2.0, 0.5])
+    TRUE_COV = np.array([[2.0, 0.3, 0.0], [0.3, 1.0, -0.4], [0.0, -0.4, 0.5]])
+    def _generate_data_set(self, size):
+        return list(np.random.multivariate_normal(self.TRUE_MU, self.TRUE_COV, size=size))
+
+    def _assert_equal(self, s1, s2):
+        c1, c2 = s1['covariance'], s2['covariance']
+        self.assertEqual(c1.get_n(), c2.get_n())
+        self.assertTrue(np.allclose(c1.get_mean(), c2.get_mean()))
+        self.assertTrue(np.allclose(c1.get_comoment(), c2.get_comoment()))
+
+    def test_log_pdf(self):
+        from scipy.stats import multivariate_normal
+        D = np.array(self._generate_data_set(500))
+        m = MultivariateNormalDistribution(D)
+        X = np.random.normal(size=(100, 3))
+        gold = multivariate_normal(np.mean(D, axis=0), np.cov(D, rowvar=False))
+        self.assertTrue(np.allclose(gold.logpdf(X), m.log_pdf(X)))
+        self.assertTrue(np.allclose(gold.pdf(X), m.pdf(X)))
+        self.assertAlmostEqual(gold.logpdf(X[0]), m.log_pdf(X[0]))
+
+    def test_badly_scaled_covariance(self):
+        from scipy.stats import multivariate_normal
+        scales = np.array([1e-2, 1.0, 1e2])
+        D = np.array(self._generate_data_set(500)) * scales
+        m = MultivariateNormalDistribution(D)
+        X = np.random.normal(size=(50, 3)) * scales
+        gold = multivariate_normal(np.mean(D, axis=0), np.cov(D, rowvar=False))
+        np.testing.assert_allclose(gold.logpdf(X), m.log_pdf(X), rtol=1e-8)
@@ -0,0 +1,237 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from algebraic_statistic import Mean, Variance, Frequency
+from conjugate_density import Bernoulli
+from density_model import NormalDistribution, PoissonDistribution, CategoricalDistribution, ExponentialDistribution
+from fitting import fit_parallel, tree_reduce, fit_stream, fit_iterable, iter_chunks, read_csv_chunks, \
+    read_npy_chunks, group_fit, fit_shared
+
+
+class TreeReduceTest(unittest.TestCase):
+    def test_matches_sequential_merge(self):
+        chunks = [[random.randint(-1000, 1000) for i in range(5)] for j in range(11)]
+        reduced = tree_reduce([Variance(c) for c in chunks])
+        gold = Variance(sum(chunks, []))
+        self.assertAlmostEqual(gold.get_variance(), reduced.get_variance(), places=6)
+
+    def test_empty(self):
+        self.assertIsNone(tree_reduce([]))
+        self.assertEqual(Mean(), tree_reduce([], Mean()))
+
+
+class FitParallelTest(unittest.TestCase):
+    def test_mean_threads(self):
+        data = np.random.uniform(-1000, 1000, size=10000)
+        m = fit_parallel(Mean, data, n_workers=4, chunk_size=999, executor='thread')
+        self.assertEqual(len(data), m.get_n())
+        self.assertAlmostEqual(np.mean(data), m.get_mean(), places=6)
+
+    def test_variance_processes(self):
+        data = [random.randint(-1000, 1000) for i in range(1000)]
+        v = fit_parallel(Variance, data, n_workers=2)
+        self.assertAlmostEqual(Variance(data).get_variance(), v.get_variance(), places=6)
+
+    def test_frequency(self):
+        data = [random.randint(0, 10) for i in range(1000)]
+        f = fit_parallel(Frequency, data, n_workers=3, chunk_size=70, executor='thread')
+        self.assertEqual(Frequency(data).get_counter(), f.get_counter())
+
+    def test_composite(self):
+        data = np.random.normal(3, 2, size=5000)
+        n = fit_parallel(NormalDistribution, data, n_workers=2)
+        gold = NormalDistribution(data)
+        self.assertAlmostEqual(gold['mean'].get_mean(), n['mean'].get_mean(), places=6)
+        self.assertAlmostEqual(gold['variance'].get_variance(), n['variance'].get_variance(), places=6)
+
+    def test_conjugate(self):
+        data = [random.choice([0, 1]) for i in range(500)]
+        b = fit_parallel(Bernoulli, data, n_workers=2, chunk_size=64, executor='thread')
+        self.assertEqual(Bernoulli(data)['Frequency'].get_counter(), b['Frequency'].get_counter())
+
+    def test_empty(self):
+        self.assertEqual(Mean(), fit_parallel(Mean, [], n_workers=2))
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            fit_parallel(Mean, [1, 2, 3], n_workers=2, chunk_size=1, executor='cluster')
+
+
+class StreamingFitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_iter_chunks(self):
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], list(iter_chunks(range(7), 3)))
+
+    def test_fit_iterable_generator(self):
+        data = [random.randint(-1000, 1000) for i in range(1000)]
+        v = fit_iterable(Variance, (x for x in data), chunk_size=77)
+        self.assertAlmostEqual(Variance(data).get_variance(), v.get_variance(), places=6)
+        self.assertEqual(len(data), v.mean.get_n())
+
+    def test_fit_stream_empty(self):
+        self.assertEqual(Mean(), fit_stream(Mean, iter([])))
+
+    def test_csv(self):
+        data = np.random.poisson(4, size=(500, 2))
+        path = os.path.join(self.directory, 'data.csv')
+        with open(path, 'w') as f:
+            f.write('a,b\n')
+            for row in data:
+                f.write('{0},{1}\n'.format(*row))
+        p = fit_stream(PoissonDistribution, read_csv_chunks(path, 64, column=1, skip_header=True))
+        self.assertAlmostEqual(np.mean(data[:, 1]), p['mean'].get_mean(), places=6)
+        chunks = list(read_csv_chunks(path, 64, column=None, skip_header=True))
+        self.assertEqual((500, 2), np.concatenate(chunks).shape)
+
+    def test_npy(self):
+        data = np.random.normal(5, 3, size=1000)
+        path = os.path.join(self.directory, 'data.npy')
+        np.save(path, data)
+        n = fit_stream(NormalDistribution, read_npy_chunks(path, 128))
+        gold = NormalDistribution(data)
+        self.assertAlmostEqual(gold['mean'].get_mean(), n['mean'].get_mean(), places=6)
+        self.assertAlmostEqual(gold['variance'].get_variance(), n['variance'].get_variance(), places=6)
+
+
+class GroupFitTest(unittest.TestCase):
+    def _keyed_data(self, size, n_keys=20):
+        keys = np.random.randint(0, n_keys, size=size)
+        values = np.random.randint(-1000, 1000, size=size)
+        return keys, values
+
+    def test_mean(self):
+        keys, values = self._keyed_data(1000)
+        grouped = group_fit(Mean, keys, values)
+        self.assertEqual(sorted(set(keys.tolist())), sorted(grouped.keys()))
+        for key in grouped.keys():
+            gold = Mean(list(values[keys == key]))
+            self.assertEqual(gold.get_n(), grouped[key].get_n())
+            self.assertAlmostEqual(gold.get_mean(), grouped[key].get_mean(), places=6)
+
+    def test_variance(self):
+        keys, values = self._keyed_data(1000)
+        grouped = group_fit(Variance, keys, values)
+        for key in grouped.keys():
+            gold = Variance(list(values[keys == key]))
+            self.assertAlmostEqual(gold.get_variance(), grouped[key].get_variance(), places=6)
+
+    def test_frequency_string_keys(self):
+        keys = [random.choice(['a', 'b', 'c']) for i in range(300)]
+        values = [random.randint(0, 5) for i in range(300)]
+        grouped = group_fit(Frequency, keys, values)
+        for key in ['a', 'b', 'c']:
+            gold = Frequency([v for k, v in zip(keys, values) if k == key])
+            self.assertEqual(gold.get_counter(), grouped[key].get_counter())
+
+    def test_composite(self):
+        keys, values = self._keyed_data(1000)
+        grouped = group_fit(NormalDistribution, keys, values)
+        for key in grouped.keys():
+            gold = NormalDistribution(list(values[keys == key]))
+            self.assertAlmostEqual(gold['mean'].get_mean(), grouped[key]['mean'].get_mean(), places=6)
+            self.assertAlmostEqual(gold['variance'].get_variance(), grouped[key]['variance'].get_variance(),
+                                   places=6)
+
+    def test_vector_values(self):
+        keys = np.random.randint(0, 5, size=200)
+        values = np.eye(4)[np.random.randint(0, 4, size=200)]
+        grouped = group_fit(CategoricalDistribution, keys, values)
+        for key in grouped.keys():
+            self.assertTrue(np.allclose(values[keys == key].mean(axis=0), grouped[key]['mean'].get_mean()))
+
+    def test_keyed_merge(self):
+        keys1, values1 = self._keyed_data(500, n_keys=10)
+        keys2, values2 = self._keyed_data(500, n_keys=15)
+        merged = group_fit(Variance, keys1, values1) | group_fit(Variance, keys2, values2)
+        gold = group_fit(Variance, np.concatenate([keys1, keys2]), np.concatenate([values1, values2]))
+        self.assertEqual(sorted(gold.keys()), sorted(merged.keys()))
+        for key in gold.keys():
+            self.assertAlmostEqual(gold[key].get_variance(), merged[key].get_variance(), places=6)
+
+    def test_keyed_subtract(self):
+        keys1, values1 = self._keyed_data(500, n_keys=10)
+        keys2, values2 = self._keyed_data(500, n_keys=15)
+        g1, g2 = group_fit(Mean, keys1, values1), group_fit(Mean, keys2, values2)
+        merged = g1 | g2
+        merged -= g2
+        for key in g1.keys():
+            self.assertAlmostEqual(g1[key].get_mean(), merged[key].get_mean(), places=6)
+            self.assertEqual(g1[key].get_n(), merged[key].get_n())
+        self.assertEqual(g1, g1 | g2.get_identity())
+
+    def test_group_laws(self):
+        a = group_fit(Mean, [0, 1], [1.0, 2.0])
+        b = group_fit(Mean, [1, 2], [3.0, 4.0])
+        self.assertEqual(a, (a | b) - b)
+        self.assertEqual([0, 1], sorted(((a | b) - b).keys()))
+        self.assertTrue((a - a).is_identity())
+        self.assertTrue((b | -b).is_identity())
+        merged = a | b
+        merged -= b
+        self.assertEqual(a, merged)
+        merged -= a
+        self.assertTrue(merged.is_identity())
+        for cls, values in [(Frequency, [1, 2, 2]), (NormalDistribution, [1.0, 2.0, 4.0])]:
+            grouped = group_fit(cls, ['x', 'y', 'y'], values)
+            self.assertTrue((grouped - grouped).is_identity())
+            forgotten = grouped | group_fit(cls, ['z'], values[:1])
+            forgotten -= group_fit(cls, ['z'], values[:1])
+            self.assertEqual(['x', 'y'], sorted(forgotten.keys()))
+
+    def test_weights(self):
+        keys, values = self._keyed_data(1000)
+        weights = np.random.rand(1000)
+        for cls in [Variance, Frequency, NormalDistribution]:
+            grouped = group_fit(cls, keys, values, weights=weights)
+            fallback = group_fit(cls, keys.astype(str), values, weights=weights)
+            for key in grouped.keys():
+                gold = cls(values[keys == key], weights=weights[keys == key])
+                for statistic in [grouped[key], fallback[str(key)]]:
+                    if cls is Frequency:
+                        self.assertEqual(sorted(gold.get_counter()), sorted(statistic.get_counter()))
+                        continue
+                    variance = statistic if cls is Variance else statistic['variance']
+                    gold_variance = gold if cls is Variance else gold['variance']
+                    self.assertAlmostEqual(gold_variance.mean.get_n(), variance.mean.get_n())
+                    self.assertAlmostEqual(gold_variance.get_variance(), variance.get_variance(), places=6)
+
+
+
+class FitSharedTest(unittest.TestCase):
+    def test_matches_individual_fits(self):
+        data = np.random.randint(1, 1000, size=500)
+        classes = [NormalDistribution, PoissonDistribution, ExponentialDistribution, CategoricalDistribution]
+        models = fit_shared(classes, data)
+        for cls, model in zip(classes, models):
+            self.assertIsInstance(model, cls)
+            gold = cls(data)
+            self.assertEqual(gold['mean'].get_n(), model['mean'].get_n())
+            np.testing.assert_allclose(gold['mean'].get_mean(), model['mean'].get_mean())
+        self.assertAlmostEqual(NormalDistribution(data)['variance'].get_variance(),
+                               models[0]['variance'].get_variance())
+
+    def test_models_do_not_share_state(self):
+        normal, poisson = fit_shared([NormalDistribution, PoissonDistribution], [1.0, 2.0, 3.0])
+        self.assertTrue(normal['mean'] is normal['variance'].mean)
+        self.assertFalse(normal['mean'] is poisson['mean'])
+        poisson.update(10.0)
+        self.assertEqual(3, normal['mean'].get_n())
+        self.assertEqual(4, poisson['mean'].get_n())
+
+    def test_weights(self):
+        normal, = fit_shared([NormalDistribution], [1.0, 2.0], weights=[3, 1])
+        self.assertEqual(NormalDistribution([1.0, 1.0, 1.0, 2.0]), normal)
+
+
+if __name__ == '__main__':
+    unittest.main()
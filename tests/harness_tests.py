@@ -0,0 +1,49 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import harness
+
+
+def _measurement(seconds, peak_bytes=1000):
+    return {'seconds': seconds, 'number': 1, 'peak_bytes': peak_bytes}
+
+
+class CompareTest(unittest.TestCase):
+    def test_flags_slowdowns(self):
+        baseline = {'merge/or/Mean[10]': _measurement(1.0), 'merge/or/Mean[100]': _measurement(10.0),
+                    'removed[10]': _measurement(1.0)}
+        results = {'merge/or/Mean[10]': _measurement(1.5), 'merge/or/Mean[100]': _measurement(11.0),
+                   'added[10]': _measurement(100.0)}
+        self.assertEqual([('merge/or/Mean[10]', 'seconds', 1.0, 1.5)], harness.compare(results, baseline))
+        self.assertEqual([], harness.compare(results, baseline, tolerance=0.6))
+
+    def test_flags_memory_growth(self):
+        baseline = {'construct/Mean[10]': _measurement(1.0, peak_bytes=1000)}
+        results = {'construct/Mean[10]': _measurement(0.5, peak_bytes=2000)}
+        self.assertEqual([('construct/Mean[10]', 'peak_bytes', 1000, 2000)], harness.compare(results, baseline))
+
+    def test_main_exit_status(self):
+        entry = ('test/sum', lambda size: lambda: sum(range(size)), None)
+        harness.BENCHMARKS.append(entry)
+        self.addCleanup(harness.BENCHMARKS.remove, entry)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output, baseline = os.path.join(directory, 'results.json'), os.path.join(directory, 'baseline.json')
+        arguments = ['-k', 'test/*', '--max-size', '10', '--repeat', '1', '--output', output]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(0, harness.main(arguments))
+            results = harness.load_results(output)
+            self.assertEqual(['test/sum[10]'], list(results))
+            # A baseline a thousand times faster than this run flags a regression
+            with open(baseline, 'w') as f:
+                json.dump({'results': {'test/sum[10]': _measurement(results['test/sum[10]']['seconds'] / 1000.0)}}, f)
+            self.assertEqual(1, harness.main(arguments + ['--baseline', baseline]))
+
+
+if __name__ == '__main__':
+    unittest.main()
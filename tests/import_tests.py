@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['algebraic_statistic', 'density_model', 'conjugate_density', 'fitting', 'mixture_model', 'naive_bayes',
+           'sliding_window', 'aggregation_service']
+HEAVY_MODULES = ['scipy', 'matplotlib', 'multiprocessing']
+
+
+def _loaded_after_import(code):
+    # Runs in a fresh interpreter so that modules imported by other tests do not leak in
+    script = code + '\nimport sys\nprint(" ".join(sorted(set(m.split(".")[0] for m in sys.modules))))'
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=REPOSITORY_ROOT)
+    return set(output.decode().split())
+
+
+class LazyImportTest(unittest.TestCase):
+    def test_no_heavy_dependencies_on_import(self):
+        loaded = _loaded_after_import('\n'.join('import ' + module for module in MODULES))
+        for heavy in HEAVY_MODULES:
+            self.assertNotIn(heavy, loaded)
+
+    def test_scipy_loaded_on_first_use(self):
+        loaded = _loaded_after_import('import density_model\ndensity_model.PoissonDistribution([1, 2]).pdf(1)')
+        self.assertIn('scipy', loaded)
+
+    def test_no_output_on_import(self):
+        output = subprocess.check_output([sys.executable, '-c', 'import conjugate_density'], cwd=REPOSITORY_ROOT)
+        self.assertEqual(b'', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
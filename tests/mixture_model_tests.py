@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from density_model import NormalDistribution, PoissonDistribution, CategoricalDistribution
+from mixture_model import MixtureModel, MixtureStatistics
+
+
+class MixtureStatisticsTest(unittest.TestCase):
+    def _statistics(self, X, random_state):
+        responsibilities = random_state.dirichlet([1, 1, 1], size=len(X))
+        return responsibilities, MixtureStatistics.from_responsibilities(responsibilities, X, -1.5)
+
+    def _assert_close(self, s1, s2):
+        np.testing.assert_allclose(s1.get_n(), s2.get_n())
+        np.testing.assert_allclose(s1.get_mean(), s2.get_mean(), atol=1e-12)
+        np.testing.assert_allclose(s1.get_sum_square_distance(), s2.get_sum_square_distance(), atol=1e-12)
+        self.assertAlmostEqual(s1.get_log_likelihood(), s2.get_log_likelihood())
+
+    def test_merge_matches_concatenation(self):
+        random_state = np.random.RandomState(0)
+        for X in [random_state.normal(size=50), random_state.normal(size=(50, 3))]:
+            responsibilities, _ = self._statistics(X, random_state)
+            merged = MixtureStatistics.from_responsibilities(responsibilities[:20], X[:20], -1.5) \
+                     | MixtureStatistics.from_responsibilities(responsibilities[20:], X[20:], -1.5)
+            self._assert_close(MixtureStatistics.from_responsibilities(responsibilities, X, -3.0), merged)
+
+    def test_identity_and_inverse(self):
+        random_state = np.random.RandomState(1)
+        _, a = self._statistics(random_state.normal(size=30), random_state)
+        _, b = self._statistics(random_state.normal(size=20), random_state)
+        self.assertTrue(MixtureStatistics.get_identity().is_identity())
+        self.assertEqual(a, a | MixtureStatistics.get_identity())
+        self._assert_close(a, (a | b) - b)
+        self.assertTrue(np.all((a - a).get_n() == 0))
+
+    def test_serialization_round_trip(self):
+        _, a = self._statistics(np.arange(10.0), np.random.RandomState(2))
+        self.assertEqual(a, MixtureStatistics.from_bytes(a.to_bytes()))
+
+
+class MixtureModelTest(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+
+    def test_gaussian_mixture(self):
+        X = np.concatenate([self.random_state.normal(-5, 1, 3000), self.random_state.normal(5, 2, 7000)])
+        model = MixtureModel.fit(NormalDistribution, 2, X)
+        order = np.argsort([c['mean'].get_mean() for c in model.get_components()])
+        np.testing.assert_allclose([0.3, 0.7], model.get_weights()[order], atol=0.02)
+        np.testing.assert_allclose([-5, 5], [model.get_components()[k]['mean'].get_mean() for k in order],
+                                   atol=0.1)
+        np.testing.assert_allclose([1, 4], [model.get_components()[k]['variance'].get_variance() for k in order],
+                                   rtol=0.1)
+
+    def test_poisson_mixture(self):
+        X = np.concatenate([self.random_state.poisson(2, 4000), self.random_state.poisson(20, 6000)])
+        model = MixtureModel.fit(PoissonDistribution, 2, X)
+        rates = sorted(c['mean'].get_mean() for c in model.get_components())
+        np.testing.assert_allclose([2, 20], rates, rtol=0.05)
+
+    def test_categorical_mixture(self):
+        probabilities = [0.1, 0.2, 0.3, 0.4]
+        X = np.eye(4)[self.random_state.choice(4, 5000, p=probabilities)]
+        model = MixtureModel.fit(CategoricalDistribution, 2, X)
+        np.testing.assert_allclose(X.mean(axis=0), model.pdf(np.eye(4)), atol=1e-6)
+
+    def test_parallel_fit_matches_serial(self):
+        X = np.concatenate([self.random_state.normal(-2, 1, 500), self.random_state.normal(3, 1, 500)])
+        serial = MixtureModel.fit(NormalDistribution, 2, X, chunk_size=100)
+        parallel = MixtureModel.fit(NormalDistribution, 2, X, chunk_size=100, n_workers=2, executor='thread')
+        np.testing.assert_allclose(serial.get_weights(), parallel.get_weights())
+        np.testing.assert_allclose(serial.log_pdf(X), parallel.log_pdf(X))
+
+    def test_weights(self):
+        X = np.round(np.concatenate([self.random_state.normal(-4, 1, 300), self.random_state.normal(4, 1, 700)]))
+        values, counts = np.unique(X, return_counts=True)
+        expanded = MixtureModel.fit(NormalDistribution, 2, X)
+        histogram = MixtureModel.fit(NormalDistribution, 2, values, weights=counts)
+        np.testing.assert_allclose(sorted(expanded.get_weights()), sorted(histogram.get_weights()), atol=1e-6)
+        np.testing.assert_allclose(expanded.log_pdf(values), histogram.log_pdf(values), atol=1e-6)
+
+    def test_log_pdf(self):
+        components = [NormalDistribution([0.0, 1.0, 2.0]), NormalDistribution([5.0, 7.0])]
+        model = MixtureModel(components, [0.25, 0.75])
+        X = np.linspace(-2, 8, 11)
+        expected = np.log(0.25 * components[0].pdf(X) + 0.75 * components[1].pdf(X))
+        np.testing.assert_allclose(expected, model.log_pdf(X))
+        self.assertAlmostEqual(expected[0], model.log_pdf(X[0]))
+        np.testing.assert_allclose(1.0, model.predict_proba(X).sum(axis=-1))
+        self.assertEqual([0, 1], list(model.predict(np.array([1.0, 6.0]))))
+
+    def test_far_outlier(self):
+        # All weighted log densities underflow for points far from every component
+        model = MixtureModel([NormalDistribution([0.0, 1.0]), NormalDistribution([2.0, 3.0])])
+        self.assertTrue(np.isfinite(model.log_pdf(1e5)))
+        np.testing.assert_allclose(1.0, model.predict_proba(np.array([1e5, -1e5])).sum(axis=-1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+
+import numpy as np
+
+from density_model import NormalDistribution, BernoulliDistribution, CategoricalDistribution
+from naive_bayes import NaiveBayes
+
+
+class MixedNaiveBayes(NaiveBayes):
+    FEATURE_MODELS = [(NormalDistribution, [0, 1]), (BernoulliDistribution, 2), (CategoricalDistribution, [3, 4, 5])]
+
+
+def _mixed_data(random_state, size):
+    labels = random_state.choice(['a', 'b', 'c'], size=size, p=[0.2, 0.3, 0.5])
+    offsets = np.select([labels == 'a', labels == 'b'], [-2.0, 0.0], 2.0)
+    normal = random_state.normal(offsets[:, None], 1.0, size=(size, 2))
+    bernoulli = (random_state.rand(size) < np.where(labels == 'c', 0.8, 0.3)).astype(float)
+    categorical = np.eye(3)[random_state.randint(3, size=size)]
+    return np.column_stack([normal, bernoulli, categorical]), labels
+
+
+class NaiveBayesTest(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.X, self.labels = _mixed_data(self.random_state, 600)
+
+    def _assert_close(self, nb1, nb2):
+        self.assertEqual(nb1.get_classes(), nb2.get_classes())
+        np.testing.assert_allclose(nb1.predict_log_proba(self.X), nb2.predict_log_proba(self.X), atol=1e-9)
+
+    def test_against_gold(self):
+        nb = MixedNaiveBayes(self.X, self.labels)
+        self.assertEqual(['a', 'b', 'c'], nb.get_classes())
+        joint = []
+        for label in ['a', 'b', 'c']:
+            rows = self.X[self.labels == label]
+            log_likelihood = np.log(len(rows) / 600.0) + CategoricalDistribution(rows[:, 3:]).log_pdf(self.X[:, 3:])
+            for j in range(2):
+                log_likelihood += NormalDistribution(list(rows[:, j])).log_pdf(self.X[:, j])
+            log_likelihood += BernoulliDistribution(list(rows[:, 2])).log_pdf(self.X[:, 2])
+            joint.append(log_likelihood)
+        joint = np.array(joint).T
+        np.testing.assert_allclose(joint, nb.joint_log_likelihood(self.X))
+        expected = joint - np.log(np.exp(joint).sum(axis=1))[:, None]
+        np.testing.assert_allclose(expected, nb.predict_log_proba(self.X))
+        np.testing.assert_allclose(1.0, nb.predict_proba(self.X).sum(axis=1))
+        self.assertEqual(list(np.array(['a', 'b', 'c'])[joint.argmax(axis=1)]), list(nb.predict(self.X)))
+        np.testing.assert_allclose(expected[0], nb.predict_log_proba(self.X[0]))
+
+    def test_default_features(self):
+        nb = NaiveBayes(self.X[:, :2], self.labels)
+        self.assertEqual(2, len(nb.get_features()[0]['a']['mean'].get_mean()))
+        accuracy = np.mean(nb.predict(self.X[:, :2]) == self.labels)
+        self.assertGreater(accuracy, 0.6)
+
+    def test_single_row_class(self):
+        nb = NaiveBayes([[0, 1], [1, 2], [5, 5]], [0, 0, 1])
+        log_proba = nb.predict_log_proba(np.array([[0.5, 1.5], [5, 5], [4, 6]]))
+        self.assertTrue(np.all(np.isfinite(log_proba)))
+        self.assertEqual([0, 1], list(nb.predict(np.array([[0.5, 1.5], [5, 5]]))))
+        nb.update([9, 9], 2)
+        self.assertTrue(np.all(np.isfinite(nb.predict_log_proba(self.X[:5, :2]))))
+
+    def test_constant_feature(self):
+        X = np.column_stack([self.X[:, 0], np.where(self.labels == 'a', 1.0, self.X[:, 1])])
+        nb = NaiveBayes(X, self.labels)
+        log_proba = nb.predict_log_proba(X)
+        self.assertFalse(np.any(np.isnan(log_proba)))
+        np.testing.assert_allclose(1.0, np.exp(log_proba).sum(axis=1))
+        self.assertEqual(2, len(NaiveBayes(np.ones((4, 2)), [0, 1, 0, 1]).predict_log_proba(np.ones((3, 2)))[0]))
+        self.assertFalse(np.any(np.isnan(NaiveBayes(np.ones((4, 2)), [0, 1, 0, 1]).predict_log_proba(np.ones(2)))))
+
+    def test_merge_and_forget(self):
+        whole = MixedNaiveBayes(self.X, self.labels)
+        first = MixedNaiveBayes(self.X[:250], self.labels[:250])
+        second = MixedNaiveBayes(self.X[250:], self.labels[250:])
+        self._assert_close(whole, first | second)
+        self._assert_close(first, whole - second)
+        merged = MixedNaiveBayes.get_identity()
+        merged |= first
+        merged |= second
+        self._assert_close(whole, merged)
+        merged -= second
+        self._assert_close(first, merged)
+        self.assertEqual({'a', 'b', 'c'}, set(second.get_prior().get_counter()))
+
+    def test_forget_class(self):
+        nb = MixedNaiveBayes(self.X, self.labels)
+        rows = self.labels == 'a'
+        nb -= MixedNaiveBayes(self.X[rows], self.labels[rows])
+        self.assertEqual(['b', 'c'], nb.get_classes())
+        self.assertNotIn('a', set(nb.predict(self.X)))
+
+    def test_no_classes(self):
+        nb = MixedNaiveBayes(self.X[:50], self.labels[:50])
+        for empty in [MixedNaiveBayes.get_identity(), nb - nb]:
+            self.assertEqual([], empty.get_classes())
+            with self.assertRaises(ValueError):
+                empty.predict_log_proba(self.X)
+            with self.assertRaises(ValueError):
+                empty.predict(self.X[0])
+
+    def test_update(self):
+        nb = MixedNaiveBayes(self.X[:100], self.labels[:100])
+        for x, label in zip(self.X[100:150], self.labels[100:150]):
+            self.assertIs(nb, nb.update(x, label))
+        self._assert_close(MixedNaiveBayes(self.X[:150], self.labels[:150]), nb)
+
+    def test_weights(self):
+        counts = self.random_state.randint(0, 4, size=len(self.X))
+        repeated = MixedNaiveBayes(np.repeat(self.X, counts, axis=0), np.repeat(self.labels, counts))
+        self._assert_close(repeated, MixedNaiveBayes(self.X, self.labels, weights=counts))
+
+    def test_parallel_fit(self):
+        nb = MixedNaiveBayes(self.X, self.labels)
+        self._assert_close(nb, MixedNaiveBayes.fit(self.X, self.labels, chunk_size=100))
+        self._assert_close(nb, MixedNaiveBayes.fit(self.X, self.labels, n_workers=2, executor='thread'))
+        self.assertTrue(MixedNaiveBayes.fit(self.X[:0], self.labels[:0]).is_identity())
+
+    def test_serialization_round_trip(self):
+        nb = MixedNaiveBayes(self.X, self.labels)
+        decoded = MixedNaiveBayes.from_bytes(nb.to_bytes())
+        self.assertIs(MixedNaiveBayes, type(decoded))
+        self.assertEqual(nb, decoded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import algebraic_statistic
+import serialization
+from algebraic_statistic import AbstractGroupStatistic, Mean, Variance, Frequency, StatisticArray
+from density_model import NormalDistribution
+from fitting import group_fit
+
+
+class SerializationTest(unittest.TestCase):
+    def test_dispatch_on_base_class(self):
+        n = NormalDistribution([1, 2, 3, 10])
+        decoded = AbstractGroupStatistic.from_bytes(n.to_bytes())
+        self.assertIsInstance(decoded, NormalDistribution)
+        self.assertEqual(n, decoded)
+
+    def test_wrong_class(self):
+        with self.assertRaises(ValueError):
+            Variance.from_bytes(Mean([1, 2]).to_bytes())
+
+    def test_classes_with_the_same_name(self):
+        # Two statistic classes named Mean in different modules stay distinct
+        other_mean = type('Mean', (Mean,), {'__module__': 'other_module', '__slots__': ()})
+        self.addCleanup(algebraic_statistic._STATISTIC_CLASSES_BY_NAME.pop, 'other_module:Mean')
+        self.addCleanup(algebraic_statistic._STATISTIC_CLASSES_BY_QUALNAME['Mean'].pop, 'other_module')
+        m, other = Mean([1, 2]), other_mean([1, 2])
+        self.assertIs(Mean, type(AbstractGroupStatistic.from_bytes(m.to_bytes())))
+        self.assertIs(other_mean, type(AbstractGroupStatistic.from_bytes(other.to_bytes())))
+        grouped = group_fit(other_mean, [0, 1, 1], [1.0, 2.0, 3.0])
+        self.assertIs(other_mean, AbstractGroupStatistic.from_bytes(grouped.to_bytes()).statistic_cls)
+        # A bare name only decodes while a single class has it
+        self.assertIs(Variance, type(AbstractGroupStatistic.from_bytes(self._renamed(Variance([1, 2]), 'Variance'))))
+        with self.assertRaises(ValueError):
+            AbstractGroupStatistic.from_bytes(self._renamed(m, 'Mean'))
+        self.doCleanups()
+        self.assertIs(Mean, type(AbstractGroupStatistic.from_bytes(self._renamed(m, 'Mean'))))
+
+    def _renamed(self, statistic, name):
+        payload = statistic.to_bytes()[serialization.unpack_header(statistic.to_bytes())[1]:]
+        return serialization.pack_header(name) + payload
+
+    def test_bad_magic(self):
+        with self.assertRaises(ValueError):
+            Mean.from_bytes(b'XXXX' + Mean([1, 2]).to_bytes()[4:])
+
+    def test_frequency_key_kinds(self):
+        for data in [[1, 2, 2, -7], [0.5, 0.5, 2.25], ['a', 'b', 'b', u'é'], [b'x', b'yy', b'x']]:
+            f = Frequency(data)
+            self.assertEqual(f.get_counter(), Frequency.from_bytes(f.to_bytes()).get_counter())
+
+    def test_frequency_unsupported_keys(self):
+        with self.assertRaises(ValueError):
+            Frequency([(1, 2), 'a']).to_bytes()
+
+    def test_compact(self):
+        f = Frequency(np.random.randint(0, 1000, size=10000).tolist())
+        self.assertLess(len(f.to_bytes()), len(pickle.dumps(f)))
+        m = Mean([1.5, 2.5])
+        self.assertLess(len(m.to_bytes()), len(pickle.dumps(m)))
+
+    def test_grouped(self):
+        keys = np.random.randint(0, 20, size=500)
+        grouped = group_fit(Variance, keys, np.random.normal(size=500))
+        self.assertEqual(grouped, AbstractGroupStatistic.from_bytes(grouped.to_bytes()))
+
+    def test_statistic_array(self):
+        a = StatisticArray.from_statistics([Variance(np.random.normal(size=5)) for i in range(10)])
+        self.assertEqual(a, StatisticArray.from_bytes(a.to_bytes()))
+
+
+class BatchFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'batch.alg')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip_with_keys(self):
+        a = StatisticArray.from_statistics([Variance(np.random.normal(size=5)) for i in range(100)])
+        keys = np.arange(100) * 7
+        a.save(self.path, keys)
+        loaded_keys, loaded = StatisticArray.load(self.path)
+        self.assertTrue(np.array_equal(keys, loaded_keys))
+        self.assertEqual(a, loaded)
+        self.assertFalse(loaded.get_mean().flags.writeable)
+        self.assertEqual(16 + 4 * 8 * 100, os.path.getsize(self.path))
+
+    def test_loaded_arrays_merge(self):
+        a = StatisticArray.from_statistics([Variance(np.random.normal(size=5)) for i in range(10)])
+        a.save(self.path)
+        keys, loaded = StatisticArray.load(self.path)
+        self.assertIsNone(keys)
+        loaded |= a
+        self.assertTrue(np.array_equal(2 * a.get_n(), loaded.get_n()))
+
+    def test_non_numeric_keys(self):
+        a = StatisticArray.from_statistics([Variance([1, 2])])
+        with self.assertRaises(ValueError):
+            a.save(self.path, np.array(['a']))
+
+
+if __name__ == '__main__':
+    unittest.main()
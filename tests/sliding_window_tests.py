@@ -0,0 +1,120 @@
+import random
+import unittest
+
+from algebraic_statistic import AbstractGroupStatistic, Mean, Variance, Frequency
+from density_model import NormalDistribution
+from sliding_window import SlidingWindow, TimeBucketedWindow
+
+
+class Maximum(AbstractGroupStatistic):
+    # A monoid without inverses, to exercise the two-stack fallback.
+    def __init__(self, data=None):
+        self.value = max(data) if data else float('-inf')
+
+    def __or__(self, other):
+        result = Maximum()
+        result.value = max(self.value, other.value)
+        return result
+
+
+class SlidingWindowTest(unittest.TestCase):
+    def _chunks(self, n):
+        return [[random.randint(-1000, 1000) for i in range(random.randint(1, 5))] for j in range(n)]
+
+    def test_mean(self):
+        chunks = self._chunks(50)
+        window = SlidingWindow(Mean, 7)
+        for i, chunk in enumerate(chunks):
+            window.update(chunk)
+            gold = Mean(sum(chunks[max(0, i - 6):i + 1], []))
+            self.assertEqual(gold.get_n(), window.get_statistic().get_n())
+            self.assertAlmostEqual(gold.get_mean(), window.get_statistic().get_mean(), places=6)
+        self.assertEqual(7, len(window))
+
+    def test_variance(self):
+        chunks = self._chunks(30)
+        window = SlidingWindow(Variance, 5)
+        for chunk in chunks:
+            window.update(chunk)
+        gold = Variance(sum(chunks[-5:], []))
+        self.assertAlmostEqual(gold.get_variance(), window.get_statistic().get_variance(), places=6)
+
+    def test_frequency(self):
+        chunks = [[random.randint(0, 5) for i in range(3)] for j in range(30)]
+        window = SlidingWindow(Frequency, 4)
+        for chunk in chunks:
+            window.update(chunk)
+        self.assertEqual(Frequency(sum(chunks[-4:], [])).get_counter(), window.get_statistic().get_counter())
+
+    def test_density_model(self):
+        chunks = self._chunks(20)
+        window = SlidingWindow(NormalDistribution, 6)
+        for chunk in chunks:
+            window.update(chunk)
+        gold = NormalDistribution(sum(chunks[-6:], []))
+        self.assertAlmostEqual(gold['mean'].get_mean(), window.get_statistic()['mean'].get_mean(), places=6)
+        self.assertAlmostEqual(gold['variance'].get_variance(), window.get_statistic()['variance'].get_variance(),
+                               places=6)
+
+    def test_query_does_not_alias_window(self):
+        window = SlidingWindow(Mean, 2)
+        window.update([1, 2, 3])
+        snapshot = window.get_statistic()
+        snapshot |= Mean([100])
+        self.assertEqual(3, window.get_statistic().get_n())
+
+    def test_two_stack_fallback(self):
+        self.assertFalse(Maximum.is_invertible())
+        chunks = self._chunks(40)
+        window = SlidingWindow(Maximum, 6)
+        for i, chunk in enumerate(chunks):
+            window.update(chunk)
+            self.assertEqual(max(sum(chunks[max(0, i - 5):i + 1], [])), window.get_statistic().value)
+
+    def test_invalid_window(self):
+        with self.assertRaises(ValueError):
+            SlidingWindow(Mean, 0)
+
+
+class TimeBucketedWindowTest(unittest.TestCase):
+    def _events(self, n):
+        return sorted((random.uniform(0, 100), random.randint(-1000, 1000)) for i in range(n))
+
+    def _gold(self, events, now, bucket_width, n_buckets):
+        oldest_bucket = int(now // bucket_width) - n_buckets + 1
+        return [x for t, x in events if int(t // bucket_width) >= oldest_bucket and t <= now]
+
+    def test_mean(self):
+        events = self._events(500)
+        window = TimeBucketedWindow(Mean, 5.0, 4)
+        for t, x in events:
+            window.update(t, [x])
+        gold = Mean(self._gold(events, events[-1][0], 5.0, 4))
+        self.assertEqual(gold.get_n(), window.get_statistic().get_n())
+        self.assertAlmostEqual(gold.get_mean(), window.get_statistic().get_mean(), places=6)
+
+    def test_advance_expires(self):
+        window = TimeBucketedWindow(Frequency, 1.0, 3)
+        window.update(0.5, ['a'])
+        window.update(1.5, ['b'])
+        self.assertEqual({'a': 1, 'b': 1}, window.get_statistic().get_counter())
+        self.assertEqual({'b': 1}, window.get_statistic(3.2).get_counter())
+        self.assertEqual({}, window.get_statistic(100.0).get_counter())
+
+    def test_late_events(self):
+        window = TimeBucketedWindow(Mean, 1.0, 2)
+        window.update(5.5, [1])
+        self.assertTrue(window.update(4.5, [3]))
+        self.assertFalse(window.update(3.5, [100]))
+        self.assertAlmostEqual(2.0, window.get_statistic().get_mean())
+
+    def test_monoid(self):
+        events = self._events(200)
+        window = TimeBucketedWindow(Maximum, 10.0, 3)
+        for t, x in events:
+            window.update(t, [x])
+        self.assertEqual(max(self._gold(events, events[-1][0], 10.0, 3)), window.get_statistic().value)
+
+
+if __name__ == '__main__':
+    unittest.main()